@@ -1,11 +1,11 @@
 from dataclasses import dataclass
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class ActionExpr:
   """Base class for actions"""
   pass
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Atom(ActionExpr):
   atom: int | float | str
 
@@ -15,7 +15,7 @@ class Atom(ActionExpr):
   def pvars(self) -> set[str]:
     return set()
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class PatVar(ActionExpr):
   name: str
 
@@ -25,7 +25,7 @@ class PatVar(ActionExpr):
   def pvars(self) -> set[str]:
     return {self.name}
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class App(ActionExpr):
   op: str
   args: list[ActionExpr]
@@ -40,12 +40,29 @@ class App(ActionExpr):
       pvs.update(arg.pvars())
     return pvs
 
-@dataclass(frozen=True)
+# Primitive calls like [+ ?x ?y] compute a value (see prim.py). Where an eclass
+# is needed, as in (Num [+ ?x ?y]), the value is added as an atom.
+@dataclass(frozen=True, slots=True)
+class Prim(ActionExpr):
+  op: str
+  args: list[ActionExpr]
+
+  def __str__(self) -> str:
+    args = " ".join(map(str, self.args))
+    return f"[{self.op} {args}]"
+
+  def pvars(self) -> set[str]:
+    pvs = set()
+    for arg in self.args:
+      pvs.update(arg.pvars())
+    return pvs
+
+@dataclass(frozen=True, slots=True)
 class Action:
   """Base class for actions"""
   pass
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Nop(Action):
   def __str__(self) -> str:
     return f"nop"
@@ -53,7 +70,7 @@ class Nop(Action):
   def pvars(self) -> set[str]:
     return set()
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Merge(Action):
   l: ActionExpr
   r: ActionExpr
@@ -66,23 +83,21 @@ class Merge(Action):
     pvs_r = self.r.pvars()
     return pvs_l.union(pvs_r)
 
-@dataclass(frozen=True)
+# The right-hand side is a value: a literal, a pattern variable, a primitive
+# call, or a function lookup like (lo ?x).
+@dataclass(frozen=True, slots=True)
 class SetFun(Action):
   l: App
-  r: int | float | PatVar
+  r: ActionExpr
 
   def __str__(self) -> str:
     return f"{self.l} := {self.r}"
 
   def pvars(self) -> set[str]:
     pvs_l = self.l.pvars()
+    return pvs_l.union(self.r.pvars())
 
-    if isinstance(self.r, PatVar):
-      return pvs_l.union(self.r.pvars())
-    else:
-      return pvs_l
-
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Seq(Action):
   a1: Action
   a2: Action
@@ -95,6 +110,39 @@ class Seq(Action):
     pvs_a2 = self.a2.pvars()
     return pvs_a1.union(pvs_a2)
 
+# all operators and functions an action or action expression mentions
+def ops(a) -> set[str]:
+  match a:
+    case App(op, args) | Prim(op, args):
+      res = {op} if isinstance(a, App) else set()
+      for arg in args:
+        res |= ops(arg)
+      return res
+    case Merge(l, r) | SetFun(l, r):
+      return ops(l) | ops(r)
+    case Seq(a1, a2):
+      return ops(a1) | ops(a2)
+    case _:
+      return set()
+
+# rename the pattern variables of an action or action expression by m
+def rename(a, m: dict[str, str]):
+  match a:
+    case PatVar(v):
+      return PatVar(m.get(v, v))
+    case App(op, args):
+      return App(op, [rename(arg, m) for arg in args])
+    case Prim(op, args):
+      return Prim(op, [rename(arg, m) for arg in args])
+    case Merge(l, r):
+      return Merge(rename(l, m), rename(r, m))
+    case SetFun(l, r):
+      return SetFun(rename(l, m), rename(r, m))
+    case Seq(a1, a2):
+      return Seq(rename(a1, m), rename(a2, m))
+    case _:
+      return a
+
 
 #
 # PARSING
@@ -118,6 +166,7 @@ grammar = """
   ?aexpr: atom
         | patvar
         | app
+        | prim
 
   atom: SIGNED_INT                -> int_lit
       | SIGNED_FLOAT              -> float_lit
@@ -127,15 +176,19 @@ grammar = """
 
   app: "(" op aexpr* ")"
 
+  prim: "[" primop aexpr* "]"
+
   op: /[a-zA-Z_+*\\/\\-~][a-zA-Z0-9_+*\\/\\-~]*/
 
+  primop: /[a-zA-Z_+*\\/\\-~<>=!][a-zA-Z0-9_+*\\/\\-~<>=!]*/
+
   %import common.SIGNED_INT
   %import common.SIGNED_FLOAT
   %import common.WS
   %ignore WS
 """
 
-_parser = lark.Lark(grammar, start="start", parser="lalr")
+_parser = lark.Lark(grammar, start=["start", "aexpr"], parser="lalr")
 
 @lark.v_args(inline=True)
 class ActionTransformer(lark.Transformer):
@@ -157,9 +210,15 @@ class ActionTransformer(lark.Transformer):
   def patvar(self, value):
     return PatVar(str(value))
 
+  def primop(self, value):
+    return str(value)
+
   def app(self, op, *args):
     return App(op, list(args))
 
+  def prim(self, op, *args):
+    return Prim(op, list(args))
+
   def nop(self):
     return Nop()
 
@@ -167,10 +226,7 @@ class ActionTransformer(lark.Transformer):
     return Merge(l, r)
 
   def setfun(self, l, r):
-    rtyps = [int, float, PatVar]
-    if any(isinstance(r, t) for t in rtyps):
-      return SetFun(l, r)
-    raise ValueError(f"invalid setfun right-hand side {r}")
+    return SetFun(l, r)
 
   def seq(self, a1, a2):
     return Seq(a1, a2)
@@ -178,7 +234,10 @@ class ActionTransformer(lark.Transformer):
 _transformer = ActionTransformer()
 
 def parse(s: str) -> Action:
-  return _transformer.transform(_parser.parse(s))
+  return _transformer.transform(_parser.parse(s, start="start"))
+
+def parse_expr(s: str) -> ActionExpr:
+  return _transformer.transform(_parser.parse(s, start="aexpr"))
 
 #
 # TESTS
@@ -202,6 +261,26 @@ class TestActions(unittest.TestCase):
     action = parse("(+ x 0) = ?z")
     self.assertEqual(str(action), "(+ x 0) = ?z")
 
+  def test_parse_setfun(self):
+    action = parse("(lo ?x) := ?y")
+    self.assertEqual(action, SetFun(App("lo", [PatVar("?x")]), PatVar("?y")))
+    action = parse("(lo ?x) := 3")
+    self.assertEqual(action, SetFun(App("lo", [PatVar("?x")]), Atom(3)))
+
+  def test_parse_setfun_value(self):
+    action = parse("(lo ?x) := [+ (lo ?y) 1]")
+    self.assertEqual(str(action), "(lo ?x) := [+ (lo ?y) 1]")
+    self.assertEqual(action.pvars(), {"?x", "?y"})
+
+  def test_parse_prim(self):
+    action = parse("(Num [+ ?a ?b]) = ?r")
+    self.assertEqual(action, Merge(
+      App("Num", [Prim("+", [PatVar("?a"), PatVar("?b")])]),
+      PatVar("?r")))
+
+  def test_parse_expr(self):
+    self.assertEqual(parse_expr("[<= ?a 0]"), Prim("<=", [PatVar("?a"), Atom(0)]))
+
   def test_parse_seq(self):
     action = parse("nop; x = ?y")
     self.assertEqual(str(action), "nop;\nx = ?y")
@@ -0,0 +1,117 @@
+# EClass Analyses
+#
+# An analysis attaches a lattice value to every eclass, like the lo/hi interval
+# functions in demo-02.egglog. Written as rules, such analyses only propagate
+# one step per saturation iteration, since a rule has to fire again over its
+# whole table after each change. Here an analysis is given by callbacks:
+#
+#   make(op, vals)         value for an enode with operator op whose argument
+#                          classes have values vals (or None for no value);
+#                          for atoms, op is the expr.Atom and vals is empty
+#   merge(old, new)        join two values for the same eclass
+#   modify(eg, id, val)    optional, called whenever the value of eclass id
+#                          changes, and may add enodes or merge classes
+#
+# Values live in a FunTab named after the analysis, keyed by (eclass,), so they
+# are canonicalized like any other function. New enodes and merged classes go
+# on a worklist, and the values of merged classes are joined right away. When
+# an eclass value changes, only its parents (found through the class index) are
+# re-evaluated, and rebuilding keeps going until the worklist is empty.
+
+class Analysis:
+  def __init__(self, name, make, merge, modify=None):
+    self.name = name
+    self.make = make
+    self.merge = merge
+    self.modify = modify
+
+class Worklist:
+  def __init__(self):
+    self.nodes = []      # enodes (op, ids) to (re)evaluate
+    self.classes = set() # eclasses whose parents need re-evaluating
+    self.merges = []     # (winner, loser) for each union since the last pass
+
+  def __bool__(self):
+    return bool(self.nodes or self.classes or self.merges)
+
+  # called by the union-find whenever loser is absorbed by winner
+  def merge(self, winner: int, loser: int):
+    self.merges.append((winner, loser))
+
+
+import unittest
+import expr
+import egraph
+
+# lo/hi bounds, as in demo-02.egglog
+def make_interval(op, vals):
+  match op:
+    case expr.Atom(int(a)):
+      return (a, a)
+    case "+":
+      (l1, h1), (l2, h2) = vals
+      return (l1 + l2, h1 + h2)
+    case "*":
+      (l1, h1), (l2, h2) = vals
+      ps = [l1 * l2, l1 * h2, h1 * l2, h1 * h2]
+      return (min(ps), max(ps))
+  return None
+
+def merge_interval(old, new):
+  return (max(old[0], new[0]), min(old[1], new[1]))
+
+class TestAnalysis(unittest.TestCase):
+  def setUp(self):
+    self.eg = egraph.EGraph()
+    self.eg.add_analysis(Analysis("ival", make_interval, merge_interval))
+
+  def ival(self, se):
+    return self.eg.get_fun("ival", (self.eg.get_sexpr(se),))
+
+  def test_make(self):
+    self.eg.get_sexpr("(+ 1 (* 2 3))")
+    self.eg.rebuild()
+    self.assertEqual(self.ival("(+ 1 (* 2 3))"), (7, 7))
+
+  def test_one_pass(self):
+    # a deep chain converges in a single rebuild
+    e = "x"
+    for i in range(50):
+      e = f"(+ {i % 3} {e})"
+    self.eg.get_sexpr(e)
+    self.eg.set_fun("ival", (self.eg.get_sexpr("x"),), (0, 1))
+    self.eg.rebuild()
+    self.assertEqual(self.ival(e), (49, 50))
+
+  def test_no_value(self):
+    self.eg.get_sexpr("(+ x 1)")
+    self.eg.rebuild()
+    with self.assertRaises(ValueError):
+      self.ival("(+ x 1)")
+
+  def test_merge_propagates(self):
+    self.eg.get_sexpr("(* (+ x 1) 2)")
+    self.eg.set_fun("ival", (self.eg.get_sexpr("x"),), (0, 10))
+    self.eg.set_fun("ival", (self.eg.get_sexpr("y"),), (5, 20))
+    self.eg.rebuild()
+    self.assertEqual(self.ival("(* (+ x 1) 2)"), (2, 22))
+    # x = y narrows x to [5, 10], which flows up to the root
+    self.eg.uf.union(self.eg.get_sexpr("x"), self.eg.get_sexpr("y"))
+    self.eg.rebuild()
+    self.assertEqual(self.ival("(* (+ x 1) 2)"), (12, 22))
+
+  def test_modify(self):
+    # constant folding: singleton intervals are merged with their constant
+    def fold(eg, id, val):
+      if val[0] == val[1]:
+        eg.uf.union(id, eg.get_expr(expr.Atom(val[0])))
+
+    eg = egraph.EGraph()
+    eg.add_analysis(Analysis("ival", make_interval, merge_interval, fold))
+    id = eg.get_sexpr("(* (+ 1 2) (+ x 1))")
+    eg.set_fun("ival", (eg.get_sexpr("x"),), (1, 1))
+    eg.rebuild()
+    self.assertEqual(eg.uf.find(id), eg.uf.find(eg.atom[6]))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,227 @@
+# Benchmarks for building, matching, saturating and rebuilding
+#
+#   python3 bench.py [--sizes 100,200,400,800] [--workloads get_expr,query]
+#                    [--generators random,chain,sum] [--seed 0] [--out FILE]
+#
+# Each workload times one egraph operation on terms from a synthetic generator,
+# for each of the given sizes:
+#
+#   get_expr    adding the terms
+#   query       matching a few queries, after one round of nice_rules
+#   run_rules   one round of all_rules (searching and applying, no rebuild)
+#   nice_rules  one round of nice_rules
+#   rebuild     rebuilding after one round of all_rules
+#
+# Only the operation itself is timed, not setting up the egraph for it. Results
+# are printed as JSON: one record per workload, generator and size with the
+# operation count (enodes added, matches found, or enodes in the egraph, as
+# fits the workload), time, ops/sec and peak RSS, plus a scaling curve for each
+# workload and generator. The slope of a curve is the exponent k of the best fit
+# time ~ size^k, so 1 means linear scaling.
+#
+# Peak RSS is the high-water mark of the whole process up to that point, so it
+# only grows from one record to the next. Run a single workload and size for a
+# precise figure.
+
+import argparse
+import json
+import math
+import platform
+import random
+import resource
+import sys
+import time
+import expr
+import query
+import rules
+from egraph import EGraph
+
+# Generators. Each returns a list of terms with about n operators in total.
+
+OPS = ["+", "*", "-"]
+
+# random arithmetic over a few variables and small constants
+def random_term(n: int, seed: int = 0) -> list[expr.Expr]:
+  rng = random.Random(seed)
+  def leaf():
+    if rng.random() < 0.25:
+      return expr.Atom(rng.randrange(3))
+    return expr.Atom(f"x{rng.randrange(8)}")
+  def term(n):
+    if n == 0:
+      return leaf()
+    if rng.random() < 0.1:
+      return expr.App("~", [term(n - 1)])
+    l = rng.randrange(n)
+    return expr.App(rng.choice(OPS), [term(l), term(n - 1 - l)])
+  return [term(n)]
+
+# (+ 0 (* 1 (+ 2 ... x))), a single chain n deep
+def chain(n: int, seed: int = 0) -> list[expr.Expr]:
+  e = expr.Atom("x")
+  for i in range(n):
+    e = expr.App(OPS[i % 2], [expr.Atom(i % 3), e])
+  return [e]
+
+# a balanced sum of n + 1 distinct variables
+def wide_sum(n: int, seed: int = 0) -> list[expr.Expr]:
+  def term(lo, hi):
+    if lo == hi:
+      return expr.Atom(f"x{lo}")
+    mid = (lo + hi) // 2
+    return expr.App("+", [term(lo, mid), term(mid + 1, hi)])
+  return [term(0, n)]
+
+GENERATORS = {
+  "random": random_term,
+  "chain": chain,
+  "sum": wide_sum,
+}
+
+# Workloads. Each gets the terms to work on and returns the number of
+# operations done and the time they took.
+
+QUERIES = [
+  "(+ ?a ?b) = ?root",
+  "(* ?a (+ ?b ?c)) = ?root",
+  "(+ ?a (+ ?b ?c)) = ?root",
+  "(+ ?a ?a) = ?root",
+]
+
+def timed(f, *args):
+  start = time.perf_counter()
+  res = f(*args)
+  return res, time.perf_counter() - start
+
+def enodes(eg: EGraph) -> int:
+  return sum(len(t.tab) for t in eg.atab.values())
+
+def build(terms, rs=None) -> EGraph:
+  eg = EGraph()
+  for t in terms:
+    eg.get_expr(t)
+  eg.rebuild()
+  if rs is not None:
+    eg.run_rules(rs)
+    eg.rebuild()
+  return eg
+
+def bench_get_expr(terms):
+  eg = EGraph()
+  def add():
+    for t in terms:
+      eg.get_expr(t)
+  _, t = timed(add)
+  return enodes(eg), t
+
+def bench_query(terms):
+  eg = build(terms, rules.nice_rules)
+  qs = [query.parse(s) for s in QUERIES]
+  def run():
+    return sum(len(eg.query(q).substs) for q in qs)
+  return timed(run)
+
+def bench_rules(rs):
+  def bench(terms):
+    eg = build(terms)
+    _, t = timed(eg.run_rules, rs)
+    return enodes(eg), t
+  return bench
+
+def bench_rebuild(terms):
+  eg = build(terms)
+  eg.run_rules(rules.all_rules)
+  _, t = timed(eg.rebuild)
+  return enodes(eg), t
+
+WORKLOADS = {
+  "get_expr": bench_get_expr,
+  "query": bench_query,
+  "run_rules": bench_rules(rules.all_rules),
+  "nice_rules": bench_rules(rules.nice_rules),
+  "rebuild": bench_rebuild,
+}
+
+def peak_rss_kb() -> int:
+  # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return rss // 1024 if sys.platform == "darwin" else rss
+
+def run_one(workload: str, generator: str, size: int, seed: int = 0) -> dict:
+  terms = GENERATORS[generator](size, seed)
+  ops, secs = WORKLOADS[workload](terms)
+  return {
+    "workload": workload,
+    "generator": generator,
+    "size": size,
+    "ops": ops,
+    "seconds": secs,
+    "ops_per_sec": ops / secs if secs > 0 else None,
+    "peak_rss_kb": peak_rss_kb(),
+  }
+
+# least squares fit of log(seconds) against log(size)
+def slope(points: list[tuple[int, float]]) -> float | None:
+  pts = [(math.log(n), math.log(t)) for n, t in points if n > 0 and t > 0]
+  if len(pts) < 2:
+    return None
+  mx = sum(x for x, _ in pts) / len(pts)
+  my = sum(y for _, y in pts) / len(pts)
+  sxx = sum((x - mx) ** 2 for x, _ in pts)
+  if sxx == 0:
+    return None
+  return sum((x - mx) * (y - my) for x, y in pts) / sxx
+
+def run(workloads, generators, sizes, seed=0) -> dict:
+  records = [run_one(w, g, n, seed)
+             for w in workloads for g in generators for n in sizes]
+  curves = []
+  for w in workloads:
+    for g in generators:
+      pts = [(r["size"], r["seconds"]) for r in records
+             if r["workload"] == w and r["generator"] == g]
+      curves.append({
+        "workload": w,
+        "generator": g,
+        "points": pts,
+        "slope": slope(pts),
+      })
+  return {
+    "python": platform.python_version(),
+    "seed": seed,
+    "records": records,
+    "curves": curves,
+  }
+
+def names(s: str, known: dict) -> list[str]:
+  res = s.split(",")
+  for name in res:
+    if name not in known:
+      raise argparse.ArgumentTypeError(f"unknown name {name}, expected one of {', '.join(known)}")
+  return res
+
+def main(argv=None):
+  ap = argparse.ArgumentParser(description="Time egraph operations on synthetic terms.")
+  ap.add_argument("--sizes", default="100,200,400,800",
+                  type=lambda s: [int(n) for n in s.split(",")])
+  ap.add_argument("--workloads", default=",".join(WORKLOADS),
+                  type=lambda s: names(s, WORKLOADS))
+  ap.add_argument("--generators", default=",".join(GENERATORS),
+                  type=lambda s: names(s, GENERATORS))
+  ap.add_argument("--seed", default=0, type=int)
+  ap.add_argument("--out", help="write JSON here instead of to stdout")
+  args = ap.parse_args(argv)
+
+  # chains recurse once per level when adding and matching
+  sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * max(args.sizes) + 100))
+
+  res = run(args.workloads, args.generators, args.sizes, args.seed)
+  if args.out:
+    with open(args.out, "w") as f:
+      json.dump(res, f, indent=2)
+  else:
+    json.dump(res, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+  main()
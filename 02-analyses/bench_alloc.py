@@ -0,0 +1,69 @@
+# Measure allocations on the hot paths
+#
+#   python3 bench_alloc.py [copies] [substs]
+#
+# Two measurements under tracemalloc:
+#
+#   substs      build `substs` substitutions of three variables each, the way
+#               matching does (binding one variable at a time), and report the
+#               memory blocks and bytes they hold
+#   saturation  run the rule schedule of demo.py on `copies` copies of its
+#               expression (with distinct variables), and report the peak
+#               memory while saturating, plus the blocks and bytes the egraph
+#               holds at the end
+#
+# Blocks are the number of separate allocations, so fewer blocks per object
+# means fewer (and cheaper) allocations while matching.
+
+import sys
+import time
+import tracemalloc
+import subst
+import rules
+from egraph import EGraph
+
+def held(f):
+  tracemalloc.start()
+  tracemalloc.reset_peak()
+  start = time.perf_counter()
+  res = f()
+  secs = time.perf_counter() - start
+  _, peak = tracemalloc.get_traced_memory()
+  stats = tracemalloc.take_snapshot().statistics("filename")
+  tracemalloc.stop()
+  blocks = sum(s.count for s in stats)
+  size = sum(s.size for s in stats)
+  return res, blocks, size, peak, secs
+
+def substs(n):
+  res = []
+  empty = subst.Subst({})
+  for i in range(n):
+    # small ints are cached, so only the substitutions themselves are counted
+    res.append(empty.bind("?a", i % 100).bind("?b", i % 99).bind("?root", i % 98))
+  return res
+
+def saturate(copies):
+  eg = EGraph()
+  eg.get_sexpr("0")
+  eg.get_sexpr("1")
+  for i in range(copies):
+    eg.get_sexpr(f"(* (+ x{i} (~ x{i})) (+ y{i} z{i}))")
+  for rs in [rules.nice_rules, rules.all_rules, rules.nice_rules, rules.all_rules]:
+    eg.run_rules(rs)
+    eg.rebuild()
+  return eg
+
+def main(copies=50, n=100000):
+  res, blocks, size, peak, secs = held(lambda: substs(n))
+  print(f"substs      {n} substitutions: {blocks} blocks ({blocks / n:.2f} each), "
+        f"{size / n:.0f} bytes each, {secs:.3f}s")
+  del res
+
+  eg, blocks, size, peak, secs = held(lambda: saturate(copies))
+  enodes = sum(len(t.tab) for t in eg.atab.values())
+  print(f"saturation  {copies} copies, {enodes} enodes: peak {peak / 1e6:.2f} MB, "
+        f"holds {blocks} blocks, {size / 1e6:.2f} MB, {secs:.3f}s")
+
+if __name__ == "__main__":
+  main(*(int(a) for a in sys.argv[1:]))
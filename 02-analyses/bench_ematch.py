@@ -0,0 +1,54 @@
+# Compare relational matching against top-down ematching
+#
+#   python3 bench_ematch.py [size] [iters]
+#
+# Builds a sum of `size` variables, grows the egraph by running the nested
+# associativity rules and commutativity for `iters` iterations, then times both
+# matchers on a few queries and checks that they agree.
+
+import sys
+import time
+from egraph import EGraph
+import query
+import rules
+
+QUERIES = [
+  "(+ ?a ?b) = ?root",
+  "(+ ?a (+ ?b ?c)) = ?root",
+  "(+ (+ ?a ?b) (+ ?c ?d)) = ?root",
+  "(+ ?a (+ ?b (+ ?c ?d))) = ?root",
+  "(+ ?a ?a) = ?root",
+]
+
+def build(size, iters):
+  eg = EGraph()
+  e = "x0"
+  for i in range(1, size):
+    e = f"(+ x{i} {e})"
+  eg.get_sexpr(e)
+  rs = rules.assoc_rules("topdown") + [rules.add_comm]
+  for _ in range(iters):
+    eg.run_rules(rs)
+    eg.rebuild()
+  return eg
+
+def timed(f, *args):
+  start = time.perf_counter()
+  res = f(*args)
+  return res, time.perf_counter() - start
+
+def main(size=8, iters=3):
+  eg = build(size, iters)
+  nodes = sum(len(t.tab) for t in eg.atab.values())
+  print(f"egraph: {size} leaves, {iters} iterations, {nodes} enodes\n")
+
+  print(f"{'query':<36} {'matches':>8} {'relational':>11} {'top-down':>11}")
+  for s in QUERIES:
+    q = query.parse(s)
+    rel, trel = timed(eg.query, q)
+    top, ttop = timed(eg.ematch, q)
+    assert rel.substs == top.substs, s
+    print(f"{s:<36} {len(rel.substs):>8} {trel:>10.4f}s {ttop:>10.4f}s")
+
+if __name__ == "__main__":
+  main(*(int(a) for a in sys.argv[1:]))
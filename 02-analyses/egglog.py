@@ -0,0 +1,701 @@
+# Running egglog scripts
+#
+#   python3 egglog.py demo-01.egglog [more.egglog ...]
+#
+# Commands are read one at a time from the script and carried out through the
+# EGraph API. Rules and rewrites become regular rule.Rule objects, so they are
+# matched and applied exactly like the rules in rules.py. Every command is
+# timed, and a summary table is printed at the end. A command that fails (or
+# uses a feature this mini egglog does not have yet) is reported and skipped.
+#
+# Some notes on how egglog maps onto our egraph:
+#
+#   - datatype constructors are operators with AppTabs, functions are FunTabs
+#   - functions returning a datatype are eclass-valued, merged by union
+#   - primitive values (numbers, strings, rationals) are atoms, and datatypes
+#     and signatures are declared to the egraph, which checks them
+#   - pattern variables may be written ?x or just x, as in the egglog demos
+#   - a global defined by let stands for its defining term, so rules that
+#     mention a global match (or build) that term
+#   - a variable v in a primitive-sorted constructor argument, like r in
+#     (Num r), matches the atom's eclass as ?v# and its value as ?v
+#   - in queries, function calls become patterns on the function's table,
+#     (= v (+ ...)) makes v an alias, and other primitive facts are guards
+
+import copy
+import itertools
+import sys
+import time
+import lark
+
+import action
+import egraph
+import expr
+import pattern
+import prim
+import query
+import rule
+
+#
+# READING
+#
+
+class Sym(str):
+  """Symbols, as opposed to string literals."""
+  pass
+
+class Bracket(list):
+  """Bracketed lists like [+ r1 r2], which egglog uses for primitive calls."""
+  pass
+
+grammar = r"""
+  ?start: sexp
+
+  ?sexp: list
+       | bracket
+       | atom
+
+  list: "(" sexp* ")"
+  bracket: "[" sexp* "]"
+
+  atom: FLOAT  -> float_lit
+      | INT    -> int_lit
+      | ESCAPED_STRING -> str_lit
+      | SYMBOL -> symbol
+
+  FLOAT.3: /-?\d+\.\d+/
+  INT.2: /-?\d+/
+  SYMBOL: /[^\s()\[\]";]+/
+  COMMENT: /;[^\n]*/
+
+  %import common.ESCAPED_STRING
+  %import common.WS
+  %ignore WS
+  %ignore COMMENT
+"""
+
+_parser = lark.Lark(grammar, start="start", parser="lalr")
+
+@lark.v_args(inline=True)
+class SexpTransformer(lark.Transformer):
+  def list(self, *items):
+    return list(items)
+
+  def bracket(self, *items):
+    return Bracket(items)
+
+  def float_lit(self, value):
+    return float(value)
+
+  def int_lit(self, value):
+    return int(value)
+
+  def str_lit(self, value):
+    return str(value[1:-1])
+
+  def symbol(self, value):
+    return Sym(value)
+
+_transformer = SexpTransformer()
+
+def parse(s: str):
+  return _transformer.transform(_parser.parse(s))
+
+# Yield (line, text) for each top-level form without reading the whole script,
+# by tracking nesting depth, string literals, and comments character by character.
+def forms(lines):
+  buf = []
+  depth = 0
+  start = None
+  in_str = False
+  for lineno, line in enumerate(lines, 1):
+    i = 0
+    seg = 0 # where the current form starts in this line
+    while i < len(line):
+      c = line[i]
+      if in_str:
+        if c == "\\":
+          i += 1
+        elif c == '"':
+          in_str = False
+      elif c == ";":
+        break
+      elif c == '"':
+        in_str = True
+      elif c in "([":
+        if depth == 0:
+          start = lineno
+          seg = i
+        depth += 1
+      elif c in ")]":
+        depth -= 1
+        if depth == 0:
+          buf.append(line[seg:i + 1])
+          yield start, "".join(buf)
+          buf = []
+          start = None
+      i += 1
+    if start is not None:
+      buf.append(line[seg:])
+  if depth != 0:
+    raise ValueError(f"unbalanced parentheses in form starting on line {start}")
+
+#
+# INTERPRETER
+#
+
+class Unsupported(Exception):
+  """Raised for egglog features this runner does not handle (yet)."""
+  pass
+
+class CheckFailed(Exception):
+  pass
+
+class Function:
+  def __init__(self, name, arity, eclass, merge, default):
+    self.name = name
+    self.arity = arity
+    self.eclass = eclass
+    self.merge = merge
+    self.default = default
+
+class Interpreter:
+  def __init__(self, out=sys.stdout):
+    self.out = out
+    self.eg = egraph.EGraph()
+    self.datatypes: set[str] = set()
+    self.ctors: dict[str, list[str]] = {} # constructor -> argument sorts
+    self.funs: dict[str, Function] = {}
+    self.env: dict[str, object] = {} # global -> its (evaluated) defining term
+    self.rules: list[rule.Rule] = []
+    self.stack = []
+    self.fresh = itertools.count()
+    self.prim_vars: set[str] = set() # variables bound to values, per rule
+    self.aliases: dict[str, action.ActionExpr] = {} # (= v (+ ...)), per rule
+    self.timings = [] # (line, command, seconds, status)
+
+  def run_file(self, path):
+    with open(path) as f:
+      self.run_lines(f)
+
+  def run_lines(self, lines):
+    for line, text in forms(lines):
+      cmd = parse(text)
+      head = cmd[0] if isinstance(cmd, list) and cmd else cmd
+      start = time.perf_counter()
+      try:
+        self.run_command(cmd)
+        status = "ok"
+      except (Unsupported, CheckFailed, ValueError, KeyError, TypeError) as e:
+        status = type(e).__name__
+        print(f"line {line}: {status}: {e}", file=self.out)
+      self.timings.append((line, str(head), time.perf_counter() - start, status))
+
+  def summary(self):
+    lines = [f"{'line':>5}  {'command':<14} {'ms':>10}  status"]
+    for line, head, secs, status in self.timings:
+      lines.append(f"{line:>5}  {head:<14} {secs * 1000:>10.3f}  {status}")
+    total = sum(secs for _, _, secs, _ in self.timings)
+    failed = sum(1 for *_, status in self.timings if status != "ok")
+    lines.append(f"{'':>5}  {'total':<14} {total * 1000:>10.3f}  {failed} failed")
+    # how many partial matches each guard rejected
+    for r in self.rules:
+      for g, n in zip(r.query.guards, r.query.pruned):
+        lines.append(f"guard {g} pruned {n}")
+    return "\n".join(lines)
+
+  def run_command(self, cmd):
+    match cmd:
+      case [Sym("datatype"), Sym(sort), *ctors]:
+        self.datatypes.add(str(sort))
+        self.eg.add_sort(str(sort))
+        for name, *sorts in ctors:
+          self.ctors[str(name)] = [str(s) for s in sorts]
+          self.eg.add_op(str(name), self.ctors[str(name)], str(sort))
+
+      case [Sym("function"), Sym(name), list(sorts), Sym(out), *opts]:
+        self.eg.add_op(str(name), [str(s) for s in sorts], str(out))
+        self.declare_function(str(name), len(sorts), out in self.datatypes, opts)
+
+      case [Sym("let"), Sym(name), term]:
+        self.env[str(name)] = self.resolve(term)
+        self.term_id(term)
+
+      case [Sym("rewrite"), lhs, rhs]:
+        self.scope()
+        root = self.var()
+        pre, post = [], []
+        pat = self.pat(lhs, root, pre, post)
+        a = action.Merge(self.aexpr(rhs), action.PatVar(root))
+        self.add_rule(query.Query(pre + [pat] + post), a)
+
+      case [Sym("rule"), list(facts), list(actions)]:
+        q = self.query(facts)
+        a = action.Nop()
+        for act in actions:
+          a = action.Seq(a, self.action(act))
+        self.add_rule(q, a)
+
+      case [Sym("run"), int(n)]:
+        for _ in range(n):
+          self.eg.run_rules(self.rules)
+          self.eg.rebuild()
+
+      case [Sym("check"), *facts]:
+        self.check(facts)
+
+      case [Sym("fail"), inner]:
+        try:
+          self.run_command(inner)
+        except (CheckFailed, ValueError, KeyError):
+          return
+        raise CheckFailed(f"expected failure")
+
+      case [Sym("push")]:
+        self.stack.append(copy.deepcopy((self.eg, self.env, self.rules, self.funs)))
+
+      case [Sym("pop")]:
+        self.eg, self.env, self.rules, self.funs = self.stack.pop()
+
+      case [Sym("set"), [Sym(f), *args], val]:
+        ids = tuple(self.term_id(a) for a in args)
+        if self.funs[f].eclass:
+          self.eg.set_fun(str(f), ids, self.term_id(val))
+        else:
+          self.eg.set_fun(str(f), ids, self.value(val))
+
+      case [Sym("extract") | Sym("query-extract"), term]:
+        print(self.extract(term), file=self.out)
+
+      case list([Sym(_), *_]):
+        # a bare term just adds it (or looks it up for functions)
+        if cmd[0] in self.ctors:
+          self.term_id(cmd)
+        else:
+          self.value(cmd)
+
+      case _:
+        raise Unsupported(f"command {cmd}")
+
+  def declare_function(self, name, arity, eclass, opts):
+    opts = dict(zip(opts[::2], opts[1::2]))
+    merge = opts.get(":merge")
+    default = opts.get(":default")
+    if eclass:
+      if merge is not None or default is not None:
+        raise Unsupported(f"merge or default for {name}, which returns eclasses")
+      self.funs[name] = Function(name, arity, eclass, None, None)
+      self.eg.add_fun(name, "union")
+      return
+
+    def repair(old, new):
+      if merge is None:
+        if old != new:
+          raise ValueError(f"conflicting values for {name}: {old} and {new}")
+        return new
+      return self.value(merge, {"old": old, "new": new})
+
+    # use the table's built-in merges when we can
+    match merge:
+      case Sym("new"):
+        repair = "new"
+      case [Sym("max" | "min") as kind, Sym("old"), Sym("new")]:
+        repair = str(kind)
+
+    self.funs[name] = Function(name, arity, eclass, merge, default)
+    self.eg.add_fun(name, repair)
+
+  def add_rule(self, q, a):
+    self.rules.append(rule.Rule(q, a))
+
+  def var(self):
+    return f"?${next(self.fresh)}"
+
+  # variables are scoped to a rule
+  def scope(self):
+    self.prim_vars = set()
+    self.aliases = {}
+
+  def is_var(self, s):
+    return (isinstance(s, Sym)
+      and s not in self.env and s not in self.ctors and s not in self.funs)
+
+  def is_prim(self, term):
+    return (isinstance(term, list) and bool(term) and isinstance(term[0], Sym)
+      and term[0] in prim.PRIMS and term[0] not in self.ctors
+      and term[0] not in self.funs)
+
+  # replace globals by their defining terms and evaluate ground primitive calls
+  def resolve(self, sexp):
+    match sexp:
+      case Sym() if sexp in self.env:
+        return self.env[sexp]
+      case Sym() if sexp in self.ctors:
+        return [sexp]
+      case list([Sym(op), *args]) if op in self.ctors or op in self.funs:
+        return [op] + [self.resolve(a) for a in args]
+      case list([Sym(op), *args]) if self.is_prim(sexp):
+        args = [self.resolve(a) for a in args]
+        if any(isinstance(a, (list, Sym)) for a in args):
+          # left for the rule to compute
+          return Bracket([op] + args)
+        return prim.call(op, args)
+      case list() | Bracket():
+        raise Unsupported(f"expression {sexp}")
+      case _:
+        return sexp
+
+  #
+  # ground terms
+  #
+
+  def term_id(self, term) -> int:
+    term = self.resolve(term)
+    match term:
+      case Sym():
+        raise ValueError(f"unbound variable {term}")
+      case [op, *args] if op in self.ctors:
+        ids = tuple(self.term_id(a) for a in args)
+        return self.eg.get_enode(str(op), ids)
+      case list():
+        raise ValueError(f"not a constructor term {term}")
+      case _:
+        return self.eg.get_expr(expr.Atom(term))
+
+  def value(self, term, env={}):
+    if isinstance(term, Sym) and term in env:
+      return env[term]
+    match term:
+      case [Sym(f), *args] if f in self.funs:
+        ids = tuple(self.term_id(a) for a in args)
+        try:
+          return self.eg.get_fun(str(f), ids)
+        except ValueError:
+          default = self.funs[f].default
+          if default is None:
+            raise
+          val = self.value(default, env)
+          self.eg.set_fun(str(f), ids, val)
+          return val
+      case list([Sym(op), *args]) if self.is_prim(term):
+        return prim.call(op, [self.value(a, env) for a in args])
+    term = self.resolve(term)
+    if isinstance(term, (list, Sym)):
+      raise ValueError(f"not a primitive value {term}")
+    return term
+
+  def extract(self, term):
+    if self.eg.is_dirty():
+      self.eg.rebuild()
+    match term:
+      case [Sym(f), *args] if f in self.funs and self.funs[f].eclass:
+        ids = tuple(self.term_id(a) for a in args)
+        return self.eg.extract(self.eg.get_fun(str(f), ids))
+      case [Sym(f), *_] if f in self.funs:
+        return self.value(term)
+    return self.eg.extract(self.term_id(term))
+
+  #
+  # queries
+  #
+
+  # translate a term to a pattern, with vres naming its eclass; patterns for
+  # the values of primitive-sorted variables are added to post, and pre is
+  # for anything that must bind before the joins
+  def pat(self, term, vres, pre, post) -> pattern.Pat:
+    term = self.resolve(term)
+    match term:
+      case [op, *args] if op in self.ctors or op in self.funs:
+        return pattern.AppPat(str(op), self.pargs(op, args, pre, post), vres)
+      case Sym() | list():
+        raise Unsupported(f"pattern {term}")
+      case _:
+        return pattern.AtomPat(term, vres)
+
+  def pargs(self, op, args, pre, post):
+    sorts = self.ctors.get(op, [None] * len(args))
+    return [self.parg(a, pre, post, sort) for a, sort in zip(args, sorts)]
+
+  def parg(self, term, pre, post, sort=None):
+    term = self.resolve(term)
+    match term:
+      case Sym():
+        v = f"?{term.removeprefix('?')}"
+        if sort is None or sort in self.datatypes:
+          return v
+        # match the atom's eclass, and get its value after the joins
+        if v not in self.prim_vars:
+          self.prim_vars.add(v)
+          post.append(pattern.ValPat(v, v + "#"))
+        return v + "#"
+      case [op, *args] if op in self.ctors or op in self.funs:
+        return pattern.AppPat(str(op), self.pargs(op, args, pre, post), None)
+      case list():
+        raise Unsupported(f"pattern {term}")
+      case _:
+        return pattern.AtomPat(term, None)
+
+  def query(self, facts) -> query.Query:
+    self.scope()
+    pre, pats, post = [], [], []
+    guards = []
+    for fact in facts:
+      fact = self.resolve(fact)
+      match fact:
+        case [Sym("="), l, r] if self.is_var(l) and self.is_prim(r):
+          self.aliases[f"?{l.removeprefix('?')}"] = self.vexpr(r, pats)
+        case [Sym("="), l, r] if self.is_var(r) and self.is_prim(l):
+          self.aliases[f"?{r.removeprefix('?')}"] = self.vexpr(l, pats)
+        case [Sym("="), l, r] if self.is_prim(l) or self.is_prim(r):
+          guards.append(action.Prim("=", [self.vexpr(l, pats), self.vexpr(r, pats)]))
+        case [Sym("="), l, r] if self.is_var(l):
+          pats.append(self.pat(r, self.parg(l, pre, post), pre, post))
+        case [Sym("="), l, r] if self.is_var(r):
+          pats.append(self.pat(l, self.parg(r, pre, post), pre, post))
+        case [Sym("="), l, r]:
+          v = self.var()
+          pats.append(self.pat(l, v, pre, post))
+          pats.append(self.pat(r, v, pre, post))
+        case _ if self.is_prim(fact):
+          guards.append(self.vexpr(fact, pats))
+        case _:
+          pats.append(self.pat(fact, self.var(), pre, post))
+    return query.Query(pre + pats + post, guards)
+
+  def check(self, facts):
+    if self.eg.is_dirty():
+      self.eg.rebuild()
+    q = self.query(facts)
+    if not self.eg.query(q).substs:
+      raise CheckFailed(" ".join(map(sexp_str, facts)))
+
+  #
+  # actions
+  #
+
+  # an expression for an eclass
+  def aexpr(self, term) -> action.ActionExpr:
+    term = self.resolve(term)
+    match term:
+      case Sym():
+        v = f"?{term.removeprefix('?')}"
+        if v in self.aliases:
+          return self.aliases[v]
+        if v in self.prim_vars:
+          return action.PatVar(v + "#")
+        return action.PatVar(v)
+      case [op, *args] if op in self.ctors:
+        return action.App(str(op), [self.aexpr(a) for a in args])
+      case [op, *args] if op in self.funs and self.funs[op].eclass:
+        return action.App(str(op), [self.aexpr(a) for a in args])
+      case list() if self.is_prim(term):
+        # computed values become atoms
+        return self.vexpr(term)
+      case list():
+        raise Unsupported(f"action expression {term}")
+      case _:
+        return action.Atom(term)
+
+  # an expression for a primitive value; in queries (when pats is given),
+  # function calls become patterns on the function's table
+  def vexpr(self, term, pats=None) -> action.ActionExpr:
+    term = self.resolve(term)
+    match term:
+      case Sym():
+        v = f"?{term.removeprefix('?')}"
+        return self.aliases.get(v, action.PatVar(v))
+      case [op, *args] if op in self.funs and pats is not None:
+        v = self.var()
+        pre, post = [], []
+        pats.append(self.pat(term, v, pre, post))
+        pats[-1:-1] = pre
+        pats.extend(post)
+        return action.PatVar(v)
+      case [op, *args] if op in self.funs:
+        return action.App(str(op), [self.aexpr(a) for a in args])
+      case [op, *args] if self.is_prim(term):
+        return action.Prim(str(op), [self.vexpr(a, pats) for a in args])
+      case list():
+        raise Unsupported(f"value expression {sexp_str(term)}")
+      case _:
+        return action.Atom(term)
+
+  def action(self, act) -> action.Action:
+    match act:
+      case [Sym("union"), l, r]:
+        return action.Merge(self.aexpr(l), self.aexpr(r))
+      case [Sym("set"), [Sym(f), *args], val]:
+        l = action.App(str(f), [self.aexpr(a) for a in args])
+        if f in self.funs and self.funs[f].eclass:
+          return action.SetFun(l, self.aexpr(val))
+        return action.SetFun(l, self.vexpr(val))
+      case [Sym(op), *_] if op in self.ctors:
+        e = self.aexpr(act)
+        return action.Merge(e, e)
+      case _:
+        raise Unsupported(f"action {sexp_str(act)}")
+
+def sexp_str(sexp):
+  match sexp:
+    case Bracket():
+      return "[" + " ".join(map(sexp_str, sexp)) + "]"
+    case list():
+      return "(" + " ".join(map(sexp_str, sexp)) + ")"
+    case str() if not isinstance(sexp, Sym):
+      return f'"{sexp}"'
+    case _:
+      return str(sexp)
+
+
+#
+# TESTS
+#
+
+import io
+import unittest
+
+class TestReader(unittest.TestCase):
+  def test_parse(self):
+    self.assertEqual(parse('(Num [+ r1 -2] "x" 1.5) ; hi'),
+                     ["Num", ["+", "r1", -2], "x", 1.5])
+    self.assertIsInstance(parse("(a [b])")[1], Bracket)
+    self.assertIsInstance(parse("one-two"), Sym)
+    self.assertNotIsInstance(parse('"x"'), Sym)
+
+  def test_forms(self):
+    src = io.StringIO('(a (b\n c)) ; (not a form\n\n(d ")")\n')
+    self.assertEqual(list(forms(src)), [(1, "(a (b\n c))"), (4, '(d ")")')])
+    self.assertEqual(list(forms(["(a) (b\n", ")"])), [(1, "(a)"), (1, "(b\n)")])
+
+class TestInterpreter(unittest.TestCase):
+  def run_script(self, src):
+    out = io.StringIO()
+    interp = Interpreter(out)
+    interp.run_lines(io.StringIO(src))
+    return interp, out.getvalue()
+
+  DATATYPE = """
+    (datatype Math
+      (Num Rational)
+      (Var String)
+      (Add Math Math))
+  """
+
+  def test_rewrite_and_check(self):
+    interp, out = self.run_script(self.DATATYPE + """
+      (let one (Num (rational 1 1)))
+      (let two (Num (rational 2 1)))
+      (Add one two)
+      (rewrite (Add ?a ?b) (Add ?b ?a))
+      (run 1)
+      (check (= (Add two one) (Add one two)))
+    """)
+    self.assertEqual(out, "")
+    self.assertEqual([t[3] for t in interp.timings], ["ok"] * 7)
+
+  def test_check_fails(self):
+    interp, out = self.run_script(self.DATATYPE + """
+      (Add (Var "x") (Var "y"))
+      (check (= (Add (Var "y") (Var "x")) (Add (Var "x") (Var "y"))))
+      (fail (check (= (Add (Var "y") (Var "x")) (Add (Var "x") (Var "y")))))
+    """)
+    self.assertEqual([t[3] for t in interp.timings], ["ok", "ok", "CheckFailed", "ok"])
+
+  def test_push_pop(self):
+    interp, out = self.run_script(self.DATATYPE + """
+      (let zero (Num (rational 0 1)))
+      (Add (Var "x") zero)
+      (push)
+      (rewrite (Add a zero) a)
+      (run 1)
+      (check (= (Var "x") (Add (Var "x") zero)))
+      (pop)
+      (run 1)
+      (fail (check (= (Var "x") (Add (Var "x") zero))))
+    """)
+    self.assertEqual(out, "")
+
+  def test_functions(self):
+    interp, out = self.run_script(self.DATATYPE + """
+      (function lo (Math) Rational :merge (max old new))
+      (function cost (Math) i64 :default 7)
+      (let x (Var "x"))
+      (set (lo x) (rational 0 1))
+      (set (lo x) (rational 1 2))
+      (set (lo x) (rational 1 3))
+      (extract (lo x))
+      (extract (cost x))
+      (rule ((Var s)) ((set (lo (Var s)) (rational 5 1))))
+      (run 1)
+      (query-extract (lo x))
+    """)
+    self.assertEqual(out, "1/2\n7\n5\n")
+
+  def test_eclass_functions(self):
+    interp, out = self.run_script(self.DATATYPE + """
+      (function simp (Math) Math)
+      (let x (Var "x"))
+      (let y (Var "y"))
+      (set (simp x) (Add x (Num (rational 0 1))))
+      (rule ((= s (simp e))) ((set (simp e) e)))
+      (run 1)
+      (extract (simp x))
+      (check (= x (Add x (Num (rational 0 1)))))
+    """)
+    self.assertEqual(out, "(Var x)\n")
+
+  def test_sorts(self):
+    interp, out = self.run_script(self.DATATYPE + """
+      (Num 1)
+      (Add (Var "x") "y")
+      (function lo (Math) Rational :merge (max old new))
+      (function bad (Math) Nat)
+    """)
+    self.assertEqual([t[3] for t in interp.timings], ["ok", "TypeError", "TypeError", "ok", "ValueError"])
+
+  def test_extract(self):
+    interp, out = self.run_script(self.DATATYPE + """
+      (let zero (Num (rational 0 1)))
+      (let e (Add (Var "x") zero))
+      (rewrite (Add a zero) a)
+      (run 1)
+      (extract e)
+    """)
+    self.assertEqual(out, "(Var x)\n")
+
+  def test_primitives(self):
+    interp, out = self.run_script(self.DATATYPE + """
+      (function lo (Math) Rational :merge (max old new))
+      (let e (Add (Num (rational 1 1)) (Num (rational 2 1))))
+      (rewrite (Add (Num r1) (Num r2)) (Num [+ r1 r2]))
+      (rule ((Num r)) ((set (lo (Num r)) r)))
+      (rule ((= e (Add a b)) (= s (+ (lo a) (lo b))) [> s (rational 2 1)])
+            ((set (lo e) s)))
+      (run 2)
+      (check (= e (Num (rational 3 1))))
+      (extract (lo e))
+    """)
+    self.assertEqual(out, "3\n")
+
+  def test_unsupported(self):
+    interp, out = self.run_script(self.DATATYPE + """
+      (rule ((= e (Add a b))) ((Add (Var "x") (frobnicate a))))
+    """)
+    self.assertIn("Unsupported: expression", out)
+
+  def test_summary(self):
+    interp, out = self.run_script(self.DATATYPE + "(push) (pop)")
+    lines = interp.summary().splitlines()
+    self.assertEqual(len(lines), 5)
+    self.assertIn("datatype", lines[1])
+    self.assertIn("0 failed", lines[-1])
+
+if __name__ == "__main__":
+  if len(sys.argv) > 1:
+    interp = Interpreter()
+    for path in sys.argv[1:]:
+      interp.run_file(path)
+    print(interp.summary())
+    sys.exit(any(status != "ok" for *_, status in interp.timings))
+
+  unittest.main()
@@ -6,10 +6,25 @@ import query
 import action
 import rule
 import table
+import index
+import ematch
+import analysis
+import prim
+import sorts
+import events
+import stats
+import memory
+import fractions
+import io
+import itertools
+import json
+import time
 
 class EGraph:
   def __init__(self):
     self.uf = uf.UF() # union-find
+    self.uf.watchers.append(self) # before the index, see merge
+    self.index = index.Index(self.uf) # eclass -> enodes and parents
     self.atab = {} # app tables
     self.ftab = {} # fun tables
 
@@ -17,43 +32,210 @@ class EGraph:
     # children). Since they do not have arguments, atoms can never violate
     # functional dependency. Instead we'll use a single dictionary to store all
     # atoms. We will still need to make sure to canonicalize their ids during
-    # rebuilding though! Otherwise ematching may not work correctly.
-    self.atom = {}
+    # rebuilding though! Otherwise ematching may not work correctly. Atoms are
+    # kept apart by sort, so 1, 1.0 and True are different atoms.
+    self.atom = sorts.Atoms()
+
+    # and the other way around, the atoms in each eclass, so that ValPats can
+    # get at the values of atoms (rebuilt along with the atom dictionary)
+    self.atom_vals: dict[int, set] = {}
+
+    # versions of the atom dictionary, like those of the tables (see table.py)
+    self.atom_version = 0
+
+    # the versions of its reads when each rule last ran (see run_rules)
+    self.seen: dict[rule.Rule, tuple] = {}
+
+    # declared datatype sorts, operator signatures, and the sort of each eclass
+    # (see sorts.py)
+    self.datatypes: set[str] = set()
+    self.sigs: dict[str, sorts.Signature] = {}
+    self.classes = sorts.Classes(self.uf)
+
+    # eclass analyses by name, their values live in ftab (see analysis.py)
+    self.analyses = {}
+    self.worklist = analysis.Worklist()
+
+    # event callbacks, None until the first subscription (see events.py)
+    self.events = None
+
+    # what the last rebuild did (see stats.py)
+    self.rebuild_stats = stats.RebuildStats()
+
+    # checked while matching, to stop long saturation runs (see saturate.py)
+    self.token = None
+
+    # the sub-queries shared by the rules of the current run_rules
+    self.shared = None
 
   def __str__(self):
-    atoms = ""
-    for a, id in sorted(self.atom.items(), key=lambda x: str(x[0])):
-      atoms += f"{a}\t->\t{id}\n"
+    f = io.StringIO()
+    self.dump(f)
+    return f.getvalue()
 
-    atabs = ""
+  def atoms(self, sort=True):
+    # atoms can mix types, so sort on their printed form
+    if sort:
+      return sorted(self.atom.items(), key=lambda x: str(x[0]))
+    return self.atom.items()
+
+  #
+  # DUMPING
+  #
+  # Dumps stream to a file object one row at a time, so even huge egraphs can be
+  # inspected without building the whole output in memory. Sorting is optional:
+  # with sort=True each table is sorted separately (so at most one table's rows
+  # are held at once), with sort=False rows come out in table order.
+  #
+
+  def dump(self, f, format="text", sort=True):
+    match format:
+      case "text":
+        self.dump_text(f, sort)
+      case "dot":
+        self.dump_dot(f, sort)
+      case "json":
+        self.dump_json(f, sort)
+      case _:
+        raise ValueError(f"invalid dump format {format}")
+
+  def dump_text(self, f, sort=True):
+    f.write("\n===== ATOMS ======\n")
+    for a, id in self.atoms(sort):
+      f.write(f"{a}\t->\t{id}\n")
+
+    f.write("\n\n===== APP TABLES =====\n")
     for op, tab in self.atab.items():
-      atabs += f"\n{op}\n{tab}"
+      f.write(f"\n{op}\n")
+      tab.dump(f, sort)
 
-    ftabs = ""
-    for f, tab in self.ftab.items():
-      ftabs += f"\n{f}\n{tab}"
+    f.write("\n\n===== FUN TABLES =====\n")
+    for fn, tab in self.ftab.items():
+      f.write(f"\n{fn}\n")
+      tab.dump(f, sort)
+    f.write("\n")
 
-    return f"""
-===== ATOMS ======
-{atoms}
+  # Graphviz output with one cluster per eclass. Graphviz merges subgraphs that
+  # share a name, so we can reopen an eclass cluster for every enode instead of
+  # first grouping enodes by class. Edges point at an anchor node in the cluster
+  # of each argument class.
+  def dump_dot(self, f, sort=True):
+    def anchor(id):
+      return f"c{id} [shape=point style=invis]"
 
-===== APP TABLES =====
-{atabs}
+    f.write("digraph egraph {\n")
+    f.write("  compound=true\n")
 
-===== FUN TABLES =====
-{ftabs}
-"""
+    n = 0
+    for a, id in self.atoms(sort):
+      id = self.uf.find(id)
+      label = json.dumps(str(a))
+      f.write(f"  subgraph cluster_{id} {{ {anchor(id)}; n{n} [label={label}] }}\n")
+      n += 1
+
+    for op, tab in self.atab.items():
+      label = json.dumps(op)
+      for ids, id in tab.rows(sort):
+        id = self.uf.find(id)
+        f.write(f"  subgraph cluster_{id} {{ {anchor(id)}; n{n} [label={label}] }}\n")
+        for i, arg in enumerate(ids):
+          arg = self.uf.find(arg)
+          f.write(f"  n{n} -> c{arg} [lhead=cluster_{arg} label={i}]\n")
+        n += 1
+
+    # function entries are values, not enodes, so they live outside clusters
+    for fn, tab in self.ftab.items():
+      for ids, res in tab.rows(sort):
+        label = json.dumps(f"{fn} = {res}")
+        f.write(f"  n{n} [shape=box label={label}]\n")
+        for i, arg in enumerate(ids):
+          arg = self.uf.find(arg)
+          f.write(f"  n{n} -> c{arg} [lhead=cluster_{arg} label={i}]\n")
+        n += 1
+
+    f.write("}\n")
+
+  # JSON lines output, one object per atom, enode, or function entry. Values
+  # that JSON has no type for are written as {"rational": [num, den]} for
+  # rationals, and as strings otherwise.
+  def dump_json(self, f, sort=True):
+    def encode(v):
+      if isinstance(v, fractions.Fraction):
+        return {"rational": [v.numerator, v.denominator]}
+      return str(v)
+
+    for a, id in self.atoms(sort):
+      row = {"kind": "atom", "atom": a, "id": id}
+      f.write(json.dumps(row, default=encode) + "\n")
+
+    for op, tab in self.atab.items():
+      for ids, id in tab.rows(sort):
+        row = {"kind": "app", "op": op, "args": list(ids), "id": id}
+        f.write(json.dumps(row, default=encode) + "\n")
+
+    for fn, tab in self.ftab.items():
+      for ids, res in tab.rows(sort):
+        row = {"kind": "fun", "fun": fn, "args": list(ids), "res": res}
+        f.write(json.dumps(row, default=encode) + "\n")
+
+  #
+  # SORTS
+  #
+
+  def add_sort(self, name):
+    self.datatypes.add(name)
+
+  # declare the signature of an operator or function
+  def add_op(self, op, args, out):
+    for s in list(args) + [out]:
+      if s not in self.datatypes and not sorts.is_prim(s):
+        raise ValueError(f"unknown sort {s}")
+    self.sigs[op] = sorts.Signature(tuple(args), out)
 
   def get_enode(self, op, ids):
     if op not in self.atab:
-      self.atab[op] = table.AppTab(self.uf)
-    return self.atab[op].get(ids)
+      self.atab[op] = table.AppTab(self.uf, op, self.index)
+    tab = self.atab[op]
+    sig = self.sigs.get(op)
+    if sig is not None:
+      if len(ids) != len(sig.args):
+        raise TypeError(f"{op} takes {len(sig.args)} arguments, not {len(ids)}")
+      for id, s in zip(ids, sig.args):
+        self.classes.check(id, s)
+    if self.analyses and ids not in tab.tab:
+      self.worklist.nodes.append((op, ids))
+    id = tab.get(ids)
+    if sig is not None:
+      self.classes.set(id, sig.out)
+    return id
+
+  # all enodes (op, args) in eclass id with canonical args
+  def enodes(self, id):
+    res = set()
+    for op, ids in self.index.enodes(id):
+      res.add((op, tuple(self.uf.find(i) for i in ids)))
+    return res
+
+  # all enodes (op, args, res) that use eclass id as an argument
+  def parents(self, id):
+    res = set()
+    for op, ids in self.index.uses(id):
+      res.add((
+        op,
+        tuple(self.uf.find(i) for i in ids),
+        self.uf.find(self.atab[op].tab[ids])))
+    return res
 
   def get_expr(self, e):
     match e:
       case expr.Atom(a):
         if a not in self.atom:
           self.atom[a] = self.uf.mkset()
+          self.atom_vals[self.atom[a]] = {a}
+          self.atom_version += 1
+          self.classes.set(self.atom[a], sorts.of_atom(a))
+          if self.analyses:
+            self.worklist.nodes.append((e, ()))
         return self.atom[a]
 
       case expr.App(op, args):
@@ -66,6 +248,91 @@ class EGraph:
   def get_sexpr(self, se):
     return self.get_expr(expr.parse(se))
 
+  # Like get_expr, but never adds anything to the egraph. Returns the canonical
+  # eclass of e, or None as soon as some subterm is not in the egraph.
+  def lookup_expr(self, e):
+    match e:
+      case expr.Atom(a):
+        id = self.atom.get(a)
+        return None if id is None else self.uf.find(id)
+
+      case expr.App(op, args):
+        tab = self.atab.get(op)
+        if tab is None:
+          return None
+        ids = []
+        for arg in args:
+          id = self.lookup_expr(arg)
+          if id is None:
+            return None
+          ids.append(id)
+        return self.lookup_enode(op, tuple(ids))
+
+      case _:
+        raise ValueError(f"invalid expression {e}")
+
+  # the canonical eclass of the enode (op, ids), for canonical ids, or None
+  def lookup_enode(self, op, ids):
+    tab = self.atab.get(op)
+    if tab is None:
+      return None
+    id = tab.tab.get(ids)
+    if id is not None:
+      return self.uf.find(id)
+
+    # after unions, keys stay stale until the next rebuild, so look through
+    # the rows that use the first argument instead
+    if self.uf.dirty and ids:
+      for o, rids in self.index.uses(ids[0]):
+        if o == op and tuple(self.uf.find(i) for i in rids) == ids:
+          return self.uf.find(tab.tab[rids])
+    return None
+
+  def lookup_sexpr(self, se):
+    return self.lookup_expr(expr.parse(se))
+
+  # are e1 and e2 already known to be equal? (never adds anything)
+  def equiv(self, e1, e2):
+    id1 = self.lookup_expr(e1)
+    if id1 is None:
+      return False
+    return id1 == self.lookup_expr(e2)
+
+  def sequiv(self, se1, se2):
+    return self.equiv(expr.parse(se1), expr.parse(se2))
+
+  # Extraction picks a smallest term (by number of nodes) in an eclass. Costs
+  # only ever go down, so we sweep all enodes until no eclass improves.
+  def extract(self, id) -> expr.Expr:
+    best = self.best_terms()
+    try:
+      return best[self.uf.find(id)][1]
+    except KeyError:
+      raise ValueError(f"no term to extract from eclass {id}")
+
+  # the cost and a smallest term of every eclass that has one, by leader
+  def best_terms(self) -> dict[int, tuple[int, expr.Expr]]:
+    best = {}
+    for a, aid in self.atom.items():
+      best[self.uf.find(aid)] = (1, expr.Atom(a))
+
+    changed = True
+    while changed:
+      changed = False
+      for op, tab in self.atab.items():
+        for ids, eid in tab.tab.items():
+          args = [best.get(self.uf.find(i)) for i in ids]
+          if None in args:
+            continue
+          cost = 1 + sum(c for c, _ in args)
+          eid = self.uf.find(eid)
+          if eid not in best or cost < best[eid][0]:
+            best[eid] = (cost, expr.App(op, [e for _, e in args]))
+            changed = True
+    return best
+
+  # repair is a merge function (or the name of a built-in one) for primitive
+  # outputs, or "union" for functions that return eclasses
   def add_fun(self, f, repair):
     self.ftab[f] = table.FunTab(self.uf, repair)
 
@@ -90,6 +357,90 @@ class EGraph:
     except KeyError:
       raise ValueError(f"no function table for {f}")
 
+    # setting an analysis value directly must still reach the parents
+    if f in self.analyses:
+      self.worklist.classes.add(self.uf.find(ids[0]))
+
+  def add_analysis(self, a):
+    self.add_fun(a.name, a.merge)
+    self.analyses[a.name] = a
+    if self.worklist not in self.uf.watchers:
+      self.uf.watchers.append(self.worklist)
+
+    # existing enodes need values too
+    for e in self.atom:
+      self.worklist.nodes.append((expr.Atom(e), ()))
+    for op, tab in self.atab.items():
+      self.worklist.nodes.extend((op, ids) for ids in tab.tab)
+
+  # Run the worklist of every analysis to a fixpoint. This only looks at the
+  # enodes that are new or whose arguments changed value.
+  def propagate(self):
+    wl = self.worklist
+    while wl:
+      # move values from losers to winners, in union order
+      merges, wl.merges = wl.merges, []
+      for winner, loser in merges:
+        for a in self.analyses.values():
+          vals = self.ftab[a.name].tab
+          if (loser,) in vals:
+            val = vals.pop((loser,))
+            if (winner,) in vals:
+              val = a.merge(vals[(winner,)], val)
+            vals[(winner,)] = val
+            self.ftab[a.name].version += 1
+        wl.classes.add(winner)
+
+      classes, wl.classes = wl.classes, set()
+      for c in classes:
+        c = self.uf.find(c)
+        wl.nodes.extend(self.index.uses(c))
+        for a in self.analyses.values():
+          val = self.ftab[a.name].tab.get((c,))
+          if a.modify is not None and val is not None:
+            a.modify(self, c, val)
+
+      nodes, wl.nodes = wl.nodes, []
+      for op, ids in nodes:
+        for a in self.analyses.values():
+          self.analyze(a, op, ids)
+
+  def analyze(self, a, op, ids):
+    vals = self.ftab[a.name].tab
+    if isinstance(op, expr.Atom):
+      id = self.atom[op.atom]
+    else:
+      # ids is how the row was stored when it was queued, which may be before
+      # or after the last table rebuild
+      tab = self.atab[op].tab
+      id = tab.get(ids)
+      ids = tuple(self.uf.find(i) for i in ids)
+      if id is None:
+        id = tab.get(ids)
+      if id is None:
+        # re-keyed since, but then it is also queued under its new key
+        return
+
+    args = [vals.get((i,)) for i in ids]
+    if None in args:
+      return
+    val = a.make(op, args)
+    if val is None:
+      return
+
+    c = self.uf.find(id)
+    if (c,) in vals:
+      old = vals[(c,)]
+      val = a.merge(old, val)
+      if val == old:
+        return
+    vals[(c,)] = val
+    self.ftab[a.name].version += 1
+
+    if a.modify is not None:
+      a.modify(self, c, val)
+    self.worklist.nodes.extend(self.index.uses(c))
+
   def is_dirty(self):
     if self.uf.dirty:
       return True
@@ -105,40 +456,189 @@ class EGraph:
     for ft in self.ftab.values():
       ft.dirty = False
 
-  def rebuild(self):
+  # Rebuild in rounds until nothing changes. Returns what each round did,
+  # which also stays around in self.rebuild_stats.
+  def rebuild(self) -> stats.RebuildStats:
+    for _ in self.rebuild_steps():
+      pass
+    return self.rebuild_stats
+
+  # rebuild one round at a time, yielding the stats.Round of each
+  def rebuild_steps(self):
+    self.rebuild_stats = stats.RebuildStats()
+    n = 0
+    while True:
+      res = self.rebuild_round(n)
+      self.rebuild_stats.rounds.append(res)
+      yield res
+      n += 1
+      if not self.is_dirty():
+        break
+
+  def rebuild_round(self, n) -> stats.Round:
+    start = time.perf_counter()
+    res = stats.Round()
+
     # clear the dirty flags so we can detect changes
     self.clear_dirty()
 
     # canonicalize all atoms
-    for a, id in list(self.atom.items()):
-      self.atom[a] = self.uf.find(id)
+    self.atom_vals = {}
+    for a, old_id in list(self.atom.items()):
+      id = self.uf.find(old_id)
+      if id != old_id:
+        self.atom[a] = id
+        self.atom_version += 1
+        res.atoms += 1
+      self.atom_vals.setdefault(id, set()).add(a)
 
     # rebuild all app tables
-    for tab in self.atab.values():
-      tab.rebuild()
+    for op, tab in self.atab.items():
+      res.apps[op] = tab.rebuild()
 
     # rebuild all fun tables
+    for f, tab in self.ftab.items():
+      res.funs[f] = tab.rebuild()
+
+    # bring analyses up to date, which may add enodes or merge classes
+    if self.analyses:
+      self.propagate()
+
+    res.seconds = time.perf_counter() - start
+    return res
+
+  #
+  # GARBAGE COLLECTION
+  #
+  # Everything ever added stays in the egraph, even terms that were only looked
+  # at once. gc keeps just the eclasses reachable from some roots: the roots,
+  # the arguments of the enodes in reachable classes, and the outputs of eclass
+  # functions on reachable arguments. Everything else goes: enodes of other
+  # classes, their atoms, and function entries with unreachable arguments.
+  # Then the surviving classes are renumbered 0, 1, ... (in their old order),
+  # and gc returns the mapping from old to new ids, since ids held outside the
+  # egraph (including the roots) are meaningless afterwards.
+  #
+  # compact does just the renumbering, for all classes. After many unions most
+  # ids are no longer leaders, and renumbering makes the ids in use dense again.
+  #
+
+  # Renumber the leaders 0, 1, ... and return the mapping from every old id
+  # (leader or not) to its new id. Only for rebuilt egraphs, where all ids in
+  # tables and atoms are leaders.
+  def compact(self) -> dict[int, int]:
+    if self.is_dirty() or self.worklist:
+      raise ValueError("compact needs a rebuilt egraph")
+    return self.renumber([id for id, p in enumerate(self.uf.parent) if id == p])
+
+  def gc(self, roots) -> dict[int, int]:
+    self.rebuild()
+    live = self.reachable(roots)
+
+    for tab in self.atab.values():
+      tab.tab = {ids: id for ids, id in tab.tab.items() if id in live}
     for tab in self.ftab.values():
-      tab.rebuild()
+      tab.tab = {ids: res for ids, res in tab.tab.items()
+                 if all(i in live for i in ids)}
+    for s, atoms in self.atom.sorts.items():
+      self.atom.sorts[s] = {a: id for a, id in atoms.items() if id in live}
+    return self.renumber(sorted(live))
+
+  # the eclasses reachable from roots, in a rebuilt egraph
+  def reachable(self, roots) -> set[int]:
+    live = set()
+    todo = [self.uf.find(r) for r in roots]
+    efuns = [tab for tab in self.ftab.values() if tab.eclass]
+    while todo:
+      while todo:
+        c = todo.pop()
+        if c in live:
+          continue
+        live.add(c)
+        for _, ids in self.index.enodes(c):
+          todo.extend(ids)
+      # reaching all the arguments of a function entry reaches its output
+      for tab in efuns:
+        todo.extend(res for ids, res in tab.tab.items()
+                    if res not in live and all(i in live for i in ids))
+    return live
 
-    # if anything changed, we need to keep rebuilding
-    if self.is_dirty():
-      self.rebuild()
+  # Give the eclasses in leaders (ascending, and covering every id still in
+  # use) the ids 0, 1, ... in one pass over every structure that holds ids.
+  # The egraph has to be rebuilt, so that all the ids in it are leaders.
+  # Returns the new id of every old id whose class is kept.
+  def renumber(self, leaders: list[int]) -> dict[int, int]:
+    new = {old: i for i, old in enumerate(leaders)}
+    res = {}
+    for old, leader in enumerate(self.uf.leaders()):
+      if leader in new:
+        res[old] = new[leader]
 
-  def matches(self, substs, pat):
+    # a fresh union-find of singletons, keeping its watchers
+    self.uf.parent = list(range(len(leaders)))
+
+    for tab in self.atab.values():
+      tab.tab = {tuple(new[i] for i in ids): new[id] for ids, id in tab.tab.items()}
+      tab.version += 1
+    for tab in self.ftab.values():
+      if tab.eclass:
+        tab.tab = {tuple(new[i] for i in ids): new[res] for ids, res in tab.tab.items()}
+      else:
+        tab.tab = {tuple(new[i] for i in ids): res for ids, res in tab.tab.items()}
+      tab.version += 1
+
+    self.atom_vals = {}
+    for atoms in self.atom.sorts.values():
+      for a, id in atoms.items():
+        atoms[a] = new[id]
+        self.atom_vals.setdefault(new[id], set()).add(a)
+    self.atom_version += 1
+
+    self.classes.sort = {new[id]: s for id, s in self.classes.sort.items() if id in new}
+
+    self.index.nodes = {}
+    self.index.parents = {}
+    for op, tab in self.atab.items():
+      for ids, id in tab.tab.items():
+        self.index.add(op, ids, id)
+    return res
+
+  # types are the sorts of the query's variables (see sorts.infer), and out is
+  # where to put the matches (a new subst.Set by default)
+  def matches(self, substs, pat, types={}, out=None):
+    ss = subst.Set() if out is None else out
+    token = self.token
     match pat:
       case pattern.AtomPat(a, _):
         # no matches if we do not have this literal
         if a not in self.atom:
-          return subst.Set()
+          return ss
 
         # otherwise check all substitutions for this pattern
-        ss = subst.Set()
         id = self.atom[a]
         for s in substs:
+          if token is not None:
+            token.check()
           ss.add(pat.match(s, id))
         return ss
 
+      case pattern.ValPat(_, vres):
+        for s in substs:
+          if token is not None:
+            token.check()
+          if vres in s.subst:
+            # just the atoms of an already bound eclass
+            id = s.subst[vres]
+            for a in self.atom_vals.get(self.uf.find(id), ()):
+              ss.add(pat.match(s, a, id))
+          elif vres in types:
+            for a, id in self.atom.sort(types[vres][0]).items():
+              ss.add(pat.match(s, a, id))
+          else:
+            for a, id in self.atom.items():
+              ss.add(pat.match(s, a, id))
+        return ss
+
       case pattern.AppPat(op, _, _):
         # figure out which table to search
         if op in self.atab:
@@ -147,53 +647,289 @@ class EGraph:
           tab = self.ftab[op]
         else:
           # no matches if we do not have this operator or function
-          return subst.Set()
+          return ss
 
-        # otherwise check all tuples under all substitutions for this pattern
-        # database techniques can be EXTREMELY helpful here!
-        ss = subst.Set()
+        # otherwise check all tuples under all substitutions for this pattern,
+        # or just the rows the class index gives for an already bound variable
+        # (often a literal, as in (+ ?x 0) = ?root)
+        indexed = op in self.atab
+        checks = self.sort_checks(pat, types)
         for s in substs:
-          for ids, id in tab.tab.items():
-            ss.add(pat.match(s, ids, id))
+          if token is not None:
+            token.check()
+          rows = []
+          if indexed:
+            rows = [self.index.uses(s.subst[v]) for v in pat.vargs if v in s.subst]
+            if pat.vres in s.subst:
+              rows.append(self.index.enodes(s.subst[pat.vres]))
+          if not rows and checks:
+            # skip the rows with classes of the wrong sort
+            for ids, id in tab.tab.items():
+              row = ids + (id,)
+              if all(self.classes.get(row[i]) in (None, srt) for i, srt in checks):
+                ss.add(pat.match(s, ids, id))
+            continue
+          if not rows:
+            for ids, id in tab.tab.items():
+              ss.add(pat.match(s, ids, id))
+            continue
+          for o, ids in min(rows, key=len):
+            if o == op:
+              ss.add(pat.match(s, ids, tab.tab[ids]))
         return ss
 
-  def query(self, q: query.Query) -> subst.Set:
+  # For tables without a signature, the (position, sort) pairs that the rows
+  # matching pat must have, where position len(vargs) is the result.
+  def sort_checks(self, pat, types):
+    if not types or pat.op in self.sigs:
+      return []
+    checks = []
+    for i, v in enumerate(list(pat.vargs) + [pat.vres]):
+      if v in types and not types[v][1]:
+        checks.append((i, types[v][0]))
+    return checks
+
+  # the sorts of the variables of q, or None if q cannot have matches
+  def infer(self, q):
+    if not self.sigs:
+      return {}
+    values = {f for f, tab in self.ftab.items() if not tab.eclass}
+    return sorts.infer(q.flat_pats, self.sigs, values)
+
+  # With out (a subst.Sample for rules with a match limit), the matches are
+  # added to out as they are found, depth first (see stream), so that matching
+  # holds about as many substitutions as out does and can stop early.
+  #
+  # With shared (a query.Shared), the query runs in its canonical form, and
+  # the results of sub-queries it has in common with other queries are reused.
+  def query(self, q: query.Query, out=None, shared=None) -> subst.Set:
+    if shared is not None:
+      cq, names = q.canonical()
+      ss = subst.Set()
+      for s in self.join(cq, None, shared):
+        ss.add(subst.Subst({names[v]: id for v, id in s.subst.items() if names[v] not in q.fresh}))
+      return self.collect(ss, out)
+    return self.join(q, out)
+
+  def join(self, q, out=None, shared=None) -> subst.Set:
+    # nothing to do for queries that do not type check
+    types = self.infer(q)
+    if types is None:
+      return self.collect(subst.Set(), out)
+
     # initially, we only have the empty substitution
     substs = subst.Set()
     substs.add(subst.Subst({}))
 
-    # match all patterns in the query
-    for pat in q:
-      substs = self.matches(substs, pat)
+    # match all patterns in the query, filtering by each guard as soon as
+    # its variables are bound
+    bound = set()
+    pending = self.push_guards(q, substs, bound, range(len(q.guards)))
+    if out is not None:
+      return self.stream(q, substs, pending, types, out)
+
+    prefixes = q.prefixes() if shared is not None else []
+    reads = q.prefix_reads() if shared is not None else []
+    for i, pat in enumerate(q.flat_pats):
+      # reuse the matches of this prefix if another query computed them (under
+      # the same sorts for its variables), unless the tables they came from
+      # have changed since
+      key = None
+      if shared is not None and prefixes[i] in shared.keys:
+        key = (prefixes[i], tuple(sorted((v, types[v]) for v in bound | pat.pvars() if v in types)))
+        stamp = (self.uf.unions, self.read_versions(reads[i]))
+        if key in shared.results and shared.results[key][0] != stamp:
+          shared.stale += 1
+          del shared.results[key]
+        if key in shared.results:
+          shared.hits += 1
+          substs = shared.results[key][1]
+          bound |= pat.pvars()
+          pending = [j for j in pending if not q.guards[j].pvars() <= bound]
+          continue
+
+      substs = self.matches(substs, pat, types)
+      bound |= pat.pvars()
+      pending = self.push_guards(q, substs, bound, pending)
+      if key is not None:
+        shared.results[key] = (stamp, substs)
 
     # return all substitutions that make all patterns match
-    return substs
+    return self.collect(self.hide(substs, q.fresh), out)
+
+  # The join for queries with a limited out, depth first: each match of a
+  # pattern goes on to the next pattern right away (see Extend), and each
+  # complete match goes to out, so that matching holds one partial match per
+  # pattern rather than all of them, and stops as soon as out is full.
+  def stream(self, q, substs, pending, types, out):
+    if not q.flat_pats:
+      return self.collect(self.hide(substs, q.fresh), out)
+
+    # the guards to check after each pattern
+    bound = set()
+    checks = []
+    for pat in q.flat_pats:
+      bound |= pat.pvars()
+      checks.append([i for i in pending if q.guards[i].pvars() <= bound])
+      pending = [i for i in pending if i not in checks[-1]]
+
+    sink = out
+    for i in reversed(range(len(q.flat_pats))):
+      next = q.flat_pats[i + 1] if i + 1 < len(q.flat_pats) else None
+      sink = Extend(self, q, types, checks[i], next, sink)
+    try:
+      self.matches(substs, q.flat_pats[0], types, sink)
+    except subst.Full:
+      pass
+    return out
+
+  # add substs to out, as far as it goes
+  def collect(self, substs, out):
+    if out is None:
+      return substs
+    try:
+      for s in substs:
+        out.add(s)
+    except subst.Full:
+      pass
+    return out
+
+  # Evaluate the pending guards (indices into q.guards) whose variables are all
+  # in bound, removing the substitutions that fail them from substs in place
+  # and counting them in q.pruned. Returns the guards that are still pending.
+  def push_guards(self, q, substs, bound, pending):
+    rest = []
+    for i in pending:
+      g = q.guards[i]
+      if not g.pvars() <= bound:
+        rest.append(i)
+        continue
+      ss = list(substs)
+      keep = self.eval_batch(g, ss)
+      for s, ok in zip(ss, keep):
+        if not ok:
+          substs.substs.discard(s)
+          q.pruned[i] += 1
+    return rest
+
+  # hide the variables introduced by flattening nested patterns
+  def hide(self, substs, fresh):
+    if not fresh:
+      return substs
+    ss = subst.Set()
+    for s in substs:
+      ss.add(subst.Subst({v: id for v, id in s.subst.items() if v not in fresh}))
+    return ss
 
   def squery(self, s: str) -> subst.Set:
     return self.query(query.parse(s))
 
-  def do_action(self, a: action.Action, s: subst.Subst):
+  # Top-down alternative to query (see ematch.py). Each pattern runs from its
+  # candidate roots: the class its result variable is already bound to, or else
+  # every class with an enode of the right operator. Function tables are not in
+  # the class index, so patterns that mention them are matched relationally.
+  def ematch(self, q, out=None) -> subst.Set:
+    types = self.infer(q)
+    if types is None:
+      return self.collect(subst.Set(), out)
+    # our own flattening below names things differently
+    types = {v: t for v, t in types.items() if v not in q.fresh}
+
+    substs = subst.Set()
+    substs.add(subst.Subst({}))
+
+    fresh = itertools.count()
+    fresh_vars = set()
+    bound = set()
+    pending = self.push_guards(q, substs, bound, range(len(q.guards)))
+    for i, pat in enumerate(q.pats):
+      if not isinstance(pat, pattern.AppPat) or any(op in self.ftab for op in pat.ops()):
+        for p in pattern.flatten(pat, fresh):
+          fresh_vars.update(p.pvars() - pat.pvars())
+          substs = self.matches(substs, p, types)
+        bound |= pat.pvars()
+        pending = self.push_guards(q, substs, bound, pending)
+        continue
+
+      if pat.op not in self.atab:
+        return self.collect(subst.Set(), out)
+
+      # as in query, the last pattern may add straight to out
+      direct = out is not None and i == len(q.pats) - 1 and not pending and not fresh_vars
+      prog = ematch.compile(pat)
+      roots = None
+      ss = out if direct else subst.Set()
+      try:
+        for s in substs:
+          if self.token is not None:
+            self.token.check()
+          if pat.vres in s.subst:
+            cands = [s.subst[pat.vres]]
+          else:
+            if roots is None:
+              roots = self.roots(pat)
+            cands = roots
+          for root in cands:
+            for binds in prog.run(self, root):
+              s1 = s
+              for v, id in binds:
+                s1 = s1.bind(v, id)
+              ss.add(s1)
+      except subst.Full:
+        pass
+      if direct:
+        return out
+      substs = ss
+      bound |= pat.pvars()
+      pending = self.push_guards(q, substs, bound, pending)
+
+    return self.collect(self.hide(substs, fresh_vars), out)
+
+  # candidate roots for a top-down match, which for a pattern with a literal
+  # argument are just the parents of the literal
+  def roots(self, pat) -> set[int]:
+    tab = self.atab[pat.op].tab
+    atoms = pat.atoms()
+    if not atoms:
+      return {self.uf.find(id) for id in tab.values()}
+    if atoms[0] not in self.atom:
+      return set()
+    uses = self.index.uses(self.atom[atoms[0]])
+    return {self.uf.find(tab[ids]) for o, ids in uses if o == pat.op}
+
+  def sematch(self, s: str) -> subst.Set:
+    return self.ematch(query.parse(s))
+
+  # Actions may compute values with primitives. Rules evaluate those in batches
+  # ahead of time (see run_rule) and pass them in vals, keyed by the id of the
+  # expression. Anything not in vals is evaluated on the spot.
+  def do_action(self, a: action.Action, s: subst.Subst, vals={}):
     match a:
       case action.Nop():
         pass
 
       case action.Seq(a1, a2):
-        self.do_action(a1, s)
-        self.do_action(a2, s)
+        self.do_action(a1, s, vals)
+        self.do_action(a2, s, vals)
 
       case action.Merge(l, r):
-        lid = self.get_aexpr(l, s)
-        rid = self.get_aexpr(r, s)
+        lid = self.get_aexpr(l, s, vals)
+        rid = self.get_aexpr(r, s, vals)
+        # only egraphs that declare sorts refuse to merge classes of
+        # different sorts, others may well merge x with 1
+        if self.datatypes or self.sigs:
+          self.classes.check_union(lid, rid)
         self.uf.union(lid, rid)
 
       case action.SetFun(l, r):
         match l:
-          case expr.App(f, args):
-            ids = tuple(self.get_aexpr(arg, s) for arg in args)
-            if isinstance(r, pattern.PatVar):
-              self.set_fun(f, ids, s.subst[r])
-            else:
-              self.set_fun(f, ids, r)
+          case action.App(f, args) if f in self.ftab and self.ftab[f].eclass:
+            ids = tuple(self.get_aexpr(arg, s, vals) for arg in args)
+            self.set_fun(f, ids, self.get_aexpr(r, s, vals))
+
+          case action.App(f, args):
+            ids = tuple(self.get_aexpr(arg, s, vals) for arg in args)
+            self.set_fun(f, ids, self.get_aval(r, s, vals))
 
           case _:
             raise ValueError(f"invalid function expression {l}")
@@ -201,7 +937,7 @@ class EGraph:
       case _:
         raise ValueError(f"invalid action {a}")
 
-  def get_aexpr(self, ae: action.ActionExpr, s: subst.Subst) -> int:
+  def get_aexpr(self, ae: action.ActionExpr, s: subst.Subst, vals={}) -> int:
     match ae:
       case action.Atom(a):
         return self.get_expr(expr.Atom(a))
@@ -210,31 +946,365 @@ class EGraph:
         # raise KeyError if not found
         return s.subst[v]
 
+      case action.App(f, args) if f in self.ftab and self.ftab[f].eclass:
+        ids = tuple(self.get_aexpr(arg, s, vals) for arg in args)
+        return self.get_fun(f, ids)
+
       case action.App(op, args):
-        ids = tuple(self.get_aexpr(arg, s) for arg in args)
+        ids = tuple(self.get_aexpr(arg, s, vals) for arg in args)
         return self.get_enode(op, ids)
 
+      case action.Prim(_, _):
+        # computed values become atoms
+        return self.get_expr(expr.Atom(self.get_aval(ae, s, vals)))
+
       case _:
         raise ValueError(f"invalid action expression {ae}")
 
-  def run_rule(self, r: rule.Rule):
-    substs = self.query(r.query)
-    for s in substs:
-      self.do_action(r.action, s)
+  # Like get_aexpr, but never adds anything to the egraph (see lookup_expr).
+  # Returns the canonical eclass of ae under s, or None if it is not there.
+  def lookup_aexpr(self, ae: action.ActionExpr, s: subst.Subst):
+    match ae:
+      case action.Atom(a):
+        return self.lookup_expr(expr.Atom(a))
+
+      case action.PatVar(v):
+        # raise KeyError if not found
+        return self.uf.find(s.subst[v])
+
+      case action.App(f, args):
+        ids = []
+        for arg in args:
+          id = self.lookup_aexpr(arg, s)
+          if id is None:
+            return None
+          ids.append(id)
+        ids = tuple(ids)
+        if f in self.ftab and self.ftab[f].eclass:
+          id = self.ftab[f].tab.get(ids)
+          return None if id is None else self.uf.find(id)
+        return self.lookup_enode(f, ids)
+
+      case action.Prim(_, _):
+        val = self.eval_batch(ae, [s])[0]
+        return None if val is None else self.lookup_expr(expr.Atom(val))
 
-  def run_rules(self, rs: list[rule.Rule]):
+      case _:
+        raise ValueError(f"invalid action expression {ae}")
+
+  # the value (rather than eclass) of an action expression
+  def get_aval(self, ae: action.ActionExpr, s: subst.Subst, vals={}):
+    match ae:
+      case action.Atom(a):
+        return a
+
+      case action.PatVar(v):
+        return s.subst[v]
+
+      case action.Prim(_, _) | action.App(_, _):
+        if id(ae) in vals:
+          val = vals[id(ae)]
+        else:
+          val = self.eval_batch(ae, [s])[0]
+        if val is None:
+          raise ValueError(f"cannot evaluate {ae} under {s}")
+        return val
+
+      case _:
+        raise ValueError(f"invalid action expression {ae}")
+
+  # Evaluate the value of ae under every substitution in substs at once. The
+  # result has one value per substitution, with None where it is undefined.
+  def eval_batch(self, ae: action.ActionExpr, substs: list[subst.Subst]) -> list:
+    match ae:
+      case action.Atom(a):
+        return [a] * len(substs)
+
+      case action.PatVar(v):
+        return [s.subst[v] for s in substs]
+
+      case action.Prim(op, args):
+        cols = [self.eval_batch(arg, substs) for arg in args]
+        return prim.call_batch(op, cols, len(substs))
+
+      case action.App(f, args) if f in self.ftab:
+        # function lookups cannot be vectorized, but at least they are batched.
+        # Guards evaluate these while matching, so arguments that are not in
+        # the egraph make the value undefined rather than being added.
+        tab = self.ftab[f].tab
+        res = []
+        for s in substs:
+          ids = tuple(self.lookup_aexpr(arg, s) for arg in args)
+          res.append(None if None in ids else tab.get(ids))
+        if self.ftab[f].eclass:
+          res = [None if id is None else self.uf.find(id) for id in res]
+        return res
+
+      case _:
+        raise ValueError(f"not a value expression {ae}")
+
+  # the outermost value expressions of an action, which run_rule evaluates in
+  # batches before running the action for each substitution
+  def value_exprs(self, a: action.Action | action.ActionExpr) -> list:
+    match a:
+      case action.Seq(a1, a2):
+        return self.value_exprs(a1) + self.value_exprs(a2)
+      case action.Merge(l, r):
+        return self.value_exprs(l) + self.value_exprs(r)
+      case action.SetFun(action.App(f, args), r):
+        if f in self.ftab and self.ftab[f].eclass:
+          res = self.value_exprs(r)
+        elif isinstance(r, (action.Prim, action.App)):
+          res = [r]
+        else:
+          res = []
+        for arg in args:
+          res.extend(self.value_exprs(arg))
+        return res
+      case action.App(_, args):
+        res = []
+        for arg in args:
+          res.extend(self.value_exprs(arg))
+        return res
+      case action.Prim(_, _):
+        return [a]
+      case _:
+        return []
+
+  # Returns whether the rule hit its match limit.
+  def run_rule(self, r: rule.Rule) -> bool:
+    a, substs = self.search(r, self.shared)
+    self.apply(a, substs)
+    self.fired(r, substs)
+    return isinstance(substs, subst.Sample) and substs.truncated
+
+  # Find the matches of a rule, at most its match limit, and return them with
+  # the action to apply to them. With shared (relational rules without a limit
+  # only), the rule matches in its canonical form, see Rule.canonical.
+  def search(self, r: rule.Rule, shared=None):
+    out = None
+    if r.match_limit is not None:
+      out = subst.Sample(r.match_limit, r.policy, r.seed)
+      shared = None
+
+    match r.matcher:
+      case "relational" if shared is not None:
+        cq, a, fresh = r.canonical()
+        return a, self.hide(self.join(cq, None, shared), fresh)
+      case "relational":
+        substs = self.query(r.query, out)
+      case "topdown":
+        substs = self.ematch(r.query, out)
+      case _:
+        raise ValueError(f"invalid matcher {r.matcher}")
+
+    if out is not None and out.truncated:
+      r.truncated += 1
+    return r.action, substs
+
+  def apply(self, a: action.Action, substs: subst.Set):
+    # evaluate primitives for all matches at once, skipping the matches where
+    # some value is undefined
+    vexprs = self.value_exprs(a)
+    if not vexprs:
+      for s in substs:
+        self.do_action(a, s)
+      return
+
+    substs = list(substs)
+    cols = [(id(ve), self.eval_batch(ve, substs)) for ve in vexprs]
+    for i, s in enumerate(substs):
+      vals = {k: col[i] for k, col in cols}
+      if None in vals.values():
+        continue
+      self.do_action(a, s, vals)
+
+  # called after a rule applied its action to its matches, a hook for
+  # TracedEGraph
+  def fired(self, r: rule.Rule, substs: subst.Set):
+    pass
+
+  # Called by the union-find whenever loser is absorbed by winner, before the
+  # index moves the rows of loser over. Matching goes through find and the
+  # index, so the rows in or using loser may match differently even before the
+  # next rebuild, and their tables (and the atoms of loser) count as changed.
+  def merge(self, winner: int, loser: int):
+    for rows in (self.index.nodes.get(loser, ()), self.index.parents.get(loser, ())):
+      for op, _ in rows:
+        self.atab[op].version += 1
+    if loser in self.atom_vals:
+      self.atom_version += 1
+
+  # the current versions of the tables a rule reads
+  def versions(self, r: rule.Rule) -> tuple:
+    return self.read_versions(r.reads)
+
+  # the current versions of the given tables (and atoms, see query.ATOMS)
+  def read_versions(self, reads) -> tuple:
+    res = []
+    for op in sorted(reads):
+      if op == query.ATOMS:
+        res.append(self.atom_version)
+      elif op in self.atab:
+        res.append(self.atab[op].version)
+      elif op in self.ftab:
+        res.append(self.ftab[op].version)
+      else:
+        res.append(None)
+    return tuple(res)
+
+  # Run each rule, except those whose reads have not changed since they last
+  # ran here (and got all their matches), since they would find the same
+  # matches and do the same things again. Returns the rules that hit their
+  # match limit.
+  #
+  # Each rule applies its action before the next one searches, so later rules
+  # see what earlier ones added. The sub-queries that several rules have in
+  # common (like the scan of + that starts every rule about +) are matched
+  # once and reused by later rules, for as long as what they read is unchanged
+  # (see query.Shared).
+  def run_rules(self, rs: list[rule.Rule]) -> list[rule.Rule]:
+    self.shared = self.share(rs)
+    try:
+      truncated = []
+      for r in rs:
+        vs = self.versions(r)
+        if self.seen.get(r) == vs:
+          continue
+        if self.run_rule(r):
+          truncated.append(r)
+          self.seen.pop(r, None)
+        else:
+          self.seen[r] = vs
+      return truncated
+    finally:
+      self.shared = None
+
+  # run_rules one step at a time (see saturate.py): yields ("search", r,
+  # substs) after each rule searched and ("apply", r, substs) after it applied
+  # its action, and returns the rules that hit their match limit
+  def rule_steps(self, rs: list[rule.Rule]):
+    shared = self.share(rs)
+    truncated = []
     for r in rs:
-      self.run_rule(r)
+      vs = self.versions(r)
+      if self.seen.get(r) == vs:
+        continue
+      a, substs = self.search(r, shared)
+      yield "search", r, substs
+      self.apply(a, substs)
+      self.fired(r, substs)
+      if isinstance(substs, subst.Sample) and substs.truncated:
+        truncated.append(r)
+        self.seen.pop(r, None)
+      else:
+        self.seen[r] = vs
+      yield "apply", r, substs
+    return truncated
+
+  # the sub-queries that the rules about to run have in common
+  def share(self, rs: list[rule.Rule]):
+    qs = [r.query.canonical()[0] for r in rs
+          if r.matcher == "relational" and r.match_limit is None
+          and self.seen.get(r) != self.versions(r)]
+    return query.Shared(qs)
 
   def run_srule(self, sq: str, sa: str):
     r = rule.parse(sq, sa)
     self.run_rule(r)
 
+  # Estimated memory use by part, sampling the intermediate results of the
+  # given queries along the way (see memory.py).
+  def memory_report(self, queries=()) -> dict:
+    return memory.report(self, queries)
+
+  # Call fn on event (see events.py). The first subscription switches the
+  # egraph to TracedEGraph.
+  def subscribe(self, event: str, fn):
+    if self.events is None:
+      self.events = events.Bus()
+      self.uf.watchers.append(self.events)
+      for f, t in self.ftab.items():
+        events.trace_fun(t, f, self.events)
+      self.__class__ = TracedEGraph
+    self.events.subscribe(event, fn)
+
+  # Stop calling fn on event. Once nothing is subscribed, the egraph switches
+  # back to the plain methods.
+  def unsubscribe(self, event: str, fn):
+    if self.events is None:
+      raise ValueError(f"{fn} is not subscribed to {event}")
+    self.events.unsubscribe(event, fn)
+    if not self.events:
+      self.uf.watchers.remove(self.events)
+      for t in self.ftab.values():
+        events.untrace_fun(t)
+      self.events = None
+      self.__class__ = EGraph
+
+# Where EGraph.matches puts the matches of one pattern during EGraph.stream:
+# each match that passes the guards checked after this pattern goes on to
+# match the next pattern, or to out (without the variables from flattening)
+# after the last one.
+class Extend:
+  __slots__ = ("eg", "q", "types", "guards", "pat", "out")
+
+  def __init__(self, eg, q, types, guards, pat, out):
+    self.eg = eg
+    self.q = q
+    self.types = types
+    self.guards = guards
+    self.pat = pat
+    self.out = out
+
+  def add(self, s):
+    if not isinstance(s, subst.Subst):
+      return
+    for i in self.guards:
+      if not self.eg.eval_batch(self.q.guards[i], [s])[0]:
+        self.q.pruned[i] += 1
+        return
+    if self.pat is not None:
+      self.eg.matches((s,), self.pat, self.types, self.out)
+    elif self.q.fresh:
+      self.out.add(subst.Subst({v: id for v, id in s.subst.items() if v not in self.q.fresh}))
+    else:
+      self.out.add(s)
+
+# An egraph with subscribers, which reports events through self.events.
+class TracedEGraph(EGraph):
+  def get_expr(self, e):
+    if isinstance(e, expr.Atom) and e.atom not in self.atom:
+      id = super().get_expr(e)
+      self.events.emit("on_enode_added", e, (), id)
+      return id
+    return super().get_expr(e)
+
+  def get_enode(self, op, ids):
+    new = op not in self.atab or ids not in self.atab[op].tab
+    id = super().get_enode(op, ids)
+    if new:
+      self.events.emit("on_enode_added", op, ids, id)
+    return id
+
+  def add_fun(self, f, repair):
+    super().add_fun(f, repair)
+    events.trace_fun(self.ftab[f], f, self.events)
+
+  def rebuild_round(self, n):
+    res = super().rebuild_round(n)
+    self.events.emit("on_rebuild_round", n, res)
+    return res
+
+  def fired(self, r, substs):
+    self.events.emit("on_rule_fired", r, substs)
+
 
 #
 # TESTS
 #
 
+import copy
 import unittest
 
 class TestEGraph(unittest.TestCase):
@@ -255,6 +1325,75 @@ class TestEGraph(unittest.TestCase):
     self.eg.rebuild()
     self.assertEqual(self.eg.uf.find(self.eg.atom[1]), self.eg.uf.find(self.eg.atom[2]))
 
+  def test_rebuild_stats(self):
+    self.eg.get_sexpr("(+ (f 1) (f 2))")
+    self.eg.add_fun("lo", "max")
+    self.eg.set_fun("lo", (self.eg.atom[1],), 1)
+    self.eg.set_fun("lo", (self.eg.atom[2],), 2)
+    self.eg.uf.union(self.eg.atom[1], self.eg.atom[2])
+    st = self.eg.rebuild()
+    self.assertIs(st, self.eg.rebuild_stats)
+    # the f rows collide, which merges (f 1) and (f 2), and since that union
+    # makes the egraph dirty again, a second round checks that all is done
+    self.assertEqual(len(st.rounds), 2)
+    first = st.rounds[0]
+    self.assertEqual(first.atoms, 1)
+    self.assertEqual(first.apps["f"], stats.TableRound(rows=2, changed=1, unions=1))
+    self.assertEqual(first.apps["+"], stats.TableRound(rows=1, changed=1))
+    self.assertEqual(first.funs["lo"], stats.TableRound(rows=2, changed=1, repairs=1))
+    self.assertEqual(st.rounds[1].apps["f"], stats.TableRound(rows=1))
+    self.assertEqual((st.changed, st.unions, st.repairs), (3, 1, 1))
+
+  def test_gc(self):
+    keep = self.eg.get_sexpr("(+ x (* y 2))")
+    drop = self.eg.get_sexpr("(- z (* y 2))")
+    self.eg.add_fun("lo", "min")
+    self.eg.add_fun("neg", "union")
+    y = self.eg.get_sexpr("y")
+    self.eg.set_fun("lo", (y,), 0)
+    self.eg.set_fun("lo", (self.eg.get_sexpr("z"),), 0)
+    # eclass function outputs on live arguments are live too
+    self.eg.set_fun("neg", (y,), self.eg.get_sexpr("(~ w)"))
+    self.eg.uf.union(self.eg.get_sexpr("x"), self.eg.get_sexpr("(+ 0 x)"))
+
+    new = self.eg.gc([keep])
+    self.assertNotIn(drop, new)
+    self.assertEqual(set(new.values()), set(range(len(self.eg.uf.parent))))
+    self.assertEqual(self.eg.atom.get("z"), None)
+    self.assertEqual(self.eg.atab["-"].tab, {})
+    self.assertEqual(len(self.eg.ftab["lo"].tab), 1)
+    self.assertEqual(self.eg.lookup_sexpr("(+ (+ 0 x) (* y 2))"), new[keep])
+    self.assertEqual(self.eg.lookup_sexpr("(- z (* y 2))"), None)
+    self.assertEqual(self.eg.get_fun("lo", (self.eg.lookup_sexpr("y"),)), 0)
+    self.assertEqual(self.eg.get_fun("neg", (self.eg.lookup_sexpr("y"),)),
+                     self.eg.lookup_sexpr("(~ w)"))
+    self.assertEqual(self.eg.enodes(new[keep]),
+      {("+", (self.eg.lookup_sexpr("x"), self.eg.lookup_sexpr("(* y 2)")))})
+
+    # and the egraph keeps working
+    self.eg.run_rules([rule.parse("(* ?a ?b) = ?r", "(* ?b ?a) = ?r")])
+    self.eg.rebuild()
+    self.assertEqual(self.eg.lookup_sexpr("(* 2 y)"), self.eg.lookup_sexpr("(* y 2)"))
+
+  def test_compact(self):
+    ids = [self.eg.get_sexpr(f"(f {i})") for i in range(4)]
+    self.eg.uf.union(self.eg.atom[0], self.eg.atom[1])
+    self.eg.uf.union(self.eg.atom[2], self.eg.atom[3])
+    with self.assertRaises(ValueError):
+      self.eg.compact()
+    self.eg.rebuild()
+    atoms = [self.eg.atom[i] for i in range(4)]
+
+    new = self.eg.compact()
+    self.assertEqual(len(self.eg.uf.parent), 4)
+    self.assertEqual(set(new.values()), set(range(4)))
+    # non-leaders map to the new id of their leader
+    self.assertEqual(len(new), 8)
+    self.assertEqual(new[ids[0]], new[ids[1]])
+    self.assertEqual(self.eg.lookup_sexpr("(f 3)"), new[ids[2]])
+    self.assertEqual(self.eg.atab["f"].tab, {(new[atoms[0]],): new[ids[0]], (new[atoms[2]],): new[ids[2]]})
+    self.assertEqual(self.eg.enodes(new[ids[3]]), {("f", (new[atoms[3]],))})
+
   def test_query_atom(self):
     self.eg.get_sexpr("42")
     q = query.parse("42 = ?x")
@@ -295,5 +1434,456 @@ class TestEGraph(unittest.TestCase):
     })
     self.assertIn(expected_subst, substs.substs)
 
+  def test_enodes(self):
+    id = self.eg.get_sexpr("(+ 1 2)")
+    self.eg.get_sexpr("(* 1 2)")
+    self.eg.run_srule("(* ?x ?y) = ?z", "(+ ?x ?y) = ?z")
+    one, two = self.eg.atom[1], self.eg.atom[2]
+    self.assertEqual(self.eg.enodes(id), {("+", (one, two)), ("*", (one, two))})
+
+  def test_parents(self):
+    id = self.eg.get_sexpr("(+ 1 2)")
+    self.eg.get_sexpr("(~ 3)")
+    self.eg.uf.union(self.eg.atom[1], self.eg.atom[3])
+    one, two = self.eg.uf.find(self.eg.atom[1]), self.eg.atom[2]
+    neg = self.eg.atab["~"].tab[(self.eg.atom[3],)]
+    self.assertEqual(self.eg.parents(one), {("+", (one, two), id), ("~", (one,), neg)})
+    self.eg.rebuild()
+    self.assertEqual(self.eg.parents(one), {("+", (one, two), id), ("~", (one,), neg)})
+
+  def test_query_nested(self):
+    self.eg.get_sexpr("(+ 1 (+ 2 3))")
+    substs = self.eg.squery("(+ ?a (+ ?b ?c)) = ?root")
+    self.assertEqual(len(substs.substs), 1)
+    (s,) = substs
+    self.assertEqual(s.subst["?b"], self.eg.atom[2])
+
+  def test_ematch_matches_query(self):
+    self.eg.get_sexpr("(+ 1 (+ 2 (+ 3 1)))")
+    self.eg.get_sexpr("(* (+ 1 1) (+ 2 2))")
+    for q in [
+      "(+ ?a ?b) = ?root",
+      "(+ ?a (+ ?b ?c)) = ?root",
+      "(+ ?a ?a) = ?root",
+      "(* (+ ?a ?a) (+ ?b ?b)) = ?root",
+      "(+ ?a ?r) = ?root\n(+ ?b ?c) = ?r",
+      "1 = ?one\n(+ ?one ?x) = ?root",
+      "(- ?a ?b) = ?root",
+    ]:
+      self.assertEqual(self.eg.sematch(q).substs, self.eg.squery(q).substs, q)
+
+  def test_ematch_funtab_fallback(self):
+    self.eg.get_sexpr("(+ 1 2)")
+    self.eg.add_fun("lo", max)
+    self.eg.set_fun("lo", (self.eg.atom[1],), 1)
+    q = "(+ ?a ?b) = ?root\n(lo ?a) = ?l"
+    self.assertEqual(len(self.eg.sematch(q).substs), 1)
+    self.assertEqual(self.eg.sematch(q).substs, self.eg.squery(q).substs)
+    q = "(lo ?a) = ?l\n(+ (lo ?a) ?b) = ?x"
+    self.assertEqual(self.eg.sematch(q).substs, self.eg.squery(q).substs)
+
+  def test_ematch_unrebuilt(self):
+    self.eg.get_sexpr("(+ 1 (+ 2 3))")
+    self.eg.uf.union(self.eg.atom[1], self.eg.atom[3])
+    # top-down matching sees through unions without rebuilding first
+    substs = self.eg.sematch("(+ ?a (+ ?b ?a)) = ?root")
+    self.assertEqual(len(substs.substs), 1)
+
+  def test_run_rule_topdown(self):
+    self.eg.get_sexpr("(+ 1 (+ 2 3))")
+    r = rule.parse("(+ ?a (+ ?b ?c)) = ?root", "(+ (+ ?a ?b) ?c) = ?root", "topdown")
+    self.eg.run_rule(r)
+    self.eg.rebuild()
+    self.assertEqual(self.eg.get_sexpr("(+ (+ 1 2) 3)"), self.eg.get_sexpr("(+ 1 (+ 2 3))"))
+
+  def test_lookup_expr(self):
+    id = self.eg.get_sexpr("(+ 1 (~ 2))")
+    before = str(self.eg)
+    self.assertEqual(self.eg.lookup_sexpr("(+ 1 (~ 2))"), id)
+    self.assertIsNone(self.eg.lookup_sexpr("(+ 1 (~ 3))"))
+    self.assertIsNone(self.eg.lookup_sexpr("(* 1 2)"))
+    self.assertIsNone(self.eg.lookup_sexpr("(+ 2 1)"))
+    self.assertEqual(str(self.eg), before)
+    self.assertEqual(len(self.eg.uf.parent), 4)
+
+  def test_lookup_expr_unrebuilt(self):
+    id = self.eg.get_sexpr("(+ 1 (~ 2))")
+    self.eg.uf.union(self.eg.atom[2], self.eg.get_sexpr("3"))
+    self.assertEqual(self.eg.lookup_sexpr("(+ 1 (~ 3))"), self.eg.uf.find(id))
+    self.eg.rebuild()
+    self.assertEqual(self.eg.lookup_sexpr("(+ 1 (~ 3))"), self.eg.uf.find(id))
+
+  def test_equiv(self):
+    self.eg.get_sexpr("(+ x 0)")
+    self.eg.get_sexpr("(+ 0 x)")
+    self.assertFalse(self.eg.sequiv("(+ x 0)", "(+ 0 x)"))
+    self.assertFalse(self.eg.sequiv("(+ x 0)", "(+ y 0)"))
+    self.eg.run_srule("(+ ?a ?b) = ?r", "(+ ?b ?a) = ?r")
+    self.assertTrue(self.eg.sequiv("(+ x 0)", "(+ 0 x)"))
+    self.assertFalse(self.eg.sequiv("y", "y"))
+
+  def test_extract(self):
+    id = self.eg.get_sexpr("(+ (* x 1) (+ 0 y))")
+    self.eg.uf.union(self.eg.get_sexpr("(* x 1)"), self.eg.get_sexpr("x"))
+    self.eg.uf.union(self.eg.get_sexpr("(+ 0 y)"), self.eg.get_sexpr("y"))
+    self.eg.rebuild()
+    self.assertEqual(str(self.eg.extract(id)), "(+ x y)")
+
+  def test_run_setfun(self):
+    self.eg.get_sexpr("(+ 1 2)")
+    self.eg.add_fun("size", max)
+    self.eg.run_srule("(+ ?a ?b) = ?r", "(size ?r) := 3")
+    self.eg.run_srule("(+ ?a ?b) = ?r", "(size ?a) := ?r")
+    self.assertEqual(self.eg.get_efun(expr.parse("(size (+ 1 2))")), 3)
+    self.assertEqual(self.eg.get_efun(expr.parse("(size 1)")), self.eg.get_sexpr("(+ 1 2)"))
+
+  def test_query_val(self):
+    self.eg.get_sexpr("(Num 3)")
+    substs = self.eg.squery("(Num ?x) = ?e\n?v = ?x")
+    self.assertEqual(substs.substs, {subst.Subst({"?x": self.eg.atom[3], "?v": 3, "?e": 1})})
+    self.assertEqual(self.eg.sematch("(Num ?x) = ?e\n?v = ?x").substs, substs.substs)
+
+  def test_query_guard(self):
+    self.eg.get_sexpr("(+ 1 2)")
+    self.eg.get_sexpr("(+ 2 1)")
+    substs = self.eg.squery("(+ ?a ?b) = ?r\n?x = ?a\n?y = ?b\n[< ?x ?y]")
+    self.assertEqual({s.subst["?x"] for s in substs}, {1})
+    self.assertEqual(self.eg.sematch("(+ ?a ?b) = ?r\n?x = ?a\n?y = ?b\n[< ?x ?y]").substs, substs.substs)
+
+  def test_query_guard_lookup(self):
+    self.eg.add_fun("lo", "max")
+    self.eg.get_sexpr("(Num 1)")
+    q = "(Num ?x) = ?r\n[> (lo (Num 3)) 0]"
+    self.assertEqual(len(self.eg.squery(q).substs), 0)
+    self.assertIsNone(self.eg.lookup_sexpr("(Num 3)"))
+    self.eg.set_fun("lo", (self.eg.get_sexpr("(Num 3)"),), 1)
+    self.assertEqual(len(self.eg.squery(q).substs), 2)
+
+  def test_query_literal(self):
+    self.eg.get_sexpr("(+ x 0)")
+    self.eg.get_sexpr("(+ 0 y)")
+    self.eg.get_sexpr("(+ x y)")
+    for m in (self.eg.squery, self.eg.sematch):
+      substs = m("(+ ?a 0) = ?r")
+      self.assertEqual({s.subst["?a"] for s in substs}, {self.eg.atom["x"]})
+      self.assertEqual(m("(+ ?a 1) = ?r").substs, set())
+
+  def test_typed_atoms(self):
+    ids = {self.eg.get_expr(expr.Atom(a)) for a in (1, 1.0, True)}
+    self.assertEqual(len(ids), 3)
+    self.assertEqual(self.eg.lookup_expr(expr.Atom(1.0)), self.eg.atom[1.0])
+
+  def test_signatures(self):
+    self.eg.add_sort("Math")
+    self.eg.add_op("Num", ["i64"], "Math")
+    self.eg.add_op("Add", ["Math", "Math"], "Math")
+    with self.assertRaises(ValueError):
+      self.eg.add_op("Sub", ["Math", "Nat"], "Math")
+    one = self.eg.get_sexpr("(Num 1)")
+    self.assertEqual(self.eg.classes.get(one), "Math")
+    self.eg.get_sexpr("(Add (Num 1) (Num 2))")
+    with self.assertRaises(TypeError):
+      self.eg.get_sexpr("(Add 1 (Num 2))")
+    with self.assertRaises(TypeError):
+      self.eg.get_sexpr("(Num 1.5)")
+    with self.assertRaises(TypeError):
+      self.eg.run_srule("(Num ?x) = ?r", "?x = ?r")
+
+  def test_untyped_merge(self):
+    self.eg.get_sexpr("(eq x 1)")
+    self.eg.run_rules([rule.parse("(eq ?a ?b) = ?r", "?a = ?b")])
+    self.eg.rebuild()
+    self.assertTrue(self.eg.sequiv("x", "1"))
+
+  def test_query_sorts(self):
+    self.eg.add_sort("Math")
+    self.eg.add_op("Num", ["i64"], "Math")
+    self.eg.add_op("lo", ["Math"], "i64")
+    self.eg.add_fun("lo", "max")
+    n = self.eg.get_sexpr("(Num 1)")
+    self.eg.set_fun("lo", (n,), 0)
+    # the untyped f table has rows with atoms and with Math classes
+    self.eg.get_sexpr("(f (Num 1))")
+    self.eg.get_sexpr("(f 3)")
+    for m in (self.eg.squery, self.eg.sematch):
+      self.assertEqual(len(m("(f ?a) = ?r").substs), 2)
+      self.assertEqual(len(m("(f ?a) = ?r\n(Num ?x) = ?a").substs), 1)
+      # the value of lo is not an atom class, whatever its id happens to be
+      self.assertEqual(m("(lo ?e) = ?v\n(Num ?v) = ?n").substs, set())
+
+  def test_eclass_fun(self):
+    # an eclass-valued function, merged by congruence rather than repaired
+    self.eg.add_fun("simp", "union")
+    x, y = self.eg.get_sexpr("x"), self.eg.get_sexpr("y")
+    self.eg.set_fun("simp", (x,), self.eg.get_sexpr("(+ x 0)"))
+    self.eg.set_fun("simp", (y,), self.eg.get_sexpr("(+ y 0)"))
+    self.eg.uf.union(x, y)
+    self.eg.rebuild()
+    self.assertTrue(self.eg.sequiv("(+ x 0)", "(+ y 0)"))
+    self.assertEqual(self.eg.get_fun("simp", (self.eg.uf.find(y),)), self.eg.lookup_sexpr("(+ x 0)"))
+
+  def test_eclass_fun_rule(self):
+    self.eg.add_fun("simp", "union")
+    self.eg.get_sexpr("(+ x 0)")
+    self.eg.run_srule("(+ ?a 0) = ?r", "(simp ?r) := ?a")
+    self.eg.run_srule("(+ ?a 0) = ?r", "(simp ?r) := (* ?a 1)")
+    self.eg.rebuild()
+    self.assertTrue(self.eg.sequiv("x", "(* x 1)"))
+    self.assertEqual(self.eg.squery("(simp ?r) = ?s\nx = ?s").substs,
+                     {subst.Subst({"?r": self.eg.lookup_sexpr("(+ x 0)"), "?s": self.eg.atom["x"]})})
+
+  def test_skip_unchanged(self):
+    ran = []
+    run_rule = self.eg.run_rule
+    self.eg.run_rule = lambda r: ran.append(r) or run_rule(r)
+    comm = rule.parse("(+ ?a ?b) = ?r", "(+ ?b ?a) = ?r")
+    other = rule.parse("(* ?a ?b) = ?r", "(* ?b ?a) = ?r")
+    self.eg.get_sexpr("(+ x (* y z))")
+    for _ in range(3):
+      self.eg.run_rules([comm, other])
+      self.eg.rebuild()
+    # both add a row the first time, and find nothing new the second time
+    self.assertEqual(ran, [comm, other, comm, other])
+    self.eg.get_sexpr("(+ y x)")
+    self.eg.run_rules([comm, other])
+    self.assertEqual(ran[4:], [comm])
+
+  def test_shared_after_apply(self):
+    self.eg.add_fun("lo", "max")
+    self.eg.add_fun("hi", "max")
+    comm = rule.parse("(+ ?a ?b) = ?r", "(+ ?b ?a) = ?r")
+    lo = rule.parse("(+ ?a ?b) = ?r", "(lo ?a) := 1")
+    hi = rule.parse("(+ ?a ?b) = ?r", "(hi ?b) := 1")
+    self.eg.get_sexpr("(+ x y)")
+    shares = []
+    share = self.eg.share
+    self.eg.share = lambda rs: shares.append(share(rs)) or shares[-1]
+    self.eg.run_rules([comm, lo, hi])
+    # lo sees the row comm added, and hi reuses the matches of lo
+    self.assertEqual(len(self.eg.ftab["lo"].tab), 2)
+    self.assertEqual(len(self.eg.ftab["hi"].tab), 2)
+    self.assertEqual((shares[0].stale, shares[0].hits), (1, 1))
+
+  def test_skip_unchanged_union(self):
+    # top-down matching goes through find, so a union changes what matches
+    # even before a rebuild, and the rule runs again
+    self.eg.get_sexpr("(f a)")
+    gb = self.eg.get_sexpr("(g b)")
+    r = rule.parse("(f (g ?x)) = ?r", "(h ?x) = ?r", "topdown")
+    self.eg.run_rules([r])
+    self.assertIsNone(self.eg.lookup_sexpr("(h b)"))
+    self.eg.uf.union(self.eg.atom["a"], gb)
+    self.eg.run_rules([r])
+    self.assertIsNotNone(self.eg.lookup_sexpr("(h b)"))
+
+  def test_skip_unchanged_fun(self):
+    # the action reads lo, so a new lo value reruns the rule
+    self.eg.add_fun("lo", "max")
+    self.eg.add_fun("hi", "max")
+    r = rule.parse("(+ ?a ?b) = ?r", "(hi ?r) := [+ (lo ?a) (lo ?b)]")
+    self.eg.get_sexpr("(+ x y)")
+    x, y = self.eg.atom["x"], self.eg.atom["y"]
+    self.eg.set_fun("lo", (x,), 1)
+    self.eg.run_rules([r])
+    self.assertEqual(self.eg.ftab["hi"].tab, {})
+    self.eg.set_fun("lo", (y,), 2)
+    self.eg.run_rules([r])
+    self.assertEqual(self.eg.get_efun(expr.parse("(hi (+ x y))")), 3)
+
+  def test_match_limit(self):
+    for i in range(10):
+      self.eg.get_sexpr(f"(Num {i})")
+    self.eg.add_fun("seen", "new")
+    for matcher in rule.MATCHERS:
+      for policy in subst.POLICIES:
+        eg = copy.deepcopy(self.eg)
+        r = rule.parse("(Num ?x) = ?r", "(seen ?r) := 1", matcher, match_limit=3, policy=policy)
+        self.assertEqual(eg.run_rules([r]), [r])
+        self.assertEqual(len(eg.ftab["seen"].tab), 3, (matcher, policy))
+        self.assertEqual(r.truncated, 1)
+
+  def test_match_limit_nested(self):
+    e = "x0"
+    for i in range(1, 30):
+      e = f"(+ x{i} {e})"
+    self.eg.get_sexpr(e)
+    # the sizes of the substitution sets that matching builds
+    sizes = []
+    matches = self.eg.matches
+    def spy(substs, pat, types={}, out=None):
+      if isinstance(substs, subst.Set):
+        sizes.append(len(substs.substs))
+      return matches(substs, pat, types, out)
+    self.eg.matches = spy
+    r = rule.parse("(+ ?a (+ ?b ?c)) = ?r", "(+ (+ ?a ?b) ?c) = ?r", match_limit=3)
+    self.assertEqual(self.eg.run_rules([r]), [r])
+    self.assertLessEqual(max(sizes), 3)
+    self.assertEqual(len(self.eg.atab["+"].tab), 29 + 6)
+
+  def test_match_limit_guard(self):
+    for i in range(10):
+      self.eg.get_sexpr(f"(Num {i})")
+    self.eg.add_fun("seen", "new")
+    r = rule.parse("(Num ?x) = ?r\n?v = ?x\n[>= ?v 5]", "(seen ?r) := ?v", match_limit=5)
+    self.assertEqual(self.eg.run_rules([r]), [])
+    self.assertEqual(sorted(self.eg.ftab["seen"].tab.values()), [5, 6, 7, 8, 9])
+
+  def test_match_limit_seeded(self):
+    for i in range(20):
+      self.eg.get_sexpr(f"(Num {i})")
+    q = query.parse("(Num ?x) = ?r")
+    a = self.eg.query(q, subst.Sample(4, "seeded", 1))
+    b = self.eg.ematch(q, subst.Sample(4, "seeded", 1))
+    self.assertEqual(a.substs, b.substs)
+
+  def test_guard_pushdown(self):
+    for i in range(4):
+      self.eg.get_sexpr(f"(* (+ {i} 1) y)")
+    q = query.parse("""
+      (+ ?a ?b) = ?r
+      ?x = ?a
+      [< ?x 2]
+      (* ?r ?c) = ?root
+    """)
+    self.assertEqual(len(self.eg.query(q).substs), 2)
+    # the guard runs before the join with *, so it sees 4 rows
+    self.assertEqual(q.pruned, [2])
+    self.assertEqual(len(self.eg.ematch(q).substs), 2)
+    self.assertEqual(q.pruned, [4])
+
+  def test_guard_unbound(self):
+    with self.assertRaises(ValueError):
+      query.parse("(+ ?a ?b) = ?r\n[< ?x 2]")
+
+  def test_run_prim(self):
+    # constant folding
+    id = self.eg.get_sexpr("(+ (Num 1) (Num 2))")
+    self.eg.run_srule("""
+      (+ (Num ?a) (Num ?b)) = ?r
+      ?x = ?a
+      ?y = ?b
+    """, "(Num [+ ?x ?y]) = ?r")
+    self.eg.rebuild()
+    self.assertEqual(self.eg.uf.find(id), self.eg.lookup_sexpr("(Num 3)"))
+
+  def test_run_prim_setfun(self):
+    self.eg.get_sexpr("(+ x y)")
+    self.eg.get_sexpr("(+ x z)")
+    self.eg.add_fun("lo", "max")
+    self.eg.set_fun("lo", (self.eg.atom["x"],), 1)
+    self.eg.set_fun("lo", (self.eg.atom["y"],), 2)
+    self.eg.run_srule("(+ ?a ?b) = ?r", "(lo ?r) := [+ (lo ?a) [max (lo ?b) 0]]")
+    self.assertEqual(self.eg.get_efun(expr.parse("(lo (+ x y))")), 3)
+    # no value for z, so nothing to compute for (+ x z)
+    with self.assertRaises(ValueError):
+      self.eg.get_efun(expr.parse("(lo (+ x z))"))
+
+  def test_run_prim_batched(self):
+    calls = []
+    prim.register("count", lambda x: x, lambda xs: calls.append(len(xs)) or xs)
+    for i in range(5):
+      self.eg.get_sexpr(f"(Num {i})")
+    self.eg.add_fun("val", "new")
+    self.eg.run_srule("(Num ?a) = ?r\n?x = ?a", "(val ?r) := [count ?x]")
+    self.assertEqual(calls, [5])
+    self.assertEqual(self.eg.get_efun(expr.parse("(val (Num 4))")), 4)
+    del prim.PRIMS["count"]
+
+  def test_events(self):
+    log = []
+    for e in events.EVENTS:
+      self.eg.subscribe(e, lambda *args, e=e: log.append((e, *args)))
+    self.assertIsInstance(self.eg, TracedEGraph)
+
+    x = self.eg.get_sexpr("x")
+    y = self.eg.get_sexpr("y")
+    fx = self.eg.get_enode("f", (x,))
+    self.eg.get_enode("f", (y,))
+    self.eg.get_enode("f", (x,)) # already there
+    self.eg.add_fun("hi", "max")
+    self.eg.set_fun("hi", (fx,), 1)
+    self.eg.set_fun("hi", (self.eg.get_enode("f", (y,)),), 2)
+    r = rule.parse("(f ?x) = ?r", "?x = ?r")
+    self.eg.run_rule(r)
+    self.eg.uf.union(x, y)
+    self.eg.rebuild()
+
+    # the order of the matches is up to the subst.Set
+    log[4:6] = sorted(log[4:6])
+    self.assertEqual(log, [
+      ("on_enode_added", expr.Atom("x"), (), x),
+      ("on_enode_added", expr.Atom("y"), (), y),
+      ("on_enode_added", "f", (x,), 2),
+      ("on_enode_added", "f", (y,), 3),
+      ("on_union", x, 2),
+      ("on_union", y, 3),
+      ("on_rule_fired", r, log[6][2]),
+      ("on_union", x, y),
+      ("on_funtab_repair", "hi", (x,), 1, 2),
+      ("on_rebuild_round", 0, self.eg.rebuild_stats.rounds[0]),
+      ("on_rebuild_round", 1, self.eg.rebuild_stats.rounds[1]),
+    ])
+    self.assertEqual(len(log[6][2].substs), 2)
+
+  def test_events_unsubscribe(self):
+    fn = lambda *args: None
+    self.eg.add_fun("hi", "max")
+    self.eg.subscribe("on_union", fn)
+    self.assertIsInstance(self.eg.ftab["hi"], events.TracedFunTab)
+    self.eg.unsubscribe("on_union", fn)
+    self.assertIs(type(self.eg), EGraph)
+    self.assertIs(type(self.eg.ftab["hi"]), table.FunTab)
+    self.assertEqual(self.eg.uf.watchers, [self.eg, self.eg.index, self.eg.classes])
+
+  def test_dump_text(self):
+    self.eg.get_sexpr("(+ 1 (+ 2 3))")
+    f = io.StringIO()
+    self.eg.dump(f)
+    self.assertEqual(f.getvalue(), str(self.eg))
+
+  def test_dump_unsorted(self):
+    self.eg.get_sexpr("(+ 1 (+ 2 3))")
+    f = io.StringIO()
+    self.eg.dump(f, sort=False)
+    self.assertEqual(sorted(f.getvalue().splitlines()),
+                     sorted(str(self.eg).splitlines()))
+
+  def test_dump_json(self):
+    self.eg.get_sexpr("(+ 1 (+ 2 3))")
+    self.eg.add_fun("lo", max)
+    self.eg.set_fun("lo", (self.eg.atom[1],), 1)
+    f = io.StringIO()
+    self.eg.dump(f, format="json")
+    rows = [json.loads(l) for l in f.getvalue().splitlines()]
+    self.assertEqual([r["kind"] for r in rows].count("atom"), 3)
+    self.assertEqual([r["kind"] for r in rows].count("app"), 2)
+    self.assertIn({"kind": "fun", "fun": "lo", "args": [self.eg.atom[1]], "res": 1}, rows)
+
+  def test_dump_json_rational(self):
+    half = self.eg.get_expr(expr.Atom(fractions.Fraction(1, 2)))
+    self.eg.add_fun("lo", max)
+    self.eg.set_fun("lo", (half,), fractions.Fraction(3, 4))
+    f = io.StringIO()
+    self.eg.dump(f, format="json")
+    rows = [json.loads(l) for l in f.getvalue().splitlines()]
+    self.assertIn({"kind": "atom", "atom": {"rational": [1, 2]}, "id": half}, rows)
+    self.assertIn({"kind": "fun", "fun": "lo", "args": [half], "res": {"rational": [3, 4]}}, rows)
+
+  def test_dump_dot(self):
+    id = self.eg.get_sexpr("(+ 1 2)")
+    self.eg.uf.union(self.eg.atom[1], self.eg.atom[2])
+    f = io.StringIO()
+    self.eg.dump(f, format="dot")
+    out = f.getvalue()
+    self.assertTrue(out.startswith("digraph egraph {"))
+    self.assertIn(f"subgraph cluster_{id} ", out)
+    # edges point at canonical classes even before rebuilding
+    leader = self.eg.uf.find(self.eg.atom[2])
+    self.assertIn(f"-> c{leader} [lhead=cluster_{leader} label=1]", out)
+
+  def test_dump_bad_format(self):
+    with self.assertRaises(ValueError):
+      self.eg.dump(io.StringIO(), format="xml")
+
 if __name__ == "__main__":
   unittest.main()
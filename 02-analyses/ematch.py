@@ -0,0 +1,137 @@
+# Top-down EMatching
+#
+# Relational matching (EGraph.query) joins one flat pattern at a time against
+# whole tables. Top-down ematching instead starts from a candidate root eclass
+# and walks down through the enodes of each class, like egg does. A pattern is
+# compiled once into a small program for a virtual machine with registers that
+# hold eclass ids:
+#
+#   Bind(reg, op, arity, out)  for each enode (op, args) in class regs[reg],
+#                              load args into regs[out], ..., regs[out+arity-1]
+#   Compare(r1, r2)            continue only if regs[r1] and regs[r2] are equal
+#   Literal(reg, atom)         continue only if regs[reg] is the class of atom
+#
+# Register 0 holds the root. When a pattern variable is seen again, a Compare
+# checks that both occurrences landed on the same class. Running a program
+# backtracks over every choice of enode in each Bind, and each complete run
+# yields one way to bind the pattern variables.
+#
+# The walk goes through the class index (see index.py), so only AppTab operators
+# can be matched top down.
+
+from dataclasses import dataclass
+import pattern
+
+@dataclass(frozen=True, slots=True)
+class Bind:
+  reg: int
+  op: str
+  arity: int
+  out: int
+
+  def __str__(self):
+    return f"bind r{self.reg} ({self.op} ...{self.arity}) -> r{self.out}"
+
+@dataclass(frozen=True, slots=True)
+class Compare:
+  r1: int
+  r2: int
+
+  def __str__(self):
+    return f"compare r{self.r1} r{self.r2}"
+
+@dataclass(frozen=True, slots=True)
+class Literal:
+  reg: int
+  atom: int | float | str
+
+  def __str__(self):
+    return f"literal r{self.reg} {self.atom}"
+
+class Program:
+  def __init__(self, pat: pattern.AppPat):
+    self.pat = pat
+    self.instrs = []
+    self.pvars: dict[str, int] = {} # first register holding each variable
+    self.nregs = 1
+
+    if pat.vres is not None:
+      self.pvars[pat.vres] = 0
+    self.compile(pat, 0)
+
+  def __str__(self):
+    return "\n".join(str(i) for i in self.instrs)
+
+  def compile(self, pat: pattern.AppPat, reg: int):
+    out = self.nregs
+    self.nregs += len(pat.vargs)
+    self.instrs.append(Bind(reg, pat.op, len(pat.vargs), out))
+
+    for i, varg in enumerate(pat.vargs):
+      r = out + i
+      if isinstance(varg, str):
+        if varg in self.pvars:
+          self.instrs.append(Compare(self.pvars[varg], r))
+        else:
+          self.pvars[varg] = r
+      elif isinstance(varg, pattern.AtomPat):
+        self.instrs.append(Literal(r, varg.atom))
+      else:
+        self.compile(varg, r)
+
+  # yield the (var, eclass) bindings of every match rooted at eclass root
+  def run(self, eg, root: int):
+    regs = [0] * self.nregs
+    regs[0] = eg.uf.find(root)
+    for _ in self.step(eg, 0, regs):
+      yield [(v, regs[r]) for v, r in self.pvars.items()]
+
+  def step(self, eg, pc: int, regs: list[int]):
+    if pc == len(self.instrs):
+      yield
+      return
+
+    match self.instrs[pc]:
+      case Bind(reg, op, arity, out):
+        for o, ids in eg.index.enodes(regs[reg]):
+          if o != op or len(ids) != arity:
+            continue
+          for i, id in enumerate(ids):
+            regs[out + i] = eg.uf.find(id)
+          yield from self.step(eg, pc + 1, regs)
+
+      case Compare(r1, r2):
+        if regs[r1] == regs[r2]:
+          yield from self.step(eg, pc + 1, regs)
+
+      case Literal(reg, atom):
+        if atom in eg.atom and regs[reg] == eg.uf.find(eg.atom[atom]):
+          yield from self.step(eg, pc + 1, regs)
+
+def compile(pat: pattern.AppPat) -> Program:
+  return Program(pat)
+
+
+import unittest
+
+class TestEMatch(unittest.TestCase):
+  def test_compile(self):
+    prog = compile(pattern.parse("(+ ?a (+ ?b ?a)) = ?root"))
+    self.assertEqual(str(prog), "\n".join([
+      "bind r0 (+ ...2) -> r1",
+      "bind r2 (+ ...2) -> r3",
+      "compare r1 r4",
+    ]))
+    self.assertEqual(prog.pvars, {"?root": 0, "?a": 1, "?b": 3})
+
+  def test_compile_literal(self):
+    prog = compile(pattern.parse("(* ?a (+ ?a 0)) = ?root"))
+    self.assertEqual(str(prog), "\n".join([
+      "bind r0 (* ...2) -> r1",
+      "bind r2 (+ ...2) -> r3",
+      "compare r1 r3",
+      "literal r4 0",
+    ]))
+
+if __name__ == "__main__":
+  unittest.main()
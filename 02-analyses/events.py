@@ -0,0 +1,111 @@
+# Event Hooks
+#
+# Callbacks for what happens inside an egraph, to watch when and why classes
+# merge. Subscribe with eg.subscribe(event, fn), where event is one of
+#
+#   on_enode_added(op, ids, id)        a new enode (op, ids) in eclass id; for
+#                                      atoms, op is the expr.Atom and ids is ()
+#   on_union(winner, loser)            eclass loser was merged into winner
+#   on_funtab_repair(f, ids, old, new) repairing function f changed the value
+#                                      for ids from old to new
+#   on_rebuild_round(n, round)         round n (from 0) of rebuild is done,
+#                                      round is its stats.Round
+#   on_rule_fired(rule, matches)       rule applied its action to its matches
+#
+# Events cost nothing until the first subscription. Only then does the egraph
+# switch to instrumented subclasses (TracedEGraph, TracedFunTab) by assigning
+# __class__ in place, so the methods on the hot paths stay as they are for
+# everyone else. The bus also watches the union-find (see uf.py) to report
+# unions. Once the last callback unsubscribes, everything is switched back.
+
+import table
+
+EVENTS = [
+  "on_enode_added",
+  "on_union",
+  "on_funtab_repair",
+  "on_rebuild_round",
+  "on_rule_fired",
+]
+
+class Bus:
+  def __init__(self):
+    self.handlers: dict[str, list] = {e: [] for e in EVENTS}
+
+  def __bool__(self):
+    return any(self.handlers.values())
+
+  def subscribe(self, event: str, fn):
+    if event not in self.handlers:
+      raise ValueError(f"unknown event {event}")
+    self.handlers[event].append(fn)
+
+  def unsubscribe(self, event: str, fn):
+    if event not in self.handlers:
+      raise ValueError(f"unknown event {event}")
+    self.handlers[event].remove(fn)
+
+  def emit(self, event: str, *args):
+    for fn in self.handlers[event]:
+      fn(*args)
+
+  # called by the union-find whenever loser is absorbed by winner
+  def merge(self, winner: int, loser: int):
+    self.emit("on_union", winner, loser)
+
+# A function table that reports repairs. It needs the name of its function and
+# the bus, which the egraph sets when it instruments the table.
+class TracedFunTab(table.FunTab):
+  # no new slots, so tables can switch to this class and back
+  __slots__ = ()
+
+  def repaired(self, ids, old, new):
+    self.events.emit("on_funtab_repair", self.name, ids, old, new)
+
+def trace_fun(t: table.FunTab, name: str, bus: Bus):
+  t.__class__ = TracedFunTab
+  t.name = name
+  t.events = bus
+
+def untrace_fun(t: table.FunTab):
+  t.__class__ = table.FunTab
+  del t.name, t.events
+
+
+import unittest
+
+class TestBus(unittest.TestCase):
+  def test_emit(self):
+    bus = Bus()
+    self.assertFalse(bus)
+    log = []
+    fn = lambda w, l: log.append((w, l))
+    bus.subscribe("on_union", fn)
+    self.assertTrue(bus)
+    bus.merge(0, 1)
+    bus.unsubscribe("on_union", fn)
+    bus.merge(2, 3)
+    self.assertFalse(bus)
+    self.assertEqual(log, [(0, 1)])
+
+  def test_unknown_event(self):
+    with self.assertRaises(ValueError):
+      Bus().subscribe("on_frobnicate", print)
+
+  def test_traced_funtab(self):
+    import uf
+    log = []
+    bus = Bus()
+    bus.subscribe("on_funtab_repair", lambda *args: log.append(args))
+    t = table.FunTab(uf.UF(), "max")
+    trace_fun(t, "hi", bus)
+    t.set((0,), 1)
+    t.set((0,), 5)
+    t.set((0,), 3) # max keeps 5, no repair
+    untrace_fun(t)
+    t.set((0,), 7)
+    self.assertIs(type(t), table.FunTab)
+    self.assertEqual(log, [("hi", (0,), 1, 5)])
+
+if __name__ == "__main__":
+  unittest.main()
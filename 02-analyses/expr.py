@@ -4,19 +4,19 @@ from dataclasses import dataclass
 import lark
 import unittest
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Expr:
   """Base class for expressions."""
   pass
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Atom(Expr):
   atom: int | float | str
 
   def __str__(self) -> str:
     return str(self.atom)
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class App(Expr):
   op: str
   args: list[Expr]
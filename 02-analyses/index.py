@@ -0,0 +1,112 @@
+# Class Index
+#
+# Tables map argument classes to a result class, so going the other way (from a
+# class to its enodes, or to the enodes that use it as an argument) would mean
+# scanning every table. The index maintains both directions incrementally:
+#
+#   nodes[c]    the rows (op, ids) whose result is in class c
+#   parents[c]  the rows (op, ids) that have class c among their arguments
+#
+# Rows are identified by their operator and the key they are stored under in
+# that operator's AppTab. Keys may go stale when classes merge, but tables
+# re-key their rows during rebuilding and tell the index, so every entry always
+# names a row that really is in its table. The index is keyed by leader ids and
+# registers itself with the union-find to move entries from loser to winner.
+#
+# Atoms are not indexed. They have no arguments and are easy to find through
+# the atom dictionary.
+
+class Index:
+  def __init__(self, uf):
+    self.uf = uf
+    self.nodes: dict[int, set[tuple[str, tuple[int, ...]]]] = {}
+    self.parents: dict[int, set[tuple[str, tuple[int, ...]]]] = {}
+    uf.watchers.append(self)
+
+  def add(self, op: str, ids: tuple[int, ...], id: int):
+    row = (op, ids)
+    self.nodes.setdefault(self.uf.find(id), set()).add(row)
+    for i in ids:
+      self.parents.setdefault(self.uf.find(i), set()).add(row)
+
+  def remove(self, op: str, ids: tuple[int, ...], id: int):
+    row = (op, ids)
+    self.nodes[self.uf.find(id)].discard(row)
+    for i in ids:
+      self.parents[self.uf.find(i)].discard(row)
+
+  # called by the union-find whenever loser is absorbed by winner
+  def merge(self, winner: int, loser: int):
+    for idx in (self.nodes, self.parents):
+      if loser not in idx:
+        continue
+      rows = idx.pop(loser)
+      if winner not in idx:
+        idx[winner] = rows
+        continue
+      # always copy the smaller set into the larger one
+      if len(rows) > len(idx[winner]):
+        rows, idx[winner] = idx[winner], rows
+      idx[winner].update(rows)
+
+  def enodes(self, id: int) -> set[tuple[str, tuple[int, ...]]]:
+    return self.nodes.get(self.uf.find(id), set())
+
+  def uses(self, id: int) -> set[tuple[str, tuple[int, ...]]]:
+    return self.parents.get(self.uf.find(id), set())
+
+
+import unittest
+import uf
+import table
+
+class TestIndex(unittest.TestCase):
+  def setUp(self):
+    self.uf = uf.UF()
+    self.idx = Index(self.uf)
+    self.tab = table.AppTab(self.uf, "f", self.idx)
+    for _ in range(4):
+      self.uf.mkset()
+
+  def test_get_adds_rows(self):
+    ec = self.tab.get((0, 1))
+    self.assertEqual(self.idx.enodes(ec), {("f", (0, 1))})
+    self.assertEqual(self.idx.uses(0), {("f", (0, 1))})
+    self.assertEqual(self.idx.uses(1), {("f", (0, 1))})
+    self.assertEqual(self.idx.uses(2), set())
+
+  def test_union_merges_rows(self):
+    ec0 = self.tab.get((0,))
+    ec1 = self.tab.get((1,))
+    self.uf.union(ec0, ec1)
+    self.assertEqual(self.idx.enodes(ec1), {("f", (0,)), ("f", (1,))})
+    self.uf.union(0, 1)
+    self.assertEqual(self.idx.uses(1), {("f", (0,)), ("f", (1,))})
+
+  def test_rebuild_rekeys_rows(self):
+    ec0 = self.tab.get((0, 2))
+    ec1 = self.tab.get((1, 2))
+    self.uf.union(0, 1)
+    self.tab.rebuild()
+    self.assertEqual(self.uf.find(ec0), self.uf.find(ec1))
+    # both rows collapsed into one canonical row
+    self.assertEqual(self.idx.enodes(ec0), {("f", (0, 2))})
+    self.assertEqual(self.idx.uses(2), {("f", (0, 2))})
+    self.assertEqual(self.idx.uses(1), {("f", (0, 2))})
+
+  def test_rebuild_onto_canonical_row(self):
+    ec1 = self.tab.get((1, 2))
+    ec0 = self.tab.get((0, 2))
+    self.uf.union(0, 1)
+    self.tab.rebuild()
+    self.assertEqual(self.idx.enodes(ec1), {("f", (0, 2))})
+    self.assertEqual(self.idx.enodes(ec0), {("f", (0, 2))})
+
+  def test_set_existing_row(self):
+    ec0 = self.tab.get((0,))
+    self.tab.set((0,), 3)
+    self.assertEqual(self.idx.enodes(3), {("f", (0,))})
+    self.assertEqual(self.uf.find(ec0), self.uf.find(3))
+
+if __name__ == "__main__":
+  unittest.main()
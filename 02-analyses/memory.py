@@ -0,0 +1,140 @@
+# Memory Accounting
+#
+# Estimates of how much memory the parts of an egraph take, from sys.getsizeof
+# summed over everything reachable from each part: the containers, the id
+# tuples used as keys, the ints, and the atoms themselves. Small ints are
+# cached by Python and cost nothing extra, so they are not counted.
+#
+# Parts share objects (the index holds the same key tuples as the tables, for
+# example), so each part is measured on its own, as what it would take without
+# the others, and the total counts every object only once.
+#
+# Intermediate query results come and go while matching, so they are sampled
+# instead: with queries, the report runs each one under tracemalloc and records
+# the peak memory allocated while matching and the size of the final result.
+#
+# Everything in the report is made of dicts, lists, strings and numbers, so it
+# can go straight to json.dumps.
+
+import sys
+import tracemalloc
+import query
+
+def deep_size(obj, seen: set | None = None) -> int:
+  if seen is None:
+    seen = set()
+  total = 0
+  todo = [obj]
+  while todo:
+    o = todo.pop()
+    if id(o) in seen or (type(o) is int and -5 <= o <= 256):
+      continue
+    seen.add(id(o))
+    total += sys.getsizeof(o)
+    if isinstance(o, dict):
+      todo.extend(o.keys())
+      todo.extend(o.values())
+    elif isinstance(o, (list, tuple, set, frozenset)):
+      todo.extend(o)
+    elif isinstance(o, (str, bytes, int, float, complex, bool, type(None), type)):
+      pass
+    else:
+      if hasattr(o, "__dict__"):
+        todo.append(o.__dict__)
+      for cls in type(o).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+          if hasattr(o, slot):
+            todo.append(getattr(o, slot))
+  return total
+
+def table(t) -> dict:
+  rows = len(t.tab)
+  size = deep_size(t.tab)
+  return {
+    "rows": rows,
+    "bytes": size,
+    "bytes_per_row": size / rows if rows else 0,
+  }
+
+# Match q (a Query or its string form) under tracemalloc.
+def sample_query(eg, q) -> dict:
+  if isinstance(q, str):
+    q = query.parse(q)
+  tracing = tracemalloc.is_tracing()
+  if not tracing:
+    tracemalloc.start()
+  tracemalloc.reset_peak()
+  before, _ = tracemalloc.get_traced_memory()
+  substs = eg.query(q)
+  after, peak = tracemalloc.get_traced_memory()
+  if not tracing:
+    tracemalloc.stop()
+  return {
+    "query": str(q),
+    "matches": len(substs.substs),
+    "peak_bytes": peak - before,
+    "retained_bytes": after - before,
+    "result_bytes": deep_size(substs.substs),
+  }
+
+def report(eg, queries=()) -> dict:
+  apps = {op: table(t) for op, t in eg.atab.items()}
+  funs = {f: table(t) for f, t in eg.ftab.items()}
+  parts = {
+    "uf": eg.uf.parent,
+    "atoms": eg.atom.sorts,
+    "atom_vals": eg.atom_vals,
+    "index": (eg.index.nodes, eg.index.parents),
+    "classes": eg.classes.sort,
+  }
+  res = {name: {"bytes": deep_size(obj)} for name, obj in parts.items()}
+  res["uf"]["ids"] = len(eg.uf.parent)
+  res["atoms"]["count"] = len(eg.atom)
+  res["apps"] = apps
+  res["funs"] = funs
+
+  enodes = sum(t["rows"] for t in apps.values())
+  seen = set()
+  total = sum(deep_size(t.tab, seen) for t in eg.atab.values())
+  total += sum(deep_size(t.tab, seen) for t in eg.ftab.values())
+  total += sum(deep_size(obj, seen) for obj in parts.values())
+  res["enodes"] = enodes
+  res["total_bytes"] = total
+  res["bytes_per_enode"] = total / enodes if enodes else 0
+
+  if queries:
+    res["queries"] = [sample_query(eg, q) for q in queries]
+  return res
+
+
+import json
+import unittest
+import egraph
+
+class TestMemory(unittest.TestCase):
+  def test_deep_size(self):
+    ids = (1000, 1001)
+    self.assertEqual(deep_size(ids), sys.getsizeof(ids) + 2 * sys.getsizeof(1000))
+    # shared objects count once
+    self.assertEqual(deep_size([ids, ids]), sys.getsizeof([ids, ids]) + deep_size(ids))
+    # small ints are free
+    self.assertEqual(deep_size((1, 2)), sys.getsizeof((1, 2)))
+
+  def test_report(self):
+    eg = egraph.EGraph()
+    eg.get_sexpr("(+ (* x 2) (* y 2))")
+    eg.rebuild()
+    rep = json.loads(json.dumps(eg.memory_report(["(* ?a 2) = ?r"])))
+    self.assertEqual(rep["enodes"], 3)
+    self.assertEqual(rep["apps"]["*"]["rows"], 2)
+    self.assertEqual(rep["atoms"]["count"], 3)
+    parts = ["uf", "atoms", "atom_vals", "index", "classes"]
+    self.assertLessEqual(rep["total_bytes"],
+      sum(rep[p]["bytes"] for p in parts) + sum(t["bytes"] for t in rep["apps"].values()))
+    [q] = rep["queries"]
+    self.assertEqual(q["matches"], 2)
+    self.assertGreater(q["peak_bytes"], 0)
+    self.assertFalse(tracemalloc.is_tracing())
+
+if __name__ == "__main__":
+  unittest.main()
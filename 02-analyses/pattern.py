@@ -1,16 +1,21 @@
 from dataclasses import dataclass
+import itertools
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Pat:
   """Base class for patterns."""
   pass
 
-@dataclass(frozen=True)
+# As an argument of an application pattern, like the 0 in (+ ?x 0) = ?root,
+# an atom pattern has no result variable (vres is None).
+@dataclass(frozen=True, slots=True)
 class AtomPat(Pat):
   atom: int | float | str
-  vres: str
+  vres: str | None
 
   def __str__(self):
+    if self.vres is None:
+      return str(self.atom)
     # maybe using "∈" would be more clear than = 🤷
     return f"{self.atom} = {self.vres}"
 
@@ -18,16 +23,40 @@ class AtomPat(Pat):
     return subst.bind(self.vres, res)
 
   def pvars(self):
-    return {self.vres}
+    return {self.vres} if self.vres is not None else set()
+
+# The value of an atom in eclass vres, written ?v = ?x. This lets primitives
+# compute with atoms, e.g. [+ ?a ?b] after (Num ?x) = ?root and ?a = ?x.
+@dataclass(frozen=True, slots=True)
+class ValPat(Pat):
+  vval: str
+  vres: str
+
+  def __str__(self):
+    return f"{self.vval} = {self.vres}"
+
+  def match(self, subst, val, res: int):
+    return subst.bind(self.vval, val).bind(self.vres, res)
 
-@dataclass(frozen=True)
+  def pvars(self):
+    return {self.vval, self.vres}
+
+# Arguments are usually pattern variables, but they may also be literal atoms
+# or nested application patterns like the (+ ?b ?c) in
+# (+ ?a (+ ?b ?c)) = ?root. Nested patterns have no result variable (vres is
+# None). Relational matching only handles flat patterns, so queries flatten
+# nested patterns into several flat ones, while top-down ematching (see
+# ematch.py) can run them directly.
+@dataclass(frozen=True, slots=True)
 class AppPat(Pat):
   op: str
-  vargs: list[str]
-  vres: str
+  vargs: list[str | Pat]
+  vres: str | None
 
   def __str__(self):
-    args = " ".join(self.vargs)
+    args = " ".join(map(str, self.vargs))
+    if self.vres is None:
+      return f"({self.op} {args})"
     return f"({self.op} {args}) = {self.vres}"
 
   def match(self, subst, args: list[int], res: int):
@@ -37,7 +66,71 @@ class AppPat(Pat):
     return subst.bind(self.vres, res)
 
   def pvars(self):
-    return set(self.vargs).union({self.vres})
+    pvs = {self.vres} if self.vres is not None else set()
+    for varg in self.vargs:
+      if isinstance(varg, str):
+        pvs.add(varg)
+      else:
+        pvs.update(varg.pvars())
+    return pvs
+
+  def is_flat(self):
+    return all(isinstance(varg, str) for varg in self.vargs)
+
+  def ops(self):
+    res = {self.op}
+    for varg in self.vargs:
+      if isinstance(varg, AppPat):
+        res.update(varg.ops())
+    return res
+
+  # the literal atoms among the arguments (not the nested patterns)
+  def atoms(self):
+    return [varg.atom for varg in self.vargs if isinstance(varg, AtomPat)]
+
+# Flatten a pattern into a list of flat patterns, outermost first, by naming
+# each nested pattern with a fresh variable. Literal arguments come before the
+# pattern using them, so that it can look them up rather than scan its table.
+# Fresh variables start with "?." which the parser never produces, so they
+# cannot clash with user variables.
+def flatten(pat: Pat, fresh=None) -> list[Pat]:
+  if fresh is None:
+    fresh = itertools.count()
+
+  if not isinstance(pat, AppPat) or pat.is_flat():
+    return [pat]
+
+  vargs = []
+  atoms = []
+  nested = []
+  for varg in pat.vargs:
+    if isinstance(varg, str):
+      vargs.append(varg)
+    elif isinstance(varg, AtomPat):
+      v = f"?.{next(fresh)}"
+      vargs.append(v)
+      atoms.append(AtomPat(varg.atom, v))
+    else:
+      v = f"?.{next(fresh)}"
+      vargs.append(v)
+      nested.append(AppPat(varg.op, varg.vargs, v))
+
+  res = atoms + [AppPat(pat.op, vargs, pat.vres)]
+  for n in nested:
+    res.extend(flatten(n, fresh))
+  return res
+
+# rename the variables of pat by m (those not in m stay)
+def rename(pat: Pat, m: dict[str, str]) -> Pat:
+  match pat:
+    case AtomPat(a, vres):
+      return AtomPat(a, m.get(vres, vres))
+    case ValPat(vval, vres):
+      return ValPat(m.get(vval, vval), m.get(vres, vres))
+    case AppPat(op, vargs, vres):
+      args = [m.get(v, v) if isinstance(v, str) else rename(v, m) for v in vargs]
+      return AppPat(op, args, m.get(vres, vres))
+  raise ValueError(f"invalid pattern {pat}")
 
 
 #
@@ -50,11 +143,20 @@ grammar = """
   ?start: pattern
 
   ?pattern: atom_pattern
+          | val_pattern
           | app_pattern
 
   atom_pattern: atom "=" patvar -> atom_pat
 
-  app_pattern: "(" op patvar* ")" "=" patvar -> app_pat
+  val_pattern: patvar "=" patvar -> val_pat
+
+  app_pattern: "(" op parg* ")" "=" patvar -> app_pat
+
+  ?parg: patvar
+       | atom -> lit_pat
+       | nested_pattern
+
+  nested_pattern: "(" op parg* ")" -> nested_pat
 
   op : /[a-zA-Z_+*\\/\\-~][a-zA-Z0-9_+*\\/\\-~]*/
 
@@ -92,9 +194,18 @@ class PatternTransformer(lark.Transformer):
   def atom_pat(self, atom, patvar):
     return AtomPat(atom, patvar)
 
+  def val_pat(self, vval, vres):
+    return ValPat(vval, vres)
+
   def app_pat(self, op, *patvars):
     return AppPat(op, patvars[:-1], patvars[-1])
 
+  def lit_pat(self, atom):
+    return AtomPat(atom, None)
+
+  def nested_pat(self, op, *pargs):
+    return AppPat(op, pargs, None)
+
 _transformer = PatternTransformer()
 
 def parse(s: str) -> Pat:
@@ -144,5 +255,45 @@ class TestPatterns(unittest.TestCase):
     pat = parse("(+ ?l ?r) = ?x")
     self.assertEqual(str(pat), "(+ ?l ?r) = ?x")
 
+  def test_parse_val_pat(self):
+    pat = parse("?r = ?x")
+    self.assertEqual(pat, ValPat("?r", "?x"))
+    s1 = pat.match(subst.Subst({}), 3, 42)
+    self.assertEqual(s1, subst.Subst({"?r": 3, "?x": 42}))
+
+  def test_parse_nested_pat(self):
+    pat = parse("(+ ?a (+ ?b ?c)) = ?root")
+    self.assertEqual(str(pat), "(+ ?a (+ ?b ?c)) = ?root")
+    self.assertFalse(pat.is_flat())
+    self.assertEqual(pat.pvars(), {"?a", "?b", "?c", "?root"})
+
+  def test_flatten(self):
+    pat = parse("(+ (~ ?a) (+ ?b (~ ?a))) = ?root")
+    flat = flatten(pat)
+    self.assertEqual([str(p) for p in flat], [
+      "(+ ?.0 ?.1) = ?root",
+      "(~ ?a) = ?.0",
+      "(+ ?b ?.2) = ?.1",
+      "(~ ?a) = ?.2",
+    ])
+
+  def test_parse_lit_pat(self):
+    pat = parse("(+ ?x 0) = ?root")
+    self.assertEqual(pat.vargs[1], AtomPat(0, None))
+    self.assertEqual(str(pat), "(+ ?x 0) = ?root")
+    self.assertEqual(pat.pvars(), {"?x", "?root"})
+    self.assertEqual([str(p) for p in flatten(pat)], [
+      "0 = ?.0",
+      "(+ ?x ?.0) = ?root",
+    ])
+
+  def test_rename(self):
+    pat = rename(parse("(+ ?a (* ?b 1)) = ?r"), {"?a": "?0", "?r": "?1"})
+    self.assertEqual(str(pat), "(+ ?0 (* ?b 1)) = ?1")
+
+  def test_flatten_flat(self):
+    pat = parse("(+ ?l ?r) = ?x")
+    self.assertEqual(flatten(pat), [pat])
+
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,120 @@
+# Primitive Functions
+#
+# Primitives compute on values (numbers, strings, ...) rather than eclasses,
+# for example the [+ ?r1 ?r2] in (Num [+ ?r1 ?r2]) = ?root. Rules evaluate the
+# primitives in their actions and guards in batches: each argument becomes a
+# column with one value per substitution, and the whole column is handed to the
+# primitive at once. By default a batch just maps the primitive over the
+# columns, which runs at C speed for builtins and the operator module, but a
+# primitive can also register its own batch function (e.g., one using numpy).
+#
+# A missing value (say, a function lookup with no entry) is None. Rows with a
+# None argument, or for which the primitive raises, come out as None, and
+# rules skip the substitutions where any of their primitives failed.
+
+from fractions import Fraction
+import operator
+
+class Prim:
+  def __init__(self, name, fn, batch=None):
+    self.name = name
+    self.fn = fn
+    self.batch = batch
+
+  def __str__(self):
+    return self.name
+
+PRIMS: dict[str, Prim] = {}
+
+def register(name, fn, batch=None):
+  PRIMS[name] = Prim(name, fn, batch)
+
+def lookup(name) -> Prim:
+  try:
+    return PRIMS[name]
+  except KeyError:
+    raise ValueError(f"no primitive {name}")
+
+def call(name, args):
+  return lookup(name).fn(*args)
+
+def call_batch(name, cols: list[list], n: int) -> list:
+  p = lookup(name)
+  if not cols:
+    return [p.fn()] * n
+
+  # only hand complete rows to the primitive
+  ok = None
+  if any(None in col for col in cols):
+    ok = [i for i in range(n) if all(col[i] is not None for col in cols)]
+    cols = [[col[i] for i in ok] for col in cols]
+
+  try:
+    if p.batch is not None:
+      res = list(p.batch(*cols))
+    else:
+      res = list(map(p.fn, *cols))
+  except (ArithmeticError, TypeError, ValueError):
+    # some row failed, find out which ones one at a time
+    res = []
+    for args in zip(*cols):
+      try:
+        res.append(p.fn(*args))
+      except (ArithmeticError, TypeError, ValueError):
+        res.append(None)
+
+  if ok is None:
+    return res
+  full = [None] * n
+  for i, val in zip(ok, res):
+    full[i] = val
+  return full
+
+register("+", operator.add)
+register("-", operator.sub)
+register("*", operator.mul)
+register("/", operator.truediv)
+register("min", min)
+register("max", max)
+register("abs", abs)
+register("<", operator.lt)
+register(">", operator.gt)
+register("<=", operator.le)
+register(">=", operator.ge)
+register("=", operator.eq)
+register("!=", operator.ne)
+register("rational", Fraction)
+register("to-f64", float)
+
+
+import unittest
+
+class TestPrim(unittest.TestCase):
+  def test_call(self):
+    self.assertEqual(call("+", [1, 2]), 3)
+    self.assertEqual(call("rational", [2, 4]), Fraction(1, 2))
+    with self.assertRaises(ValueError):
+      call("frobnicate", [])
+
+  def test_call_batch(self):
+    self.assertEqual(call_batch("max", [[1, 5, 3], [4, 2, 3]], 3), [4, 5, 3])
+    self.assertEqual(call_batch("<", [[1, 5], [4, 2]], 2), [True, False])
+
+  def test_call_batch_missing(self):
+    self.assertEqual(call_batch("+", [[1, None, 3], [1, 1, None]], 3), [2, None, None])
+
+  def test_call_batch_errors(self):
+    self.assertEqual(call_batch("/", [[1, 1, 4], [2, 0, 2]], 3), [0.5, None, 2.0])
+
+  def test_custom_batch(self):
+    calls = []
+    def batch(xs):
+      calls.append(len(xs))
+      return [x * 2 for x in xs]
+    register("double", lambda x: x * 2, batch)
+    self.assertEqual(call_batch("double", [[1, 2, 3]], 3), [2, 4, 6])
+    self.assertEqual(calls, [3])
+    del PRIMS["double"]
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,8 +1,37 @@
+import collections
+import itertools
 import pattern
+import action
 
+# stands for the atom dictionary in read sets, no operator can be called this
+ATOMS = "#atoms"
+
+# Guards are primitive expressions like [< ?x ?y] that every match must make
+# true. They can only use variables bound by the patterns, and matching checks
+# each guard right after the pattern that binds the last of its variables.
+# pruned counts how many partial matches each guard has rejected so far.
 class Query:
-  def __init__(self, pats: list[pattern.Pat]):
+  def __init__(self, pats: list[pattern.Pat], guards: list[action.ActionExpr] = []):
     self.pats = pats
+    self.guards = list(guards)
+    self.pruned = [0] * len(self.guards)
+
+    # relational matching only handles flat patterns
+    fresh = itertools.count()
+    self.flat_pats = []
+    for pat in pats:
+      self.flat_pats.extend(pattern.flatten(pat, fresh))
+
+    # variables only introduced by flattening
+    self.fresh = set()
+    for pat in self.flat_pats:
+      self.fresh.update(pat.pvars())
+    self.fresh.difference_update(self.pvars())
+
+    pvs = self.pvars()
+    for g in self.guards:
+      if not g.pvars() <= pvs:
+        raise ValueError(f"unbound variables in guard {g}")
 
   def pvars(self):
     pvs = set()
@@ -10,8 +39,75 @@ class Query:
       pvs.update(pat.pvars())
     return pvs
 
+  # the tables (and atoms) that matching reads
+  def reads(self) -> set[str]:
+    res = {pat_reads(pat) for pat in self.flat_pats}
+    for g in self.guards:
+      res |= action.ops(g)
+    return res
+
+  # The same query, flattened, with its variables renamed ?0, ?1, ... in order
+  # of appearance, so that rules can recognize shared sub-queries whatever they
+  # call their variables. Also returns the renaming back. The patterns keep
+  # their order, which is the order of the join, so queries only share a
+  # prefix if they list its patterns in the same order.
+  def canonical(self):
+    if not hasattr(self, "canon"):
+      m = {}
+      for pat in self.flat_pats:
+        match pat:
+          case pattern.AppPat(_, vargs, vres):
+            vs = list(vargs) + [vres]
+          case pattern.ValPat(vval, vres):
+            vs = [vres, vval]
+          case _:
+            vs = [pat.vres]
+        for v in vs:
+          m.setdefault(v, f"?{len(m)}")
+      pats = [pattern.rename(pat, m) for pat in self.flat_pats]
+      guards = [action.rename(g, m) for g in self.guards]
+      q = Query(pats, guards)
+      q.pruned = self.pruned
+      self.canon = (q, {c: v for v, c in m.items()})
+    return self.canon
+
+  # Keys for the prefixes of the join: for each flat pattern, the patterns so
+  # far and the guards checked so far. Guards are checked right after the
+  # pattern that binds the last of their variables, as in EGraph.query.
+  def prefixes(self) -> list[tuple]:
+    key = tuple(str(g) for g in self.guards if not g.pvars())
+    pending = [g for g in self.guards if g.pvars()]
+    bound = set()
+    res = []
+    for pat in self.flat_pats:
+      bound |= pat.pvars()
+      ready = [g for g in pending if g.pvars() <= bound]
+      pending = [g for g in pending if g not in ready]
+      key = (key, str(pat), tuple(str(g) for g in ready))
+      res.append(key)
+    return res
+
+  # what each of the prefixes above reads, like reads for the whole query
+  def prefix_reads(self) -> list[set[str]]:
+    read = set()
+    for g in self.guards:
+      if not g.pvars():
+        read |= action.ops(g)
+    pending = [g for g in self.guards if g.pvars()]
+    bound = set()
+    res = []
+    for pat in self.flat_pats:
+      bound |= pat.pvars()
+      read = read | {pat_reads(pat)}
+      for g in pending:
+        if g.pvars() <= bound:
+          read |= action.ops(g)
+      pending = [g for g in pending if not g.pvars() <= bound]
+      res.append(read)
+    return res
+
   def __str__(self):
-    return "\n".join(str(pat) for pat in self.pats)
+    return "\n".join(str(x) for x in self.pats + self.guards)
 
   def __repr__(self):
     return repr(self.pats)
@@ -19,11 +115,40 @@ class Query:
   def __iter__(self):
     return iter(self.pats)
 
+# the table (or the atoms) a flat pattern reads
+def pat_reads(pat: pattern.Pat) -> str:
+  match pat:
+    case pattern.AppPat(op, _, _):
+      return op
+    case _:
+      return ATOMS
+
+# The intermediate results of the sub-queries that several queries have in
+# common, for sharing them while matching a set of rules (see
+# EGraph.run_rules). The queries should be canonical (see Query.canonical).
+#
+# Rules apply their actions in between, so each result is stored with a stamp
+# of the egraph it came from (the versions of the tables its prefix reads, and
+# the number of unions so far), and only reused while the stamp still holds.
+class Shared:
+  def __init__(self, queries: list[Query]):
+    counts = collections.Counter()
+    for q in queries:
+      counts.update(set(q.prefixes()))
+    self.keys = {k for k, n in counts.items() if n > 1}
+    self.results = {} # key -> (stamp, substs)
+    self.hits = 0
+    self.stale = 0
+
 def parse(s: str) -> Query:
   ps = []
+  gs = []
   for l in s.splitlines():
     l = l.strip()
     if not l:
       continue
-    ps.append(pattern.parse(l))
-  return Query(ps)
+    if l.startswith("["):
+      gs.append(action.parse_expr(l))
+    else:
+      ps.append(pattern.parse(l))
+  return Query(ps, gs)
@@ -0,0 +1,108 @@
+# Performance regression gate
+#
+#   python3 regress.py [--baseline bench_baseline.json] [--repeat 7]
+#                      [--threshold 0.10] [--update]
+#
+# Runs the benchmark workloads from bench.py several times, and compares the
+# median time of every workload, generator and size against a stored baseline.
+# A benchmark counts as slower only when both of the following hold, so noise
+# alone should not fail the gate:
+#
+#   - its median is more than threshold (10% by default) above the baseline's
+#   - the difference in medians is larger than the IQR (interquartile range) of
+#     both the new and the baseline runs
+#
+# Prints a diff report with one line per benchmark, and exits with status 1 if
+# anything got significantly slower. With --update, it writes the new
+# statistics to the baseline file instead of comparing.
+#
+# Timings only compare across runs on the same machine, so regenerate the
+# baseline with --update when moving the gate to a different box.
+
+import argparse
+import json
+import statistics
+import sys
+import bench
+
+SIZES = [200, 400]
+
+def quartiles(xs: list[float]) -> tuple[float, float, float]:
+  if len(xs) == 1:
+    return xs[0], xs[0], xs[0]
+  q1, q2, q3 = statistics.quantiles(xs, n=4, method="inclusive")
+  return q1, q2, q3
+
+def measure(workloads, generators, sizes, repeat, seed=0) -> dict:
+  samples = {}
+  for _ in range(repeat):
+    for w in workloads:
+      for g in generators:
+        for n in sizes:
+          r = bench.run_one(w, g, n, seed)
+          samples.setdefault(f"{w}/{g}/{n}", []).append(r["seconds"])
+
+  res = {}
+  for key, xs in samples.items():
+    q1, med, q3 = quartiles(xs)
+    res[key] = {"median": med, "iqr": q3 - q1, "samples": xs}
+  return res
+
+# the verdict for one benchmark: "slower", "faster", "same", "new" or "missing"
+def verdict(new: dict | None, old: dict | None, threshold: float) -> str:
+  if old is None:
+    return "new"
+  if new is None:
+    return "missing"
+  diff = new["median"] - old["median"]
+  noise = max(new["iqr"], old["iqr"])
+  if abs(diff) <= noise or abs(diff) <= threshold * old["median"]:
+    return "same"
+  return "slower" if diff > 0 else "faster"
+
+def compare(new: dict, old: dict, threshold: float) -> list[tuple[str, str, float | None]]:
+  res = []
+  for key in sorted(new.keys() | old.keys()):
+    n, o = new.get(key), old.get(key)
+    ratio = n["median"] / o["median"] if n and o and o["median"] > 0 else None
+    res.append((key, verdict(n, o, threshold), ratio))
+  return res
+
+def report(f, rows, new: dict, old: dict):
+  f.write(f"{'benchmark':<28} {'baseline':>10} {'current':>10} {'change':>8}  verdict\n")
+  for key, v, ratio in rows:
+    base = f"{old[key]['median'] * 1000:.2f}ms" if key in old else "-"
+    cur = f"{new[key]['median'] * 1000:.2f}ms" if key in new else "-"
+    change = f"{(ratio - 1) * 100:+.1f}%" if ratio is not None else "-"
+    f.write(f"{key:<28} {base:>10} {cur:>10} {change:>8}  {v}\n")
+
+def main(argv=None) -> int:
+  ap = argparse.ArgumentParser(description="Compare benchmark timings against a stored baseline.")
+  ap.add_argument("--baseline", default="bench_baseline.json")
+  ap.add_argument("--repeat", default=7, type=int)
+  ap.add_argument("--threshold", default=0.10, type=float)
+  ap.add_argument("--update", action="store_true",
+                  help="write the new timings to the baseline instead of comparing")
+  args = ap.parse_args(argv)
+
+  sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * max(SIZES) + 100))
+  new = measure(list(bench.WORKLOADS), list(bench.GENERATORS), SIZES, args.repeat)
+
+  if args.update:
+    with open(args.baseline, "w") as f:
+      json.dump(new, f, indent=2)
+    print(f"wrote {len(new)} benchmarks to {args.baseline}")
+    return 0
+
+  with open(args.baseline) as f:
+    old = json.load(f)
+  rows = compare(new, old, args.threshold)
+  report(sys.stdout, rows, new, old)
+  slower = [key for key, v, _ in rows if v == "slower"]
+  if slower:
+    print(f"\n{len(slower)} benchmark(s) got slower: {', '.join(slower)}")
+    return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
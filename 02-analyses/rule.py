@@ -1,13 +1,46 @@
 import query
 import action
+import subst
+from action import ops as action_ops, rename as action_rename
 
+# Rules can match their query relationally (EGraph.query) or top-down
+# (EGraph.ematch). Both find the same substitutions on a rebuilt egraph, but
+# one can be much faster than the other depending on the query.
+MATCHERS = ["relational", "topdown"]
+
+# A rule with a match_limit applies its action to at most that many matches
+# per run, chosen by policy (see subst.Sample), so one explosive rule cannot
+# blow up an iteration. truncated counts the runs that hit the limit.
+#
+# reads are the tables the rule depends on: those its query matches against,
+# and (conservatively) every table its action mentions. EGraph.run_rules skips
+# a rule when none of them changed since its last run.
 class Rule:
-  def __init__(self, query, action):
+  def __init__(self, query, action, matcher="relational", match_limit=None, policy="first", seed=0):
     assert query.pvars().issuperset(action.pvars())
+    assert matcher in MATCHERS
+    assert policy in subst.POLICIES
     self.query = query
     self.action = action
+    self.matcher = matcher
+    self.match_limit = match_limit
+    self.policy = policy
+    self.seed = seed
+    self.truncated = 0
+    self.reads = query.reads() | action_ops(action)
+
+  # The rule in terms of its canonical query (see Query.canonical), so that it
+  # can use the results of shared sub-queries without renaming them. Also
+  # returns the canonical names of the variables from flattening.
+  def canonical(self):
+    if not hasattr(self, "canon"):
+      cq, names = self.query.canonical()
+      m = {v: c for c, v in names.items()}
+      a = action_rename(self.action, m)
+      self.canon = (cq, a, {m[v] for v in self.query.fresh})
+    return self.canon
 
-def parse(sq: str, sa: str) -> Rule:
+def parse(sq: str, sa: str, matcher="relational", **limits) -> Rule:
   q = query.parse(sq)
   a = action.parse(sa)
-  return Rule(q, a)
+  return Rule(q, a, matcher, **limits)
@@ -0,0 +1,124 @@
+# Rewrite rules for the arithmetic demo
+
+import rule
+
+neg_neg = rule.parse('''
+  (~ ?a) = ?root
+  (~ ?b) = ?a
+''', '''
+  ?b = ?root
+''')
+
+add_neg = rule.parse('''
+  (+ ?a ?nb) = ?root
+  (~ ?b) = ?nb
+''', '''
+  (- ?a ?b) = ?root
+''')
+
+sub_self = rule.parse('''
+  (- ?a ?a) = ?root
+''', '''
+  0 = ?root
+''')
+
+add_comm = rule.parse('''
+  (+ ?l ?r) = ?x
+''', '''
+  (+ ?r ?l) = ?x
+''')
+
+mul_comm = rule.parse('''
+  (* ?l ?r) = ?x
+''', '''
+  (* ?r ?l) = ?x
+''')
+
+add_assoc_lr = rule.parse('''
+  (+ ?a ?r) = ?root
+  (+ ?b ?c) = ?r
+''', '''
+  (+ (+ ?a ?b) ?c) = ?root
+''')
+
+mul_assoc_lr = rule.parse('''
+  (* ?a ?r) = ?root
+  (* ?b ?c) = ?r
+''', '''
+  (* (* ?a ?b) ?c) = ?root
+''')
+
+add_assoc_rl = rule.parse('''
+  (+ ?l ?c) = ?root
+  (+ ?a ?b) = ?l
+''', '''
+  (+ ?a (+ ?b ?c)) = ?root
+''')
+
+mul_assoc_rl = rule.parse('''
+  (* ?l ?c) = ?root
+  (* ?a ?b) = ?l
+''', '''
+  (* ?a (+ ?b ?c)) = ?root
+''')
+
+add_zero = rule.parse('''
+  (+ ?x 0) = ?root
+''', '''
+  ?x = ?root
+''')
+
+sub_zero = rule.parse('''
+  (- ?x 0) = ?root
+''', '''
+  ?x = ?root
+''')
+
+mul_zero = rule.parse('''
+  (* ?x 0) = ?root
+''', '''
+  0 = ?root
+''')
+
+mul_one = rule.parse('''
+  (* ?x 1) = ?root
+''', '''
+  ?x = ?root
+''')
+
+all_rules = [
+  neg_neg,
+  add_neg,
+  sub_self,
+  add_comm,
+  mul_comm,
+  add_assoc_lr,
+  mul_assoc_lr,
+  add_assoc_rl,
+  mul_assoc_rl,
+  add_zero,
+  mul_zero,
+  mul_one
+]
+
+nice_rules = [
+  neg_neg,
+  add_neg,
+  sub_self,
+  add_comm,
+  mul_comm,
+  add_zero,
+  mul_zero,
+  mul_one
+]
+
+# Nested versions of the associativity rules. These need no hand flattening,
+# and can be matched either relationally or top-down.
+
+def assoc_rules(matcher):
+  return [
+    rule.parse('(+ ?a (+ ?b ?c)) = ?root', '(+ (+ ?a ?b) ?c) = ?root', matcher),
+    rule.parse('(* ?a (* ?b ?c)) = ?root', '(* (* ?a ?b) ?c) = ?root', matcher),
+    rule.parse('(+ (+ ?a ?b) ?c) = ?root', '(+ ?a (+ ?b ?c)) = ?root', matcher),
+    rule.parse('(* (* ?a ?b) ?c) = ?root', '(* ?a (* ?b ?c)) = ?root', matcher),
+  ]
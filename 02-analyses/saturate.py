@@ -0,0 +1,200 @@
+# Saturation with Progress and Cancellation
+#
+# saturate(eg, rules) runs the rules and rebuilds, iteration after iteration,
+# until an iteration changes nothing (or after iters iterations). It is a
+# generator of Progress records, one after each rule searched, each rule
+# applied, and each rebuild round, so callers can watch a long run as it goes.
+# asaturate does the same as an async iterator, handing control back to the
+# event loop after every record.
+#
+# To stop a run, pass a Token and cancel it, or give it a timeout. The egraph
+# checks the token for every substitution it extends while matching (see
+# EGraph.matches), and saturate checks it between steps. Either way, the run
+# rebuilds (which is not cancellable) and ends with a "cancelled" record, so
+# the egraph is left consistent: some rules may have applied their actions in
+# the last iteration and others not, but everything applied is rebuilt. The
+# same happens when the caller stops iterating early.
+
+import asyncio
+import time
+from dataclasses import dataclass
+import stats
+
+class Cancelled(Exception):
+  pass
+
+class Token:
+  def __init__(self, timeout: float | None = None):
+    self.flag = False
+    self.deadline = None if timeout is None else time.monotonic() + timeout
+
+  def cancel(self):
+    self.flag = True
+
+  @property
+  def cancelled(self) -> bool:
+    if self.flag:
+      return True
+    return self.deadline is not None and time.monotonic() >= self.deadline
+
+  def check(self):
+    if self.cancelled:
+      raise Cancelled()
+
+# phase is one of "search", "apply" (for rule, an index into the rules),
+# "rebuild" (with the stats.Round), "done" or "cancelled"
+@dataclass
+class Progress:
+  iteration: int
+  phase: str
+  rule: int | None = None
+  matches: int = 0
+  round: stats.Round | None = None
+  enodes: int = 0
+  seconds: float = 0.0
+
+# changes whenever a table or the atoms change
+def versions(eg) -> tuple:
+  return (
+    eg.atom_version,
+    tuple(t.version for t in eg.atab.values()),
+    tuple(t.version for t in eg.ftab.values()),
+  )
+
+def saturate(eg, rs, iters=None, token=None):
+  start = time.perf_counter()
+  index = {id(r): i for i, r in enumerate(rs)}
+  i = 0
+  def progress(phase, r=None, matches=0, round=None):
+    enodes = sum(len(t.tab) for t in eg.atab.values())
+    rule = None if r is None else index[id(r)]
+    return Progress(i, phase, rule, matches, round, enodes, time.perf_counter() - start)
+
+  rebuilt = False
+  eg.token = token
+  try:
+    for round in eg.rebuild_steps():
+      yield progress("rebuild", round=round)
+    rebuilt = True
+
+    while iters is None or i < iters:
+      before = versions(eg)
+      rebuilt = False
+      for phase, r, substs in eg.rule_steps(rs):
+        yield progress(phase, r, len(substs.substs))
+        if token is not None:
+          token.check()
+      for round in eg.rebuild_steps():
+        yield progress("rebuild", round=round)
+      rebuilt = True
+      i += 1
+      if versions(eg) == before:
+        break
+    yield progress("done")
+
+  except Cancelled:
+    eg.token = None
+    for round in eg.rebuild_steps():
+      yield progress("rebuild", round=round)
+    rebuilt = True
+    yield progress("cancelled")
+
+  finally:
+    eg.token = None
+    # stopped early by the caller
+    if not rebuilt:
+      eg.rebuild()
+
+async def asaturate(eg, rs, iters=None, token=None):
+  steps = saturate(eg, rs, iters, token)
+  try:
+    for p in steps:
+      yield p
+      await asyncio.sleep(0)
+  finally:
+    steps.close()
+
+
+import unittest
+import egraph
+import query
+import rules
+
+def chain(eg, n):
+  e = "x0"
+  for i in range(1, n):
+    e = f"(+ x{i} {e})"
+  return eg.get_sexpr(e)
+
+class TestSaturate(unittest.TestCase):
+  def test_saturate(self):
+    eg = egraph.EGraph()
+    eg.get_sexpr("(* (+ x 0) 1)")
+    ps = list(saturate(eg, rules.nice_rules))
+    self.assertEqual(ps[-1].phase, "done")
+    self.assertTrue(eg.sequiv("(* (+ x 0) 1)", "x"))
+    phases = {p.phase for p in ps}
+    self.assertEqual(phases, {"search", "apply", "rebuild", "done"})
+    applied = [p for p in ps if p.phase == "apply" and p.iteration == 0]
+    self.assertEqual([p.rule for p in applied], list(range(len(rules.nice_rules))))
+
+  def test_iters(self):
+    eg = egraph.EGraph()
+    chain(eg, 6)
+    ps = list(saturate(eg, rules.assoc_rules("relational"), iters=2))
+    self.assertEqual(ps[-1].phase, "done")
+    self.assertEqual(ps[-1].iteration, 2)
+
+  def test_cancel(self):
+    eg = egraph.EGraph()
+    chain(eg, 8)
+    token = Token()
+    ps = []
+    for p in saturate(eg, rules.all_rules, token=token):
+      ps.append(p)
+      if p.phase == "apply" and p.iteration == 1:
+        token.cancel()
+    self.assertEqual(ps[-1].phase, "cancelled")
+    self.assertEqual(ps[-2].phase, "rebuild")
+    self.assertEqual(ps[-1].iteration, 1)
+    self.assertFalse(eg.is_dirty())
+    self.assertIsNone(eg.token)
+
+  def test_cancel_while_matching(self):
+    eg = egraph.EGraph()
+    chain(eg, 4)
+    eg.token = Token()
+    eg.token.cancel()
+    with self.assertRaises(Cancelled):
+      eg.query(query.parse("(+ ?a ?b) = ?r"))
+    with self.assertRaises(Cancelled):
+      eg.ematch(query.parse("(+ ?a (+ ?b ?c)) = ?r"))
+
+  def test_timeout(self):
+    eg = egraph.EGraph()
+    chain(eg, 8)
+    ps = list(saturate(eg, rules.all_rules, token=Token(timeout=0)))
+    # stopped during the first rule with anything to match
+    self.assertEqual(ps[-1].phase, "cancelled")
+    self.assertNotIn("apply", [p.phase for p in ps])
+    self.assertFalse(eg.is_dirty())
+
+  def test_stop_early(self):
+    eg = egraph.EGraph()
+    chain(eg, 8)
+    for p in saturate(eg, rules.all_rules):
+      if p.phase == "apply":
+        break
+    self.assertFalse(eg.is_dirty())
+
+  def test_async(self):
+    async def run():
+      eg = egraph.EGraph()
+      eg.get_sexpr("(* (+ x 0) 1)")
+      return [p async for p in asaturate(eg, rules.nice_rules)], eg
+    ps, eg = asyncio.run(run())
+    self.assertEqual(ps[-1].phase, "done")
+    self.assertTrue(eg.sequiv("(* (+ x 0) 1)", "x"))
+
+if __name__ == "__main__":
+  unittest.main()
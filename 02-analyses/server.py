@@ -0,0 +1,282 @@
+# EGraph Server
+#
+#   python3 server.py PATH [window_ms]
+#
+# Serves one egraph on the Unix socket PATH. Clients send one JSON request per
+# line and get one JSON response per line, in the same order:
+#
+#   {"op": "add", "expr": "(+ x 1)"}            -> {"id": 3}
+#   {"op": "equiv", "a": "(+ x 0)", "b": "x"}   -> {"equiv": false}
+#   {"op": "query", "query": "(+ ?a ?b) = ?r"}  -> {"matches": [{"?a": 0, ...}]}
+#   {"op": "extract", "id": 3}                  -> {"expr": "(+ x 1)"}
+#   {"op": "stats"}                             -> latency and batch metrics
+#
+# Bad requests get {"error": "..."} instead.
+#
+# Rebuilding after every add would make the server rebuild once per request.
+# Instead, requests that arrive within a short window of each other (2ms by
+# default) are handled as one batch: first all the adds, then a single
+# rebuild, then the queries (sharing their common sub-queries, see
+# query.Shared), the equivalence checks and the extractions, which all see
+# the egraph with every add of the batch. Extracting costs a sweep over the
+# whole egraph, so a batch does that at most once too.
+#
+# The server keeps the latency of recent requests (from arrival to response)
+# and the sizes of recent batches, and reports their percentiles for "stats".
+
+import asyncio
+import collections
+import json
+import sys
+import time
+import expr
+import query
+from egraph import EGraph
+
+class Server:
+  def __init__(self, eg=None, window=0.002, max_batch=1024):
+    self.eg = EGraph() if eg is None else eg
+    self.window = window
+    self.max_batch = max_batch
+    self.pending = asyncio.Queue()
+    self.latencies = collections.deque(maxlen=10000) # seconds
+    self.batch_sizes = collections.deque(maxlen=10000)
+    self.requests = 0
+    self.batches = 0
+
+  # Handle req with the next batch, returning its response.
+  async def submit(self, req: dict) -> dict:
+    if req.get("op") == "stats":
+      return self.stats()
+    fut = asyncio.get_running_loop().create_future()
+    await self.pending.put((req, fut, time.perf_counter()))
+    return await fut
+
+  # Collect requests into batches and run them, forever.
+  async def run(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      batch = [await self.pending.get()]
+      deadline = loop.time() + self.window
+      while len(batch) < self.max_batch:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+          break
+        try:
+          batch.append(await asyncio.wait_for(self.pending.get(), timeout))
+        except asyncio.TimeoutError:
+          break
+
+      # off the event loop, so that connections are served in the meantime
+      # (batches still run one at a time, so nothing else touches the egraph)
+      reqs = [req for req, _, _ in batch]
+      try:
+        results = await loop.run_in_executor(None, self.run_batch, reqs)
+      except Exception as e:
+        # keep serving, even if the egraph could not be rebuilt
+        results = [{"error": f"{type(e).__name__}: {e}"}] * len(batch)
+      for (_, fut, start), res in zip(batch, results):
+        if not fut.done():
+          fut.set_result(res)
+        self.latencies.append(time.perf_counter() - start)
+      self.batch_sizes.append(len(batch))
+      self.requests += len(batch)
+      self.batches += 1
+
+  # Errors only fail their own request, except when rebuilding fails.
+  def run_batch(self, reqs: list[dict]) -> list[dict]:
+    res = [None] * len(reqs)
+    def each(op, f):
+      for i, req in enumerate(reqs):
+        if res[i] is None and req.get("op") == op:
+          try:
+            res[i] = f(req)
+          except Exception as e:
+            res[i] = {"error": f"{type(e).__name__}: {e}"}
+
+    # all adds, then one rebuild
+    added = {}
+    def add(req):
+      added[id(req)] = self.eg.get_expr(expr.parse(req["expr"]))
+    each("add", add)
+    self.eg.rebuild()
+    each("add", lambda req: {"id": self.eg.uf.find(added[id(req)])})
+
+    # queries, sharing the sub-queries they have in common
+    qs = {}
+    def parse_query(req):
+      q = query.parse(req["query"])
+      q.canonical()
+      qs[id(req)] = q
+    each("query", parse_query)
+    shared = query.Shared([q.canonical()[0] for q in qs.values()])
+    def run_query(req):
+      substs = self.eg.query(qs[id(req)], shared=shared)
+      return {"matches": sorted((s.subst for s in substs), key=lambda s: sorted(s.items()))}
+    each("query", run_query)
+
+    each("equiv", lambda req: {"equiv": self.eg.sequiv(req["a"], req["b"])})
+
+    # the best terms of all eclasses, computed for the first extract
+    best = None
+    def extract(req):
+      nonlocal best
+      id = req["id"]
+      if type(id) is not int or not 0 <= id < len(self.eg.uf.parent):
+        raise ValueError(f"no eclass {id}")
+      if best is None:
+        best = self.eg.best_terms()
+      id = self.eg.uf.find(id)
+      if id not in best:
+        raise ValueError(f"no term to extract from eclass {id}")
+      return {"expr": str(best[id][1])}
+    each("extract", extract)
+
+    for i, req in enumerate(reqs):
+      if res[i] is None:
+        res[i] = {"error": f"unknown op {req.get('op')}"}
+    return res
+
+  def stats(self) -> dict:
+    return {
+      "requests": self.requests,
+      "batches": self.batches,
+      "latency_p50_ms": percentile(self.latencies, 50) * 1000,
+      "latency_p99_ms": percentile(self.latencies, 99) * 1000,
+      "batch_p50": percentile(self.batch_sizes, 50),
+      "batch_p99": percentile(self.batch_sizes, 99),
+      "batch_max": max(self.batch_sizes, default=0),
+    }
+
+  # one client connection: requests are handled concurrently (so they can land
+  # in the same batch), and responses are written in order
+  async def connection(self, reader, writer):
+    todo = asyncio.Queue()
+    async def respond():
+      while True:
+        task = await todo.get()
+        if task is None:
+          break
+        writer.write((json.dumps(await task) + "\n").encode())
+        await writer.drain()
+
+    responder = asyncio.create_task(respond())
+    async for line in reader:
+      if not line.strip():
+        continue
+      try:
+        req = json.loads(line)
+        if not isinstance(req, dict):
+          raise ValueError("requests must be JSON objects")
+      except ValueError as e:
+        fut = asyncio.get_running_loop().create_future()
+        fut.set_result({"error": f"bad request: {e}"})
+        await todo.put(fut)
+        continue
+      await todo.put(asyncio.create_task(self.submit(req)))
+    await todo.put(None)
+    await responder
+    writer.close()
+    await writer.wait_closed()
+
+  async def serve(self, path: str):
+    batcher = asyncio.create_task(self.run())
+    server = await asyncio.start_unix_server(self.connection, path)
+    try:
+      async with server:
+        await server.serve_forever()
+    finally:
+      batcher.cancel()
+
+def percentile(xs, p):
+  xs = sorted(xs)
+  if not xs:
+    return 0
+  return xs[min(len(xs) - 1, len(xs) * p // 100)]
+
+# Send reqs over one connection to the server at path, returning the responses.
+async def request(path: str, reqs: list[dict]) -> list[dict]:
+  reader, writer = await asyncio.open_unix_connection(path)
+  for req in reqs:
+    writer.write((json.dumps(req) + "\n").encode())
+  await writer.drain()
+  res = [json.loads(await reader.readline()) for _ in reqs]
+  writer.close()
+  await writer.wait_closed()
+  return res
+
+def main(path, window_ms="2"):
+  asyncio.run(Server(window=float(window_ms) / 1000).serve(path))
+
+
+import os
+import tempfile
+import unittest
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.dir.name, "eg.sock")
+    self.server = Server(window=0.05)
+    self.task = asyncio.create_task(self.server.serve(self.path))
+    while not os.path.exists(self.path):
+      await asyncio.sleep(0.001)
+
+  async def asyncTearDown(self):
+    self.task.cancel()
+    try:
+      await self.task
+    except asyncio.CancelledError:
+      pass
+    self.dir.cleanup()
+
+  async def test_requests(self):
+    res = await request(self.path, [
+      {"op": "add", "expr": "(+ x 1)"},
+      {"op": "add", "expr": "(+ y 1)"},
+      {"op": "query", "query": "(+ ?a 1) = ?r"},
+      {"op": "equiv", "a": "(+ x 1)", "b": "(+ y 1)"},
+      {"op": "frobnicate"},
+      {"op": "add", "expr": "(+ x"},
+    ])
+    x1 = res[0]["id"]
+    self.assertEqual(len(res[2]["matches"]), 2)
+    self.assertEqual(res[3], {"equiv": False})
+    self.assertIn("error", res[4])
+    self.assertIn("error", res[5])
+    res = await request(self.path, [
+      {"op": "extract", "id": x1},
+      {"op": "extract", "id": -1},
+      {"op": "extract", "id": 1000},
+      {"op": "extract", "id": "0"},
+    ])
+    self.assertEqual(res[0], {"expr": "(+ x 1)"})
+    for r in res[1:]:
+      self.assertIn("error", r)
+
+  async def test_errors_stay_per_request(self):
+    def fail(a, b):
+      raise RuntimeError("oops")
+    self.server.eg.sequiv = fail
+    res = await request(self.path, [
+      {"op": "add", "expr": "(+ x 1)"},
+      {"op": "equiv", "a": "x", "b": "y"},
+    ])
+    self.assertIn("id", res[0])
+    self.assertEqual(res[1], {"error": "RuntimeError: oops"})
+
+  async def test_batching(self):
+    clients = [request(self.path, [{"op": "add", "expr": f"(f x{i})"}]) for i in range(20)]
+    res = await asyncio.gather(*clients)
+    self.assertEqual(len({r[0]["id"] for r in res}), 20)
+    [stats] = await request(self.path, [{"op": "stats"}])
+    self.assertEqual(stats["requests"], 20)
+    self.assertLess(stats["batches"], 20)
+    self.assertGreater(stats["batch_max"], 1)
+    self.assertGreater(stats["latency_p99_ms"], 0)
+
+if __name__ == "__main__":
+  if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
+    main(*sys.argv[1:])
+  else:
+    unittest.main()
@@ -0,0 +1,182 @@
+# Sorts
+#
+# Every eclass has a sort. Datatype sorts (like Math in the egglog demos) are
+# declared with EGraph.add_sort, and operators get a signature with
+# EGraph.add_op, after which the egraph refuses to build ill-sorted enodes or
+# merge classes of different sorts. Atoms have primitive sorts given by their
+# Python type, so 1, 1.0 and True are three different atoms even though they
+# are equal (and hash the same) in Python.
+#
+# Sorts also prune matching. Before joining, a query's variables are given
+# sorts from the signatures of the operators they appear under. A variable
+# that would need two different sorts, or that is both an eclass and a
+# primitive value (say, the output of a function returning Rational), means
+# the query has no matches at all. Otherwise the sorts narrow the candidates:
+# rows of unsorted tables whose classes have the wrong sort are skipped, and
+# value patterns only look at the atoms of their sort.
+#
+# Operators without a signature and classes without a sort are unchecked.
+# Atoms always get their primitive sort, but merges are only checked once the
+# egraph declares a sort or a signature, so egraphs that never declare sorts
+# work as before.
+
+from dataclasses import dataclass
+from fractions import Fraction
+import pattern
+
+PRIM_SORTS = {
+  int: "i64",
+  float: "f64",
+  str: "String",
+  bool: "bool",
+  Fraction: "Rational",
+}
+
+def of_atom(a) -> str:
+  return PRIM_SORTS.get(type(a), type(a).__name__)
+
+def is_prim(s: str) -> bool:
+  return s in PRIM_SORTS.values()
+
+@dataclass(frozen=True, slots=True)
+class Signature:
+  args: tuple[str, ...]
+  out: str
+
+  def __str__(self):
+    return f"({' '.join(self.args)}) -> {self.out}"
+
+# The atom dictionary, split by sort: atom -> eclass within each sort.
+class Atoms:
+  def __init__(self):
+    self.sorts: dict[str, dict] = {}
+
+  def sort(self, s: str) -> dict:
+    return self.sorts.get(s, {})
+
+  def __contains__(self, a):
+    return a in self.sorts.get(of_atom(a), ())
+
+  def __getitem__(self, a):
+    try:
+      return self.sorts[of_atom(a)][a]
+    except KeyError:
+      raise KeyError(a)
+
+  def __setitem__(self, a, id):
+    self.sorts.setdefault(of_atom(a), {})[a] = id
+
+  def get(self, a, default=None):
+    return self.sorts.get(of_atom(a), {}).get(a, default)
+
+  def items(self):
+    for atoms in self.sorts.values():
+      yield from atoms.items()
+
+  def __iter__(self):
+    for atoms in self.sorts.values():
+      yield from atoms
+
+  def __len__(self):
+    return sum(len(atoms) for atoms in self.sorts.values())
+
+# The sort of each eclass, keyed by leader and kept up to date by registering
+# with the union-find.
+class Classes:
+  def __init__(self, uf):
+    self.uf = uf
+    self.sort: dict[int, str] = {}
+    uf.watchers.append(self)
+
+  def get(self, id: int) -> str | None:
+    return self.sort.get(self.uf.find(id))
+
+  def set(self, id: int, s: str):
+    id = self.uf.find(id)
+    old = self.sort.get(id)
+    if old is not None and old != s:
+      raise TypeError(f"eclass {id} has sort {old}, not {s}")
+    self.sort[id] = s
+
+  def check(self, id: int, s: str):
+    old = self.get(id)
+    if old is not None and old != s:
+      raise TypeError(f"expected sort {s} for eclass {id}, found {old}")
+
+  def check_union(self, id1: int, id2: int):
+    s1, s2 = self.get(id1), self.get(id2)
+    if s1 is not None and s2 is not None and s1 != s2:
+      raise TypeError(f"cannot merge eclasses of sorts {s1} and {s2}")
+
+  # called by the union-find whenever loser is absorbed by winner
+  def merge(self, winner: int, loser: int):
+    s = self.sort.pop(loser, None)
+    if s is not None:
+      self.sort.setdefault(winner, s)
+
+# Infer the sorts of the variables in flat patterns. Returns a dictionary of
+# variable -> (sort, is_value), or None if no assignment of sorts fits.
+def infer(pats, sigs: dict[str, Signature], values=()) -> dict | None:
+  res = {}
+
+  def assign(v, s, is_value=False):
+    if v is None or s is None:
+      return True
+    old = res.setdefault(v, (s, is_value))
+    return old == (s, is_value)
+
+  for pat in pats:
+    match pat:
+      case pattern.AtomPat(a, vres):
+        ok = assign(vres, of_atom(a))
+      case pattern.ValPat(vval, vres):
+        # the value has the sort of its atom's class, if that is known
+        ok = True
+        if vres in res:
+          ok = assign(vval, res[vres][0], True)
+      case pattern.AppPat(op, vargs, vres) if op in sigs:
+        sig = sigs[op]
+        if len(sig.args) != len(vargs):
+          return None
+        ok = all(assign(v, s) for v, s in zip(vargs, sig.args))
+        # primitive outputs of functions are values, not eclasses
+        ok = ok and assign(vres, sig.out, op in values)
+      case _:
+        ok = True
+    if not ok:
+      return None
+  return res
+
+
+import unittest
+
+class TestSort(unittest.TestCase):
+  def test_atoms_typed(self):
+    atoms = Atoms()
+    atoms[1] = 0
+    atoms[1.0] = 1
+    atoms[True] = 2
+    self.assertEqual([atoms[1], atoms[1.0], atoms[True]], [0, 1, 2])
+    self.assertEqual(len(atoms), 3)
+    self.assertNotIn(2, atoms)
+    self.assertEqual(atoms.sort("f64"), {1.0: 1})
+    self.assertEqual(sorted(atoms.items(), key=str), [(1, 0), (1.0, 1), (True, 2)])
+
+  def test_infer(self):
+    sigs = {
+      "Num": Signature(("Rational",), "Math"),
+      "Add": Signature(("Math", "Math"), "Math"),
+      "lo": Signature(("Math",), "Rational"),
+    }
+    pats = [pattern.parse("(Add ?a ?b) = ?e"), pattern.parse("(lo ?a) = ?x")]
+    self.assertEqual(infer(pats, sigs, {"lo"}), {
+      "?a": ("Math", False), "?b": ("Math", False), "?e": ("Math", False),
+      "?x": ("Rational", True),
+    })
+    # a function value is not an atom class
+    pats.append(pattern.parse("(Num ?x) = ?n"))
+    self.assertIsNone(infer(pats, sigs, {"lo"}))
+    self.assertIsNone(infer([pattern.parse("(Add ?r ?b) = ?e"), pattern.parse("(Num ?r) = ?n")], sigs))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,85 @@
+# Rebuild Statistics
+#
+# What each call to EGraph.rebuild did, round by round, to check that the cost
+# of rebuilding follows the changes since the last rebuild rather than the size
+# of the egraph. The egraph keeps the statistics of its last rebuild in
+# eg.rebuild_stats (rebuild also returns them), and to_json turns them into
+# plain dicts and lists.
+
+from dataclasses import dataclass, field, asdict
+
+# one round of rebuilding one table
+@dataclass
+class TableRound:
+  rows: int = 0    # rows re-hashed (each row of the table is, once per round)
+  changed: int = 0 # rows whose key or value was not canonical
+  unions: int = 0  # congruence unions: rows that collided with another row
+                   # under a different class and merged the two
+  repairs: int = 0 # function values changed by repairing a collision
+
+@dataclass
+class Round:
+  seconds: float = 0.0
+  atoms: int = 0 # atoms moved to their new leader
+  apps: dict[str, TableRound] = field(default_factory=dict) # by operator
+  funs: dict[str, TableRound] = field(default_factory=dict) # by function
+
+  def tables(self):
+    return list(self.apps.values()) + list(self.funs.values())
+
+@dataclass
+class RebuildStats:
+  rounds: list[Round] = field(default_factory=list)
+
+  @property
+  def seconds(self) -> float:
+    return sum(r.seconds for r in self.rounds)
+
+  @property
+  def rows(self) -> int:
+    return sum(t.rows for r in self.rounds for t in r.tables())
+
+  @property
+  def changed(self) -> int:
+    return sum(t.changed for r in self.rounds for t in r.tables())
+
+  @property
+  def unions(self) -> int:
+    return sum(t.unions for r in self.rounds for t in r.tables())
+
+  @property
+  def repairs(self) -> int:
+    return sum(t.repairs for r in self.rounds for t in r.tables())
+
+  def to_json(self) -> dict:
+    return {
+      "rounds": [asdict(r) for r in self.rounds],
+      "seconds": self.seconds,
+      "rows": self.rows,
+      "changed": self.changed,
+      "unions": self.unions,
+      "repairs": self.repairs,
+    }
+
+
+import json
+import unittest
+
+class TestStats(unittest.TestCase):
+  def test_totals(self):
+    s = RebuildStats([
+      Round(0.5, 1, {"+": TableRound(4, 2, 1)}, {"lo": TableRound(2, 1, 0, 1)}),
+      Round(0.25, 0, {"+": TableRound(3)}, {"lo": TableRound(2)}),
+    ])
+    self.assertEqual(s.seconds, 0.75)
+    self.assertEqual(s.rows, 11)
+    self.assertEqual((s.changed, s.unions, s.repairs), (3, 1, 1))
+
+  def test_to_json(self):
+    s = RebuildStats([Round(0.5, 1, {"+": TableRound(4, 2, 1)})])
+    d = json.loads(json.dumps(s.to_json()))
+    self.assertEqual(d["rounds"][0]["apps"]["+"]["unions"], 1)
+    self.assertEqual(d["unions"], 1)
+
+if __name__ == "__main__":
+  unittest.main()
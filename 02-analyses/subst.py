@@ -1,4 +1,7 @@
+import heapq
+import random
 import unittest
+import zlib
 
 # Substitutions bind query pattern variables (strings) to eclass ids (ints).
 #
@@ -13,8 +16,13 @@ import unittest
 #
 # We want to be able to chain bindings, so we also have a special "bogus" value
 # that represents a failed binding.
+#
+# Matching allocates substitutions by the million, so they have slots instead of
+# an instance dict, and compare their cached hashes before their bindings.
 
 class Subst:
+  __slots__ = ("subst", "_hash")
+
   def __init__(self, subst: dict[str, int]):
     self.subst = subst
     self._hash = hash(frozenset(subst.items()))
@@ -44,11 +52,15 @@ class Subst:
     return self._hash
 
   def __eq__(self, other):
+    if self is other:
+      return True
     if isinstance(other, Subst):
-      return self.subst == other.subst
+      return self._hash == other._hash and self.subst == other.subst
     return False
 
 class Bogus:
+  __slots__ = ()
+
   def __init__(self):
     pass
 
@@ -72,6 +84,8 @@ _bogus = Bogus()
 # sets of substitutions
 # filters out any bogus additions
 class Set:
+  __slots__ = ("substs",)
+
   def __init__(self):
     self.substs = set()
 
@@ -88,6 +102,71 @@ class Set:
   def __iter__(self):
     return iter(self.substs)
 
+# Sets of at most limit substitutions, for rules with a match limit. Which
+# substitutions are kept depends on the policy:
+#
+#   first      the first limit added; add raises Full after that, so matching
+#              can stop early
+#   reservoir  a uniform random sample of everything added (Algorithm R), drawn
+#              with a generator seeded by seed
+#   seeded     the limit substitutions with the smallest seeded checksum, which
+#              does not depend on the order they are added in
+#
+# truncated records whether anything was left out.
+POLICIES = ["first", "reservoir", "seeded"]
+
+class Full(Exception):
+  pass
+
+class Sample(Set):
+  __slots__ = ("limit", "policy", "seed", "truncated", "seen", "rng", "kept")
+
+  def __init__(self, limit: int, policy="first", seed=0):
+    if limit <= 0:
+      raise ValueError(f"match limit must be positive, not {limit}")
+    assert policy in POLICIES
+    super().__init__()
+    self.limit = limit
+    self.policy = policy
+    self.seed = seed
+    self.truncated = False
+    self.seen = 0
+    self.rng = random.Random(seed)
+    self.kept = [] # reservoir: the sample in order, seeded: a heap
+
+  def key(self, s):
+    return zlib.crc32(f"{self.seed}:{sorted(s.subst.items())}".encode())
+
+  def add(self, s):
+    if not isinstance(s, Subst) or s in self.substs:
+      return
+    if len(self.substs) < self.limit:
+      self.substs.add(s)
+      self.seen += 1
+      if self.policy == "reservoir":
+        self.kept.append(s)
+      elif self.policy == "seeded":
+        heapq.heappush(self.kept, (-self.key(s), len(self.kept), s))
+      return
+
+    self.truncated = True
+    self.seen += 1
+    match self.policy:
+      case "first":
+        raise Full()
+      case "reservoir":
+        i = self.rng.randrange(self.seen)
+        if i < self.limit:
+          self.substs.discard(self.kept[i])
+          self.kept[i] = s
+          self.substs.add(s)
+      case "seeded":
+        k = self.key(s)
+        if k < -self.kept[0][0]:
+          _, _, old = heapq.heapreplace(self.kept, (-k, self.seen, s))
+          self.substs.discard(old)
+          self.substs.add(s)
+
 
 class TestSubst(unittest.TestCase):
   def test_empty_subst(self):
@@ -97,6 +176,13 @@ class TestSubst(unittest.TestCase):
     self.assertEqual(str(subst), "{}")
     self.assertEqual(repr(subst), "{}")
 
+  def test_compact(self):
+    s = Subst({"x": 1})
+    self.assertFalse(hasattr(s, "__dict__"))
+    self.assertFalse(hasattr(Sample(1), "__dict__"))
+    self.assertEqual(s, Subst({"x": 1}))
+    self.assertNotEqual(s, Subst({"x": 2}))
+
   def test_bind_new_var(self):
     subst = Subst({})
     new_subst = subst.bind("x", 1)
@@ -169,5 +255,48 @@ class TestSet(unittest.TestCase):
     ss.add(subst2)
     self.assertEqual(len(ss.substs), 2)
 
+class TestSample(unittest.TestCase):
+  def substs(self, n):
+    return [Subst({"x": i}) for i in range(n)]
+
+  def test_first(self):
+    ss = Sample(3)
+    with self.assertRaises(Full):
+      for s in self.substs(10):
+        ss.add(s)
+    self.assertEqual(ss.substs, set(self.substs(3)))
+    self.assertTrue(ss.truncated)
+
+  def test_not_truncated(self):
+    for policy in POLICIES:
+      ss = Sample(3, policy)
+      for s in self.substs(3) + self.substs(3) + [_bogus]:
+        ss.add(s)
+      self.assertEqual(ss.substs, set(self.substs(3)), policy)
+      self.assertFalse(ss.truncated, policy)
+
+  def test_reservoir(self):
+    ss = Sample(5, "reservoir")
+    for s in self.substs(100):
+      ss.add(s)
+    self.assertEqual(len(ss.substs), 5)
+    self.assertTrue(ss.truncated)
+    self.assertTrue(ss.substs <= set(self.substs(100)))
+    # the same seed keeps the same sample
+    again = Sample(5, "reservoir")
+    for s in self.substs(100):
+      again.add(s)
+    self.assertEqual(again.substs, ss.substs)
+
+  def test_seeded(self):
+    # the same sample, whatever the order
+    a, b = Sample(5, "seeded", 7), Sample(5, "seeded", 7)
+    for s in self.substs(100):
+      a.add(s)
+    for s in reversed(self.substs(100)):
+      b.add(s)
+    self.assertEqual(a.substs, b.substs)
+    self.assertEqual(len(a.substs), 5)
+
 if __name__ == "__main__":
   unittest.main()
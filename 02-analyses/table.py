@@ -6,90 +6,258 @@
 # congruence closure. However, merges from other tables may implicitly
 # invalidate the functional dependency, so we need to periodically rebuild the
 # table by canonicallizing all eclass ids and adding everything back.
+#
+# Each table also counts versions: version goes up whenever a row is added or
+# changed, including by rebuilding, so rules can tell whether their inputs
+# changed since they last ran.
+#
+# Rebuilding a table returns what it did as a stats.TableRound.
+
+import io
+import stats
 
 class AppTab:
-  def __init__(self, uf):
+  __slots__ = ("uf", "tab", "version", "op", "index")
+
+  def __init__(self, uf, op=None, index=None):
     self.uf = uf
     self.tab: dict[tuple[int, ...], int] = {}
+    self.version = 0
+
+    # optional class index to keep in sync (see index.py)
+    self.op = op
+    self.index = index
 
   def __str__(self):
-    res = ""
-    for ids, id in sorted(self.tab.items()):
+    f = io.StringIO()
+    self.dump(f)
+    return f.getvalue()
+
+  def rows(self, sort=True):
+    # sorting needs a list of every row, so huge dumps can ask for table order
+    if sort:
+      return sorted(self.tab.items())
+    return self.tab.items()
+
+  def dump(self, f, sort=True):
+    # stream rows to f instead of building one big string
+    for ids, id in self.rows(sort):
       sids = "\t".join(str(i) for i in ids)
-      res += f"{sids}\t->\t{id}\n"
-    return res
+      f.write(f"{sids}\t->\t{id}\n")
 
   def get(self, ids: tuple[int, ...]) -> int:
     # if necessary, add a new enode
     if ids not in self.tab:
       self.tab[ids] = self.uf.mkset()
+      self.version += 1
+      if self.index is not None:
+        self.index.add(self.op, ids, self.tab[ids])
     return self.tab[ids]
 
   def set(self, ids: tuple[int, ...], id: int) -> int:
     if ids in self.tab:
       # restore functional dependency by merging
       # NOTE: uf tracks dirty flag if anything changes
+      # NOTE: the index follows the union, the row itself is already there
       id = self.uf.union(self.tab[ids], id)
+      if id != self.tab[ids]:
+        self.version += 1
+    else:
+      self.version += 1
+      if self.index is not None:
+        self.index.add(self.op, ids, id)
     self.tab[ids] = id
     return id
 
   # one iteration of rebuilding
   # the egraph will repeat this until nothing changes
-  def rebuild(self):
+  def rebuild(self) -> stats.TableRound:
     # save and reset
     old = self.tab
     self.tab = {}
 
-    # add canonicalized enodes back to the table
-    for ids, id in old.items():
-      ids = tuple(self.uf.find(i) for i in ids)
-      id = self.uf.find(id)
+    # forget the old keys before any canonical key is indexed, otherwise a row
+    # that was already canonical could be dropped after another was moved onto it
+    if self.index is not None:
+      for ids, id in old.items():
+        self.index.remove(self.op, ids, id)
+
+    # add canonicalized enodes back to the table, which is a new version only
+    # if some row actually changed
+    version = self.version
+    res = stats.TableRound(rows=len(old))
+    for old_ids, old_id in old.items():
+      ids = tuple(self.uf.find(i) for i in old_ids)
+      id = self.uf.find(old_id)
+      if ids != old_ids or id != old_id:
+        res.changed += 1
+      if ids in self.tab and self.uf.find(self.tab[ids]) != id:
+        res.unions += 1
       self.set(ids, id)
+    self.version = version + (res.changed > 0)
+    return res
+
+# Built-in repair (merge) kinds, matching the :merge options of the egglog demos.
+# Tables that use one of these can repair all collisions of a rebuild at once
+# with a single C-level reduction per key, instead of calling back into Python
+# for every colliding row. The builtins max and min are recognized as well.
+MERGES = {
+  "max": max,
+  "min": min,
+  "new": lambda old, new: new,
+}
 
+# Function outputs are either primitive values, repaired by the merge
+# function, or eclasses (repair is "union"). Eclass outputs are canonicalized
+# and merged through the union-find, so colliding rows are congruent, like rows
+# of an AppTab.
 class FunTab:
+  # name and events are only set on traced tables (see events.py)
+  __slots__ = ("uf", "kind", "repair", "dirty", "tab", "version", "name", "events")
+
   def __init__(self, uf, repair):
     self.uf = uf
+    self.kind = None
+    if repair == "union":
+      self.kind = repair
+      repair = uf.union
+    elif isinstance(repair, str):
+      self.kind = repair
+      repair = MERGES[repair]
+    elif repair is max or repair is min:
+      self.kind = repair.__name__
     self.repair = repair
     self.dirty = False
     self.tab: dict[tuple[int, ...], int | float] = {}
+    self.version = 0
 
   def __str__(self):
-    res = ""
-    for ids, id in sorted(self.tab.items()):
+    f = io.StringIO()
+    self.dump(f)
+    return f.getvalue()
+
+  def rows(self, sort=True):
+    if sort:
+      return sorted(self.tab.items())
+    return self.tab.items()
+
+  def dump(self, f, sort=True):
+    for ids, res in self.rows(sort):
       sids = "\t".join(str(i) for i in ids)
-      res += f"{sids}\t->\t{id}\n"
-    return res
+      f.write(f"{sids}\t->\t{res}\n")
+
+  @property
+  def eclass(self) -> bool:
+    return self.kind == "union"
 
   def get(self, ids: tuple[int, ...]) -> int | float:
     # unlike AppTab, get can fail!
     try:
-      return self.tab[ids]
+      res = self.tab[ids]
     except KeyError:
       raise ValueError(f"no function table entry for {ids}")
+    return self.uf.find(res) if self.eclass else res
 
   def set(self, ids: tuple[int, ...], res: int) -> int | float:
-    if ids in self.tab:
+    if ids in self.tab and self.eclass:
+      # the union-find tracks whether anything changed
+      res = self.uf.union(self.tab[ids], res)
+    elif ids in self.tab:
       # restore functional dependency by repairing
       # NOTE: track dirty flag for rebuilding if anything changes
       old_res = self.tab[ids]
       new_res = self.repair(old_res, res)
       if new_res != old_res:
         self.dirty = True
+        self.repaired(ids, old_res, new_res)
       res = new_res
+    if ids not in self.tab or self.tab[ids] != res:
+      self.version += 1
     self.tab[ids] = res
     return res
 
+  # called whenever repairing changes the value for ids, a hook for
+  # events.TracedFunTab
+  def repaired(self, ids, old, new):
+    pass
+
   # one iteration of rebuilding
   # the egraph will repeat this until nothing changes
-  def rebuild(self):
+  def rebuild(self) -> stats.TableRound:
+    if self.kind is not None:
+      return self.rebuild_grouped()
+
     # save and reset
     old = self.tab
     self.tab = {}
 
     # add canonicalized enodes back to the table
-    for ids, res in old.items():
-      ids = tuple(self.uf.find(i) for i in ids)
-      self.set(ids, res)
+    version = self.version
+    res = stats.TableRound(rows=len(old))
+    for old_ids, val in old.items():
+      ids = tuple(self.uf.find(i) for i in old_ids)
+      if ids != old_ids:
+        res.changed += 1
+      prev = self.tab.get(ids)
+      if self.set(ids, val) != prev and prev is not None:
+        res.repairs += 1
+    self.version = version + (self.tab != old)
+    return res
+
+  # Rebuilding for built-in merge kinds: canonicalize every key in bulk, gather
+  # the values of colliding keys into groups, then reduce each group at once.
+  # This leaves the same values and dirty flag as repairing one row at a time.
+  def rebuild_grouped(self) -> stats.TableRound:
+    # for big tables, one pass over the union-find beats a find per id
+    if len(self.tab) * 4 >= len(self.uf.parent):
+      find = self.uf.leaders().__getitem__
+    else:
+      find = self.uf.find
+    old = self.tab
+    self.tab = {}
+    st = stats.TableRound(rows=len(old))
+
+    groups = {}
+    for old_ids, res in old.items():
+      ids = tuple(map(find, old_ids))
+      if ids != old_ids or (self.eclass and find(res) != res):
+        st.changed += 1
+      if self.eclass:
+        res = find(res)
+      if ids in self.tab:
+        if ids in groups:
+          groups[ids].append(res)
+        else:
+          groups[ids] = [self.tab[ids], res]
+      else:
+        self.tab[ids] = res
+
+    for ids, vals in groups.items():
+      if self.eclass:
+        # congruence: the outputs for equal arguments are equal
+        res = vals[0]
+        for val in vals[1:]:
+          if self.uf.find(res) != self.uf.find(val):
+            st.unions += 1
+          res = self.uf.union(res, val)
+        self.tab[ids] = res
+        continue
+      if self.kind == "new":
+        res = vals[-1]
+        differs = vals.count(vals[0]) != len(vals)
+      else:
+        res = self.repair(vals)
+        differs = res != vals[0]
+      if differs:
+        self.dirty = True
+        st.repairs += 1
+        self.repaired(ids, vals[0], res)
+      self.tab[ids] = res
+
+    # colliding keys changed too, so there are no groups without a change
+    if st.changed:
+      self.version += 1
+    return st
 
 
 import unittest
@@ -158,6 +326,150 @@ class TestAppTab(unittest.TestCase):
     t.rebuild()
     self.assertEqual(t.uf.find(ec0), t.uf.find(ec1)) # check congruence closure
 
+class TestFunTab(unittest.TestCase):
+  def setUp(self):
+    self.uf = uf.UF()
+    for _ in range(4):
+      self.uf.mkset()
+
+  def test_set_repairs(self):
+    t = FunTab(self.uf, "max")
+    t.set((0,), 1)
+    t.set((0,), 0)
+    self.assertFalse(t.dirty)
+    t.set((0,), 3)
+    self.assertTrue(t.dirty)
+    self.assertEqual(t.get((0,)), 3)
+
+  def test_builtin_kinds(self):
+    self.assertEqual(FunTab(self.uf, max).kind, "max")
+    self.assertEqual(FunTab(self.uf, "new").kind, "new")
+    self.assertIsNone(FunTab(self.uf, lambda old, new: old + new).kind)
+
+  def test_rebuild_grouped(self):
+    for kind, res, dirty in [
+      ("max", 5, True),
+      ("min", 2, False),
+      ("new", 4, True),
+    ]:
+      t = FunTab(uf.UF(), kind)
+      for _ in range(4):
+        t.uf.mkset()
+      t.set((0, 3), 2)
+      t.set((1, 3), 5)
+      t.set((2, 3), 4)
+      t.set((3, 3), 1)
+      t.uf.union(0, 1)
+      t.uf.union(0, 2)
+      t.rebuild()
+      self.assertEqual(t.tab, {(0, 3): res, (3, 3): 1}, kind)
+      self.assertEqual(t.dirty, dirty, kind)
+
+  def test_rebuild_grouped_matches_callable(self):
+    # the same collisions repaired one at a time by an opaque function
+    for kind in MERGES:
+      ts = [FunTab(uf.UF(), kind), FunTab(uf.UF(), lambda o, n, k=kind: MERGES[k](o, n))]
+      for t in ts:
+        for _ in range(6):
+          t.uf.mkset()
+        for i, v in enumerate([3, 1, 4, 1, 5, 9]):
+          t.set((i,), v)
+        t.uf.union(0, 1)
+        t.uf.union(2, 3)
+        t.uf.union(0, 3)
+        t.rebuild()
+      self.assertEqual(ts[0].tab, ts[1].tab, kind)
+      self.assertEqual(ts[0].dirty, ts[1].dirty, kind)
+
+  def test_eclass_outputs(self):
+    t = FunTab(self.uf, "union")
+    self.assertTrue(t.eclass)
+    t.set((0,), 2)
+    t.set((1,), 3)
+    self.uf.union(0, 1)
+    t.rebuild()
+    # the outputs of the colliding rows are unioned, not repaired
+    self.assertEqual(self.uf.find(2), self.uf.find(3))
+    self.assertEqual(t.tab, {(0,): 2})
+    self.assertTrue(self.uf.dirty)
+    self.assertFalse(t.dirty)
+
+  def test_eclass_outputs_canonical(self):
+    t = FunTab(self.uf, "union")
+    t.set((0,), 3)
+    self.uf.union(2, 3)
+    self.assertEqual(t.get((0,)), 2)
+    t.rebuild()
+    self.assertEqual(t.tab, {(0,): 2})
+    t.set((0,), 1)
+    self.assertEqual(self.uf.find(2), 1)
+
+class TestVersions(unittest.TestCase):
+  def setUp(self):
+    self.uf = uf.UF()
+    for _ in range(4):
+      self.uf.mkset()
+
+  def test_apptab(self):
+    t = AppTab(self.uf)
+    t.get((0,))
+    t.get((1,))
+    t.get((0,))
+    self.assertEqual(t.version, 2)
+    t.rebuild()
+    self.assertEqual(t.version, 2)
+    self.uf.union(0, 1)
+    t.rebuild()
+    self.assertEqual(t.version, 3)
+
+  def test_funtab(self):
+    for kind in ["max", "union", lambda old, new: max(old, new)]:
+      t = FunTab(uf.UF(), kind)
+      for _ in range(4):
+        t.uf.mkset()
+      t.set((2,), 3)
+      t.set((2,), 3)
+      self.assertEqual(t.version, 1)
+      t.rebuild()
+      self.assertEqual(t.version, 1)
+      t.uf.union(2, 3)
+      t.rebuild()
+      self.assertEqual(t.version, 2 if kind == "union" else 1)
+
+class TestRebuildStats(unittest.TestCase):
+  def setUp(self):
+    self.uf = uf.UF()
+    for _ in range(4):
+      self.uf.mkset()
+
+  def test_apptab(self):
+    t = AppTab(self.uf)
+    t.get((0,))
+    t.get((1,))
+    t.get((2,))
+    self.uf.union(0, 1)
+    self.assertEqual(t.rebuild(), stats.TableRound(rows=3, changed=1, unions=1))
+    self.assertEqual(t.rebuild(), stats.TableRound(rows=2))
+
+  def test_funtab(self):
+    for kind in ["max", lambda old, new: max(old, new)]:
+      t = FunTab(uf.UF(), kind)
+      for _ in range(4):
+        t.uf.mkset()
+      t.set((0,), 1)
+      t.set((1,), 5)
+      t.set((2,), 3)
+      t.uf.union(0, 1)
+      t.uf.union(2, 3)
+      self.assertEqual(t.rebuild(), stats.TableRound(rows=3, changed=1, repairs=1))
+
+  def test_funtab_eclass(self):
+    t = FunTab(self.uf, "union")
+    t.set((0,), 2)
+    t.set((1,), 3)
+    self.uf.union(0, 1)
+    self.assertEqual(t.rebuild(), stats.TableRound(rows=2, changed=1, unions=1))
+
 if __name__ == "__main__":
   unittest.main()
 
@@ -3,10 +3,20 @@
 import unittest
 
 class UF:
+  __slots__ = ("parent", "dirty", "unions", "watchers")
+
   def __init__(self):
     self.parent: list[int] = []
     self.dirty: bool = False
 
+    # how many unions merged two sets so far, so that cached matches can tell
+    # whether classes have merged since they were computed
+    self.unions: int = 0
+
+    # structures keyed by leader ids (like the class index) need to know when
+    # one leader is absorbed by another, see merge(winner, loser)
+    self.watchers: list = []
+
   def mkset(self) -> int:
     # allocate a fresh new id (set) at the end
     id = len(self.parent)
@@ -26,6 +36,15 @@ class UF:
     self.parent[id] = leader
     return leader
 
+  # The leader of every id, in one pass over the parent list. Since unions
+  # always keep the lower id as leader, each parent comes before its children,
+  # so by the time we reach an id, the leader of its parent is already known.
+  def leaders(self) -> list[int]:
+    res = self.parent.copy()
+    for id, p in enumerate(res):
+      res[id] = res[p]
+    return res
+
   def union(self, id1: int, id2: int) -> int:
     l1 = self.find(id1)
     l2 = self.find(id2)
@@ -36,15 +55,19 @@ class UF:
 
     # during rebuilding we will need to know if anything changed
     self.dirty = True
+    self.unions += 1
 
     # pick the lower id as "winner" -- not optimial, but simple
     # could also use "union by rank" or "union by size"
     if l1 <= l2:
-      self.parent[l2] = l1
-      return l1
+      winner, loser = l1, l2
     else:
-      self.parent[l1] = l2
-      return l2
+      winner, loser = l2, l1
+    self.parent[loser] = winner
+
+    for w in self.watchers:
+      w.merge(winner, loser)
+    return winner
 
 class TestUF(unittest.TestCase):
   def test_mkset(self):
@@ -84,6 +107,33 @@ class TestUF(unittest.TestCase):
     self.assertEqual(leader, uf.find(id1))
     self.assertEqual(leader, uf.find(id2))
 
+  def test_leaders(self):
+    uf = UF()
+    for _ in range(6):
+      uf.mkset()
+    uf.union(4, 5)
+    uf.union(2, 4)
+    uf.union(3, 1)
+    uf.union(0, 5)
+    self.assertEqual(uf.leaders(), [uf.find(i) for i in range(6)])
+    self.assertEqual(uf.leaders(), [0, 1, 0, 1, 0, 0])
+
+  def test_watchers(self):
+    class Log:
+      def __init__(self):
+        self.merges = []
+      def merge(self, winner, loser):
+        self.merges.append((winner, loser))
+
+    uf = UF()
+    log = Log()
+    uf.watchers.append(log)
+    id0 = uf.mkset()
+    id1 = uf.mkset()
+    uf.union(id1, id0)
+    uf.union(id0, id1) # already merged, no notification
+    self.assertEqual(log.merges, [(id0, id1)])
+
 if __name__ == "__main__":
 
   print("\n# SAMPLE USAGE")